@@ -0,0 +1,94 @@
+"""
+Runs the benchmark suite (see benchmarks/suite.py).
+
+    python -m benchmarks [--quick] [--filter PATTERN] [--save results.json] [--compare previous.json]
+
+Results are printed as a table and can be saved as JSON. When compared with a previous run,
+benchmarks that got slower by more than --threshold are reported and the exit code is 1.
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import platform
+import sys
+
+from .suite import get_benchmarks
+
+
+def run(args):
+    results = {}
+    print('{0:<48} {1:>14} {2:>14}  {3}'.format('benchmark', 'min', 'median', 'unit'))
+    for benchmark, unit in get_benchmarks(quick=args.quick):
+        if args.filter and not any(fnmatch.fnmatch(benchmark.name, pattern) for pattern in args.filter):
+            continue
+
+        result = benchmark.run(repeat=args.repeat)
+        result['unit'] = unit
+        results[benchmark.name] = result
+        print('{0:<48} {1:>14.3f} {2:>14.3f}  {3}'.format(
+            benchmark.name, result['min'] * 1e6, result['median'] * 1e6, unit
+        ))
+        sys.stdout.flush()
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+
+
+def compare(report, previous, threshold):
+    """Print the relative changes of the results. Return the names of regressed benchmarks."""
+    regressions = []
+    print()
+    print('{0:<48} {1:>14} {2:>14} {3:>9}'.format('benchmark', 'previous', 'current', 'change'))
+    for name, result in sorted(report['results'].items()):
+        previous_result = previous['results'].get(name)
+        if previous_result is None:
+            continue
+
+        change = result['min'] / previous_result['min'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{0:<48} {1:>14.3f} {2:>14.3f} {3:>+8.1%}{4}'.format(
+            name, previous_result['min'] * 1e6, result['min'] * 1e6, change, flag
+        ))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller inputs and fewer iterations')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements per benchmark (the best one counts)')
+    parser.add_argument('--filter', action='append', help='glob pattern of benchmark names to run (repeatable)')
+    parser.add_argument('--save', metavar='PATH', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='compare with results saved by a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(report, results_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+
+        regressions = compare(report, previous, args.threshold)
+        if regressions:
+            print('\n{0} benchmark(s) regressed by more than {1:.0%}'.format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Load test for the session server: many clients connect concurrently to a server
+running in a separate process, run a few commands each and disconnect.
+Reports sessions per second and command latency percentiles.
+
+Run with:  python -m benchmarks.server_load [--sessions N] [--concurrency N] [--commands N] [--tcp]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from pymander.contexts import StandardPrompt
+from pymander.server import run_server
+
+
+PROMPT = b'>>> '
+
+
+def serve(address):
+    host, port, path = address
+    run_server(StandardPrompt(), host=host, port=port, path=path)
+
+
+async def connect(address):
+    host, port, path = address
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+
+    return await asyncio.open_connection(host, port)
+
+
+async def run_session(address, command_count, latencies):
+    reader, writer = await connect(address)
+    await reader.readuntil(PROMPT)
+    for index in range(command_count):
+        start = time.perf_counter()
+        writer.write('echo {0}\n'.format(index).encode())
+        await reader.readuntil(PROMPT)
+        latencies.append(time.perf_counter() - start)
+
+    writer.write(b'exit\n')
+    await reader.read()
+    writer.close()
+
+
+async def run_sessions(address, session_count, concurrency, command_count, latencies):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited_session():
+        async with slots:
+            await run_session(address, command_count, latencies)
+
+    await asyncio.gather(*[limited_session() for _ in range(session_count)])
+
+
+async def wait_for_server(address):
+    for _ in range(100):
+        try:
+            reader, writer = await connect(address)
+        except OSError:
+            await asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+
+    raise RuntimeError('The server did not start')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--commands', type=int, default=10)
+    parser.add_argument('--tcp', action='store_true', help='use TCP on localhost instead of a Unix socket')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.tcp:
+            address = ('127.0.0.1', 17077, None)
+        else:
+            address = (None, None, os.path.join(tmp_dir, 'pymander.sock'))
+
+        server_process = multiprocessing.Process(target=serve, args=(address,), daemon=True)
+        server_process.start()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(wait_for_server(address))
+            latencies = []
+            start = time.perf_counter()
+            loop.run_until_complete(run_sessions(address, args.sessions, args.concurrency, args.commands, latencies))
+            duration = time.perf_counter() - start
+        finally:
+            loop.close()
+            server_process.terminate()
+            server_process.join()
+
+    print('{0:>24} {1:>12}'.format('sessions', args.sessions))
+    print('{0:>24} {1:>12}'.format('concurrent sessions', args.concurrency))
+    print('{0:>24} {1:>12.0f}'.format('sessions per sec', args.sessions / duration))
+    print('{0:>24} {1:>12.0f}'.format('commands per sec', len(latencies) / duration))
+    print('{0:>24} {1:>12.3f}'.format('p50 latency, ms', percentile(latencies, 0.5) * 1000))
+    print('{0:>24} {1:>12.3f}'.format('p99 latency, ms', percentile(latencies, 0.99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,514 @@
+"""
+Benchmarks of the hot paths of the handler/context/commander stack, run by `python -m benchmarks`.
+
+Every benchmark measures the time of a single operation (a dispatched line, a constructed context,
+a command executed by a commander, a megabyte of pasted JSON) and has a stable dotted name,
+so results of different runs can be compared.
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import statistics
+import tempfile
+import threading
+import timeit
+
+from pymander.commander import Commander
+from pymander.contexts import CommandContext, MultiLineContext, PrebuiltCommandContext, StandardPrompt, JsonContext, \
+    OUTPUT_UNBUFFERED, OUTPUT_LINE_BUFFERED, OUTPUT_BUFFERED
+from pymander.handlers import NO_MATCH, RegexLineHandler, ExactLineHandler, ArgparseLineHandler, FastArgparseLineHandler
+from pymander.decorators import bind_command, bind_exact
+from pymander.reader import ChunkedLineReader
+from pymander.protocol import MachineCommander
+from pymander.server import CommanderServer
+
+
+__all__ = ('Benchmark', 'get_benchmarks')
+
+
+class Benchmark:
+    """
+    func is called number times per measurement; ops is the number of operations
+    performed by a single call (the result is the time per operation).
+    setup, if given, is called before every measurement.
+    """
+    def __init__(self, name, func, number=1, ops=1, setup=None):
+        self.name = name
+        self.func = func
+        self.number = number
+        self.ops = ops
+        self.setup = setup
+
+    def run(self, repeat=5):
+        times = []
+        for _ in range(repeat):
+            if self.setup is not None:
+                self.setup()
+            times.append(timeit.timeit(self.func, number=self.number) / self.number / self.ops)
+
+        return {'min': min(times), 'median': statistics.median(times), 'repeat': repeat}
+
+
+class NullStream:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BenchmarkContext(CommandContext):
+    def prompt(self):
+        pass
+
+    def on_cant_execute(self, line):
+        pass
+
+
+HANDLER_TYPES = (
+    # name, base class, pattern of the line bound to the command with the given index
+    ('regex', RegexLineHandler, r'regex{0} (?P<arg>\w+)', 'regex{0} foo'),
+    ('exact', ExactLineHandler, 'exact{0} foo', 'exact{0} foo'),
+    ('argparse', ArgparseLineHandler, 'argparse{0}', 'argparse{0} foo'),
+    ('fast_argparse', FastArgparseLineHandler, 'fast{0}', 'fast{0} foo'),
+)
+
+
+def make_handler_class(base, pattern, command_count):
+    namespace = {}
+    for index in range(command_count):
+        if issubclass(base, ArgparseLineHandler):
+            def command(self, arg):
+                pass
+
+            decorator = bind_command(pattern.format(index), [['arg']])
+        else:
+            def command(self, arg=None):
+                pass
+
+            decorator = bind_command(pattern.format(index))
+
+        namespace['command_{0:04d}'.format(index)] = decorator(command)
+
+    return type('{0}{1}'.format(base.__name__, command_count), (base,), namespace)
+
+
+def make_protocol_handler_class(base, pattern, command_count):
+    """Like make_handler_class, but the last command is bound to a method named last_command (see protocol_benchmarks)."""
+    last_pattern = pattern.format(command_count - 1)
+    bind_args = (last_pattern, [['arg']]) if issubclass(base, ArgparseLineHandler) else (last_pattern,)
+
+    class ProtocolLineHandler(make_handler_class(base, pattern, command_count - 1)):
+        @bind_command(*bind_args)
+        def last_command(self, arg=None):
+            pass
+
+    return ProtocolLineHandler
+
+
+def make_prebuilt_context_class(command_count):
+    namespace = {}
+    for index in range(command_count):
+        def command(self):
+            pass
+
+        namespace['command_{0:04d}'.format(index)] = bind_exact('command{0}'.format(index))(command)
+
+    return type('PrebuiltContext{0}'.format(command_count), (PrebuiltCommandContext, BenchmarkContext), namespace)
+
+
+def dispatch_benchmarks(quick):
+    for command_count in (10, 100) if quick else (10, 100, 1000):
+        for name, base, pattern, line_pattern in HANDLER_TYPES:
+            context = BenchmarkContext([make_handler_class(base, pattern, command_count)()])
+            context.set_out_stream(NullStream())
+            lines = (
+                ('first', line_pattern.format(0)),
+                ('last', line_pattern.format(command_count - 1)),
+                ('miss', 'qwerty foo'),
+            )
+            for label, line in lines:
+                context.execute(line)  # warm up the lazily built structures
+                yield Benchmark(
+                    'dispatch.{0}.{1}.{2}'.format(name, command_count, label),
+                    lambda context=context, line=line: context.execute(line),
+                    number=200 if quick else 1000,
+                )
+
+            # repeated lines with the parse cache
+            cached_context = BenchmarkContext([make_handler_class(base, pattern, command_count)()])
+            cached_context.set_out_stream(NullStream())
+            cached_context.enable_parse_cache()
+            line = line_pattern.format(command_count - 1)
+            yield Benchmark(
+                'dispatch_cached.{0}.{1}.last'.format(name, command_count),
+                lambda context=cached_context, line=line: context.execute(line),
+                number=200 if quick else 1000,
+            )
+
+
+def sequential_regex_dispatch(handler, line):
+    """Dispatch like RegexLineHandler did before the combined regex: re.match for every pattern in turn."""
+    for command_info in handler.command_methods:
+        match = re.match(command_info['args'][0], line)
+        if match:
+            return command_info['method'](handler, **match.groupdict())
+
+    return NO_MATCH
+
+
+def sequential_dispatch_benchmarks(quick):
+    # the reference for dispatch.regex.*
+    for command_count in (10, 100) if quick else (10, 100, 1000):
+        handler = make_handler_class(RegexLineHandler, r'regex{0} (?P<arg>\w+)', command_count)()
+        lines = (('first', 'regex0 foo'), ('last', 'regex{0} foo'.format(command_count - 1)), ('miss', 'qwerty foo'))
+        for label, line in lines:
+            yield Benchmark(
+                'dispatch_sequential.regex.{0}.{1}'.format(command_count, label),
+                lambda handler=handler, line=line: sequential_regex_dispatch(handler, line),
+                number=200 if quick else 1000,
+            )
+
+
+def handler_count_benchmarks(quick):
+    # the number of handlers in a context (with 10 commands each), for handlers with and without keywords
+    handler_kinds = (
+        ('keyword', r'regex{0}_{{0}} (?P<arg>\w+)', 'regex{0}_9 foo'),
+        ('wildcard', r'(?P<arg>\w+) wild{0}_{{0}}', 'foo wild{0}_9'),
+    )
+    for handler_count in (1, 10, 100):
+        for kind, pattern, line_pattern in handler_kinds:
+            context = BenchmarkContext([
+                make_handler_class(RegexLineHandler, pattern.format(index), 10)() for index in range(handler_count)
+            ])
+            context.set_out_stream(NullStream())
+            line = line_pattern.format(handler_count - 1)
+            context.execute(line)
+            yield Benchmark(
+                'handlers.{0}.{1}.last'.format(kind, handler_count),
+                lambda context=context, line=line: context.execute(line),
+                number=200 if quick else 1000,
+            )
+
+
+ARGPARSE_OPTIONS = [
+    'name',
+    ['count', {'type': int, 'nargs': '?', 'default': 1}],
+    ['--format', '-f', {'dest': 'text_format', 'default': 'plain', 'choices': ['plain', 'json']}],
+    ['--verbose', '-v', {'action': 'store_true'}],
+]
+
+
+def make_argparse_handler_class(base, command_count):
+    namespace = {}
+    for index in range(command_count):
+        def command(self, name, count, text_format, verbose):
+            pass
+
+        namespace['command_{0:04d}'.format(index)] = bind_command('cmd{0}'.format(index), ARGPARSE_OPTIONS)(command)
+
+    return type('{0}Options{1}'.format(base.__name__, command_count), (base,), namespace)
+
+
+def argparse_benchmarks(quick):
+    # a command with positional arguments, types, choices and flags
+    line = 'cmd0 foo 3 -f json --verbose'
+    for command_count in (1, 10, 100):
+        for name, base in (('argparse', ArgparseLineHandler), ('fast_argparse', FastArgparseLineHandler)):
+            handler_class = make_argparse_handler_class(base, command_count)
+            handler = handler_class()
+            handler.set_context(BenchmarkContext())
+            handler.dispatch(line)
+            yield Benchmark(
+                'argparse.{0}.{1}.parse'.format(name, command_count),
+                lambda handler=handler: handler.dispatch(line),
+                number=500 if quick else 5000,
+            )
+
+            def construct_and_parse(handler_class=handler_class):
+                new_handler = handler_class()
+                new_handler.set_context(BenchmarkContext())
+                new_handler.dispatch(line)
+
+            yield Benchmark(
+                'argparse.{0}.{1}.construct_and_parse'.format(name, command_count), construct_and_parse,
+                number=max(10, (200 if quick else 2000) // command_count),
+            )
+
+
+def ordering_benchmarks(quick):
+    # a frequent command behind handlers that might accept any line
+    for label, reorder_interval in (('fixed', None), ('adaptive', 100)):
+        handlers = [
+            make_handler_class(RegexLineHandler, r'(?P<arg>\d+) wild{0}_{{0}}'.format(index), 10)()
+            for index in range(10)
+        ]
+        exact_handler_class = make_handler_class(ExactLineHandler, 'exact{0} foo', 10)
+        handlers.append(type('Exclusive' + exact_handler_class.__name__, (exact_handler_class,), {'exclusive': True})())
+        context_class = type('ReorderingContext', (BenchmarkContext,), {'reorder_interval': reorder_interval})
+        context = context_class(handlers)
+        context.set_out_stream(NullStream())
+        for _ in range(100):
+            context.execute('exact9 foo')  # warm up (and reorder)
+        yield Benchmark(
+            'ordering.{0}.10_wildcards.last'.format(label),
+            lambda context=context: context.execute('exact9 foo'),
+            number=200 if quick else 1000,
+        )
+
+
+def construction_benchmarks(quick):
+    for command_count in (0, 10, 100):
+        handler_classes = [
+            make_handler_class(base, pattern, command_count) for _, base, pattern, _ in HANDLER_TYPES
+        ]
+        yield Benchmark(
+            'construct.standard_prompt.{0}'.format(command_count),
+            lambda handler_classes=handler_classes: StandardPrompt(
+                [handler_class() for handler_class in handler_classes]
+            ),
+            number=500 if quick else 2000,
+        )
+
+        context_class = make_prebuilt_context_class(command_count)
+        context_class()  # generate the handler classes
+        yield Benchmark(
+            'construct.prebuilt_context.{0}'.format(command_count),
+            context_class, number=500 if quick else 2000,
+        )
+
+        prototype = context_class()
+        yield Benchmark(
+            'construct.prebuilt_context_clone.{0}'.format(command_count),
+            prototype.clone, number=500 if quick else 2000,
+        )
+
+
+def commander_benchmarks(quick):
+    command_count = 2000 if quick else 20000
+    script = 'echo hello\n' * (command_count - 1) + 'exit\n'
+
+    def mainloop():
+        Commander(StandardPrompt(), in_stream=io.StringIO(script), out_stream=io.StringIO()).mainloop()
+
+    def run_script():
+        Commander(StandardPrompt(), in_stream=io.StringIO(script), out_stream=io.StringIO()).run_script()
+
+    def run_script_buffered():
+        Commander(
+            StandardPrompt(), in_stream=io.StringIO(script), out_stream=io.StringIO(), output_policy=OUTPUT_BUFFERED,
+        ).run_script()
+
+    yield Benchmark('commander.mainloop', mainloop, ops=command_count)
+    yield Benchmark('commander.run_script', run_script, ops=command_count)
+    yield Benchmark('commander.run_script_buffered', run_script_buffered, ops=command_count)
+
+
+class CountingPipeStream:
+    """Text stream writing to a pipe that is drained by a thread."""
+    def __init__(self):
+        read_fd, write_fd = os.pipe()
+        self.stream = os.fdopen(write_fd, 'w')
+        self.reader = threading.Thread(target=self.drain, args=(read_fd,))
+        self.reader.start()
+
+    @staticmethod
+    def drain(read_fd):
+        while os.read(read_fd, 1 << 16):
+            pass
+        os.close(read_fd)
+
+    def write(self, text):
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+        self.reader.join()
+
+
+def output_benchmarks(quick):
+    # bulk output written to a pipe with every output policy
+    line_count = 20000 if quick else 200000
+    line = 'some output of a command that writes a lot\n'
+    for output_policy in (OUTPUT_UNBUFFERED, OUTPUT_LINE_BUFFERED, OUTPUT_BUFFERED):
+        def write_lines(output_policy=output_policy):
+            out_stream = CountingPipeStream()
+            context = StandardPrompt()
+            context.set_out_stream(out_stream)
+            context.set_output_policy(output_policy)
+            write = context.write
+            for _ in range(line_count):
+                write(line)
+            context.flush()
+            out_stream.close()
+
+        yield Benchmark('output.{0}'.format(output_policy), write_lines, ops=line_count)
+
+
+def make_json_lines(size):
+    record = json.dumps({'name': 'item', 'tags': ['a', 'b', 'c'], 'value': 12345.678})
+    return [record + '\n'] * (size // (len(record) + 1))
+
+
+def json_benchmarks(quick):
+    size_mb = 1 if quick else 4
+    records = make_json_lines(size_mb * 1024 * 1024)
+    document_lines = ['[\n'] + [record.replace('\n', ',\n') for record in records] + ['null\n', ']\n', '\n', '\n']
+    json_lines = records + ['\n', '\n']
+
+    def paste(lines, **context_kwargs):
+        context = JsonContext(**context_kwargs)
+        context.set_out_stream(NullStream())
+        execute = context.execute
+        try:
+            for line in lines:
+                execute(line)
+        except Exception:
+            pass  # exits after the input
+
+    yield Benchmark('json.document', lambda: paste(document_lines), ops=size_mb)
+    yield Benchmark('json.document_incremental', lambda: paste(document_lines, incremental=True), ops=size_mb)
+    yield Benchmark('json.json_lines', lambda: paste(json_lines, json_lines=True), ops=size_mb)
+
+
+class TextContext(MultiLineContext):
+    FinishedHandler = MultiLineContext.OverOn2EmptyLines
+
+    def prompt(self):
+        pass
+
+    def on_cant_execute(self, line):
+        pass
+
+    def on_finished(self):
+        self.text = self.buffer
+        self.exit()
+
+
+def multiline_benchmarks(quick):
+    # generic multi-line input, buffered until two empty lines
+    size_mb = 1 if quick else 4
+    lines = ['x' * 63 + '\n'] * (size_mb * 1024 * 1024 // 64) + ['\n', '\n']
+
+    def paste(**context_kwargs):
+        context = TextContext(**context_kwargs)
+        context.set_out_stream(NullStream())
+        execute = context.execute
+        try:
+            for line in lines:
+                execute(line)
+        except Exception:
+            pass  # exits after the input
+
+    yield Benchmark('multiline.paste', paste, ops=size_mb)
+    yield Benchmark('multiline.paste_limited', lambda: paste(max_buffer_size=size_mb * 2 * 1024 * 1024), ops=size_mb)
+
+
+def input_benchmarks(quick):
+    line_count = 100000 if quick else 1000000
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as input_file:
+        input_file.write(('x' * 60 + '\n') * line_count)
+
+    def read(make_reader):
+        with open(input_file.name) as in_stream:
+            readline = make_reader(in_stream).readline
+            while readline():
+                pass
+
+    try:
+        yield Benchmark('input.readline', lambda: read(lambda stream: stream), ops=line_count)
+        yield Benchmark('input.chunked', lambda: read(ChunkedLineReader), ops=line_count)
+        yield Benchmark(
+            'input.chunked_background', lambda: read(lambda stream: ChunkedLineReader(stream, background=True)),
+            ops=line_count,
+        )
+    finally:
+        os.remove(input_file.name)
+
+
+def protocol_benchmarks(quick):
+    request_count = 2000 if quick else 20000
+    for name, base, pattern, line in HANDLER_TYPES:
+        handler_class = make_protocol_handler_class(base, pattern, 100)
+        line_requests = json.dumps({'id': 1, 'line': line.format(99)}) + '\n'
+        command_requests = json.dumps({'id': 1, 'command': 'last_command', 'kwargs': {'arg': 'foo'}}) + '\n'
+
+        def run(requests, handler_class=handler_class):
+            MachineCommander(
+                BenchmarkContext([handler_class()]), in_stream=io.StringIO(requests * request_count),
+                out_stream=NullStream(),
+            ).mainloop()
+
+        yield Benchmark('protocol.line.{0}.100.last'.format(name), lambda run=run, requests=line_requests: run(requests),
+                        ops=request_count)
+        yield Benchmark(
+            'protocol.command.{0}.100.last'.format(name), lambda run=run, requests=command_requests: run(requests),
+            ops=request_count,
+        )
+
+
+async def run_server_sessions(path, session_count, command_count):
+    server = CommanderServer(StandardPrompt())
+    await server.start(path=path)
+
+    async def session():
+        reader, writer = await asyncio.open_unix_connection(path)
+        await reader.readuntil(b'>>> ')
+        for index in range(command_count):
+            writer.write('echo {0}\n'.format(index).encode())
+            await reader.readuntil(b'>>> ')
+        writer.write(b'exit\n')
+        await reader.read()
+        writer.close()
+
+    try:
+        await asyncio.gather(*[session() for _ in range(session_count)])
+    finally:
+        server.close()
+        await server.server.wait_closed()
+
+
+def server_benchmarks(quick):
+    # concurrent sessions over a Unix socket, with the clients in the same event loop
+    session_count = 50 if quick else 500
+    command_count = 10
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'benchmark.sock')
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(run_server_sessions(path, session_count, command_count))
+            finally:
+                loop.close()
+
+        yield Benchmark('server.sessions', serve, ops=session_count * command_count)
+
+
+BENCHMARK_GROUPS = (
+    ('dispatch', dispatch_benchmarks, 'us per line'),
+    ('dispatch_sequential', sequential_dispatch_benchmarks, 'us per line'),
+    ('handlers', handler_count_benchmarks, 'us per line'),
+    ('argparse', argparse_benchmarks, 'us per line'),
+    ('ordering', ordering_benchmarks, 'us per line'),
+    ('construct', construction_benchmarks, 'us per context'),
+    ('commander', commander_benchmarks, 'us per command'),
+    ('output', output_benchmarks, 'us per line'),
+    ('json', json_benchmarks, 'us per MB'),
+    ('multiline', multiline_benchmarks, 'us per MB'),
+    ('input', input_benchmarks, 'us per line'),
+    ('protocol', protocol_benchmarks, 'us per request'),
+    ('server', server_benchmarks, 'us per command'),
+)
+
+
+def get_benchmarks(quick=False):
+    """Yield (benchmark, unit) pairs of all benchmarks."""
+    for _, group, unit in BENCHMARK_GROUPS:
+        for benchmark in group(quick):
+            yield benchmark, unit
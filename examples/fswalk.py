@@ -18,7 +18,7 @@ class FileWriterContext(MultiLineContext):
         self.exit()
 
     def prompt(self):
-        self.write('... ')
+        self.write_prompt('... ')
 
     def on_cant_execute(self, line):
         pass
@@ -38,7 +38,8 @@ class FsContext(PrebuiltCommandContext, StandardPrompt):
 
         self.current_dir = full_dirname
 
-    @bind_regex('^ls(\s+(?P<dirname>\w+))?')
+    # the listing is cached for a few seconds or until another command (e.g. cd or mkdir) is run
+    @bind_regex(r'^ls(\s+(?P<dirname>\w+))?', cache=True, cache_ttl=5)
     def ls(self, dirname):
         if dirname:
             full_dirname = os.path.abspath(os.path.join(self.current_dir, dirname))
@@ -46,14 +47,16 @@ class FsContext(PrebuiltCommandContext, StandardPrompt):
             full_dirname = self.current_dir
 
         if not os.path.exists(full_dirname):
-            self.write('No such dir: {0}\n'.format(dirname))
+            yield 'No such dir: {0}\n'.format(dirname)
             return
 
         if not os.path.isdir(full_dirname):
-            self.write('{0}\n'.format(dirname))
+            yield '{0}\n'.format(dirname)
             return
 
-        self.write('{0}\n'.format('\n'.join(sorted(os.listdir(full_dirname)))))
+        # the names are streamed as they are yielded, without joining them into one string
+        for name in sorted(os.listdir(full_dirname)):
+            yield '{0}\n'.format(name)
 
     @bind_argparse('mkdir', ['dirname'])
     def mkdir(self, dirname):
@@ -83,7 +86,7 @@ class FsContext(PrebuiltCommandContext, StandardPrompt):
         return FileWriterContext(callback=save_to_file)
 
     def prompt(self):
-        self.write('@ {0} > '.format(os.path.basename(self.current_dir)))
+        self.write_prompt('@ {0} > '.format(os.path.basename(self.current_dir)))
 
 
 if __name__ == '__main__':
@@ -2,62 +2,270 @@ import abc
 import argparse
 import inspect
 import re
+import types
 
 from .exceptions import CantParseLine, SkipExecution
+from .patterns import CombinedRegex, literal_first_token
+from .fastargs import FALLBACK, NotCompilable, CompiledCommand
+from .line import Line
 
 
 __all__ = (
-    'LineHandler', 'RegexLineHandler', 'ExactLineHandler', 'ArgparseLineHandler',
+    'NO_MATCH', 'LineHandler', 'CommandLineHandler', 'RegexLineHandler', 'ExactLineHandler',
+    'ArgparseLineHandler', 'FastArgparseLineHandler',
 )
 
 
+class _NoMatch:
+    """Type of the NO_MATCH sentinel."""
+    def __repr__(self):
+        return 'NO_MATCH'
+
+    def __bool__(self):
+        return False
+
+
+# returned by LineHandler.dispatch if the handler doesn't accept the line
+NO_MATCH = _NoMatch()
+
+
+def _collect_commands(handler_class):
+    """Return the read-only registry of the commands bound to a handler class (see LineHandler.command_registry)."""
+    return tuple(
+        types.MappingProxyType({'method': method, 'args': method._args, 'kwargs': method._kwargs})
+        for _, method in inspect.getmembers(handler_class, predicate=inspect.isfunction)
+        if getattr(method, '_bound_command', False)
+    )
+
+
 class LineHandler(metaclass=abc.ABCMeta):
+    # the commands bound to the class, collected once when the class is created
+    # and shared by all of its instances as command_methods
+    command_registry = ()
+    # True if the handler always resolves a line the same way without side effects,
+    # so the results can be cached (see CommandContext.enable_parse_cache)
+    deterministic = False
+    # True if the handler makes use of Line attributes, so the context should pass it lines
+    # as Line objects (see pymander.line)
+    accepts_line = False
+    # ordering constraints for contexts that reorder their handlers by use (see CommandContext.reorder_handlers):
+    # a pinned handler is never moved and no handler is moved past it, a handler is never moved past
+    # instances of the classes in conflicts_with (or the other way around), and an exclusive handler
+    # declares that no other handler of its context accepts the lines it accepts
+    pinned = False
+    conflicts_with = ()
+    exclusive = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.command_registry = _collect_commands(cls)
+
     def __init__(self):
         self.context = None
-        self.command_methods = []
-        methods = inspect.getmembers(self.__class__, predicate=inspect.isfunction)
-        for method_tuple in methods:
-            method = method_tuple[1]
-            if getattr(method, '_bound_command', False):
-                self.command_methods.append(
-                    {'method': method, 'args': method._args, 'kwargs': method._kwargs}
-                )
+        self.command_methods = self.command_registry
 
     def set_context(self, context):
         self.context = context
 
+    def get_keywords(self):
+        """
+        Return the set of first tokens (words) of the lines this handler can accept
+        ('' stands for an empty line) or None if it might accept any line.
+        Used by command contexts to route lines only to the handlers that could accept them.
+        """
+        return None
+
     @abc.abstractmethod
     def try_execute(self, line):
         """Try to parse and execute a command. Must raise CantParseLine if the command is unacceptable"""
         raise NotImplementedError
 
+    def dispatch(self, line):
+        """
+        Try to parse and execute a command.
+        Same as try_execute, but returns NO_MATCH instead of raising CantParseLine.
+        This default implementation wraps try_execute, so handlers that only implement
+        the exception-based protocol keep working.
+        """
+        try:
+            return self.try_execute(line)
+
+        except CantParseLine:
+            return NO_MATCH
+
     def clone(self):
         return self.__class__()
 
 
-class RegexLineHandler(LineHandler):
-    """Interprets commands via matching to regular expressions."""
+class CommandLineHandler(LineHandler):
+    """
+    Base class for handlers that match lines to their bound commands natively,
+    without raising CantParseLine for lines they don't accept.
+    Subclasses implement resolve instead of try_execute.
+    """
+
+    def __init__(self):
+        super().__init__()
+        if self.__class__.try_execute is not CommandLineHandler.try_execute:
+            # a subclass has customized the exception-based protocol, so it must be used
+            self.dispatch = self._dispatch_via_try_execute
+
+    @abc.abstractmethod
+    def resolve(self, line):
+        """
+        Parse a line without executing it.
+        Return a (command_info, kwargs) tuple or NO_MATCH if the line is unacceptable.
+        command_info is None if the line has been fully handled while parsing (e.g. help was printed).
+        """
+        raise NotImplementedError
+
+    def invoke(self, command_info, kwargs):
+        """
+        Execute a command returned by resolve.
+        Unless the command is idempotent (see the bind_* decorators), the cached results
+        of the commands of the context are forgotten, as the command may change them.
+        """
+        if command_info is None:
+            return None
+
+        method = command_info['method']
+        result_cache = getattr(self.context, 'result_cache', None)
+        if result_cache and not getattr(method, '_idempotent', False):
+            result_cache.clear()
+
+        return method(self, **kwargs)
+
+    def is_deterministic(self, command_info):
+        """
+        Whether a line resolved to the command always resolves to the same arguments, so that the result
+        of resolving it can be cached (see CommandContext.enable_parse_cache). Only asked if the handler
+        is deterministic. A command can opt out (or in) with deterministic=False (True) in its bind_* options.
+        """
+        return command_info['kwargs'].get('deterministic', True)
+
+    def get_default_kwargs(self, command_info):
+        """
+        Return the arguments a command gets when they are not given in the line (see get_command):
+        invoking a command with them updated by some arguments is like executing a line with those arguments.
+        """
+        return {}
+
+    def dispatch(self, line):
+        resolved = self.resolve(line)
+        if resolved is NO_MATCH:
+            return NO_MATCH
+
+        return self.invoke(*resolved)
+
+    def _dispatch_via_try_execute(self, line):
+        return LineHandler.dispatch(self, line)
+
+    def matches_only_bound_commands(self, handler_class):
+        """
+        Whether lines are matched by the stock resolve of handler_class alone, so that the patterns
+        of the bound commands tell which lines the handler accepts (see get_keywords).
+        Subclasses that customize try_execute, dispatch or resolve (e.g. to add aliases) might accept any line.
+        """
+        cls = self.__class__
+        return (
+            cls.try_execute is CommandLineHandler.try_execute and cls.dispatch is CommandLineHandler.dispatch
+            and cls.resolve is handler_class.resolve and 'dispatch' not in self.__dict__
+        )
 
     def try_execute(self, line):
-        for command_info in self.command_methods:
-            expr = command_info['args'][0]
-            match = re.match(expr, line)
-            if match:
-                return command_info['method'](self, **match.groupdict())
+        result = CommandLineHandler.dispatch(self, line)
+        if result is NO_MATCH:
+            raise CantParseLine(line)
+
+        return result
+
+
+class RegexLineHandler(CommandLineHandler):
+    """
+    Interprets commands via matching to regular expressions.
+
+    All expressions of a handler class are compiled once into a combined regex per first token
+    (see pymander.patterns.CombinedRegex), so a line is matched in one pass against the expressions
+    it might match, regardless of the number of other commands.
+    """
+    deterministic = True
+
+    def get_combined_regex(self):
+        """Return the combined regex of the handler class (it is compiled on first use)."""
+        handler_class = self.__class__
+        combined_regex = handler_class.__dict__.get('_combined_regex')
+        if combined_regex is None:
+            combined_regex = CombinedRegex(
+                command_info['args'][0] for command_info in self.command_methods
+            )
+            handler_class._combined_regex = combined_regex
+
+        return combined_regex
+
+    def get_keywords(self):
+        handler_class = self.__class__
+        if '_keywords' not in handler_class.__dict__:
+            keywords = set()
+            for command_info in self.command_methods:
+                keyword = literal_first_token(command_info['args'][0])
+                if keyword is None:
+                    keywords = None
+                    break
 
-        raise CantParseLine(line)
+                keywords.add(keyword)
 
+            if not self.matches_only_bound_commands(RegexLineHandler):
+                keywords = None
 
-class ExactLineHandler(LineHandler):
+            handler_class._keywords = frozenset(keywords) if keywords is not None else None
+
+        return handler_class._keywords
+
+    def get_default_kwargs(self, command_info):
+        return {name: None for name in re.compile(command_info['args'][0]).groupindex}
+
+    def resolve(self, line):
+        match = self.get_combined_regex().match(line, line.first_token if type(line) is Line else None)
+        if match is None:
+            return NO_MATCH
+
+        index, kwargs = match
+        return self.command_methods[index], kwargs
+
+
+class ExactLineHandler(CommandLineHandler):
     """Matches line to exact expressions."""
+    deterministic = True
 
-    def try_execute(self, line):
+    def get_keywords(self):
+        if not self.matches_only_bound_commands(ExactLineHandler):
+            return None
+
+        keywords = set()
         for command_info in self.command_methods:
-            expr = command_info['args'][0]
-            if line.strip() == expr:
-                return command_info['method'](self)
+            tokens = command_info['args'][0].split(None, 1)
+            keywords.add(tokens[0] if tokens else '')
+
+        return keywords
+
+    def get_command_index(self):
+        """Return a {command line: command_info} dict for the handler class (the first command bound wins)."""
+        handler_class = self.__class__
+        command_index = handler_class.__dict__.get('_command_index')
+        if command_index is None:
+            command_index = {}
+            for command_info in self.command_methods:
+                command_index.setdefault(command_info['args'][0], command_info)
+            handler_class._command_index = command_index
+
+        return command_index
 
-        raise CantParseLine(line)
+    def resolve(self, line):
+        command_info = self.get_command_index().get(line.stripped if type(line) is Line else line.strip())
+        if command_info is None:
+            return NO_MATCH
+
+        return command_info, {}
 
 
 class ArgumentParserWrapper(argparse.ArgumentParser):
@@ -88,46 +296,205 @@ class ArgumentParserWrapper(argparse.ArgumentParser):
             super().print_help(file=self.line_handler.context.out_stream)
 
 
-class ArgparseLineHandler(LineHandler):
-    """Interprets commands via the standard argparse tool."""
+class ArgparseLineHandler(CommandLineHandler):
+    """
+    Interprets commands via the standard argparse tool.
+
+    If fast_parser is set, command arguments are parsed by a lightweight compiled parser
+    (see pymander.fastargs), and argparse is only built and used for help, errors and the cases
+    the compiled parser leaves to it.
+
+    The arguments of commands with options of other types than pure_types or with custom actions
+    are converted by arbitrary code (e.g. argparse.FileType opens a file), so they are never cached
+    (see is_deterministic).
+    """
+    deterministic = True
     common_options = {}
+    fast_parser = False
+    pure_types = (str, int, float, complex, bool)
 
     def __init__(self):
         super().__init__()
 
-        self.handler = ArgumentParserWrapper(prog='')
+        self.command_names = self.get_command_infos().keys()
+        self._parser = None
+        self._subparsers = None
+        self._built_commands = set()
+        if len(self.command_names) != len(self.command_methods):
+            # let argparse report conflicting command names right away
+            self.build_all_subparsers()
+
+    @property
+    def handler(self):
+        """
+        The argparse parser. It is built on first use, and the subparsers of commands
+        are only added to it when they are needed (see build_subparser).
+        """
+        if self._parser is None:
+            self._parser = self.build_parser()
+
+        return self._parser
+
+    def build_parser(self):
+        parser = ArgumentParserWrapper(prog='')
         for option, option_args in self.common_options.items():
             if not isinstance(option, tuple):
                 option = (option,)
-            self.handler.add_argument(*option, **option_args)
+            parser.add_argument(*option, **option_args)
+
+        self._subparsers = parser.add_subparsers()
+        self._built_commands = set()
+        return parser
+
+    def build_subparser(self, command_info):
+        command, options = command_info['args'][0], {}
+        if len(command_info['args']) > 1:
+            options = command_info['args'][1]
+        help = command_info['kwargs'].get('help', '')
+        self.handler  # make sure the main parser exists
+        subparser = self._subparsers.add_parser(
+            command, allow_help=True, line_handler=self, help=help
+        )
+        subparser.set_defaults(_command_info=command_info)
+        for option in options:
+            if isinstance(option, str):
+                option = (option,)
+            option_args = [item for item in option if isinstance(item, str)]
+            option_kwargs_l = [item for item in option if isinstance(item, dict)]
+            option_kwargs = option_kwargs_l[0] if option_kwargs_l else {}
+            subparser.add_argument(*option_args, **option_kwargs)
 
-        subparsers = self.handler.add_subparsers()
-        for command_info in self.command_methods:
-            command, options = command_info['args'][0], {}
-            if len(command_info['args']) > 1:
-                options = command_info['args'][1]
-            help = command_info['kwargs'].get('help', '')
-            subparser = subparsers.add_parser(
-                command, allow_help=True, line_handler=self, help=help
-            )
-            subparser.set_defaults(_command_method=command_info['method'])
-            for option in options:
-                if isinstance(option, str):
-                    option = (option,)
-                option_args = [item for item in option if isinstance(item, str)]
-                option_kwargs_l = [item for item in option if isinstance(item, dict)]
-                option_kwargs = option_kwargs_l[0] if option_kwargs_l else {}
-                subparser.add_argument(*option_args, **option_kwargs)
+        self._built_commands.add(command)
 
-    def try_execute(self, line):
-        if not line.strip():
-            raise CantParseLine
+    def build_all_subparsers(self):
+        for command_info in self.command_methods:
+            if command_info['args'][0] not in self._built_commands:
+                self.build_subparser(command_info)
+
+    def get_parser(self, tokens):
+        """
+        Return the argparse parser with subparsers built for every command
+        that parsing the tokens might need.
+        """
+        parser = self.handler
+        if self.common_options:
+            # the command name may be preceded by common options
+            names = [token for token in tokens if token in self.command_names]
+        else:
+            names = tokens[:1]
+
+        for name in names:
+            if name not in self._built_commands:
+                self.build_subparser(self.get_command_infos()[name])
+
+        return parser
+
+    def get_command_infos(self):
+        """Return a {command name: command_info} dict for the handler class."""
+        handler_class = self.__class__
+        command_infos = handler_class.__dict__.get('_command_infos')
+        if command_infos is None:
+            command_infos = {}
+            for command_info in self.command_methods:
+                command_infos.setdefault(command_info['args'][0], command_info)
+            handler_class._command_infos = command_infos
+
+        return command_infos
+
+    def get_compiled_commands(self):
+        """
+        Return a {command name: (command_info, CompiledCommand or None)} dict
+        for the handler class (the commands are compiled on first use).
+        """
+        handler_class = self.__class__
+        compiled_commands = handler_class.__dict__.get('_compiled_commands')
+        if compiled_commands is None:
+            compiled_commands = {}
+            for command_info in self.command_methods:
+                command = command_info['args'][0]
+                options = command_info['args'][1] if len(command_info['args']) > 1 else []
+                try:
+                    compiled_command = CompiledCommand(options)
+                except NotCompilable:
+                    compiled_command = None
+
+                if command in compiled_commands:
+                    compiled_command = None  # let argparse deal with the duplicate
+
+                compiled_commands[command] = (command_info, compiled_command)
+
+            handler_class._compiled_commands = compiled_commands
+
+        return compiled_commands
+
+    def get_default_kwargs(self, command_info):
+        command = command_info['args'][0]
+        _, compiled_command = self.get_compiled_commands()[command]
+        if compiled_command is not None:
+            return dict(compiled_command.defaults)
+
+        if command not in self._built_commands:
+            self.build_subparser(command_info)
+        parser = self._subparsers.choices[command]
+        return {
+            action.dest: action.default for action in parser._actions
+            if action.dest != 'help' and action.dest is not argparse.SUPPRESS and action.default is not argparse.SUPPRESS
+        }
+
+    def is_deterministic(self, command_info):
+        deterministic = command_info['kwargs'].get('deterministic')
+        if deterministic is not None:
+            return deterministic
+
+        options = command_info['args'][1] if len(command_info['args']) > 1 else []
+        option_kwargs = [
+            item for option in options if not isinstance(option, str)
+            for item in option if isinstance(item, dict)
+        ]
+        option_kwargs.extend(self.common_options.values())
+        return all(
+            kwargs.get('type', str) in self.pure_types and isinstance(kwargs.get('action', 'store'), str)
+            for kwargs in option_kwargs
+        )
+
+    def get_keywords(self):
+        if self.common_options:
+            # common options may precede the command name
+            return None
+
+        if not self.matches_only_bound_commands(ArgparseLineHandler):
+            return None
+
+        return set(self.command_names)
+
+    def resolve(self, line):
+        tokens = line.tokens if type(line) is Line else line.split()
+        if not tokens:
+            return NO_MATCH
+
+        if not self.common_options:
+            if tokens[0] not in self.command_names:
+                # not one of our subcommands, so there's no need to run the parser
+                return NO_MATCH
+
+            if self.fast_parser:
+                command_info, compiled_command = self.get_compiled_commands()[tokens[0]]
+                if compiled_command is not None:
+                    kwargs = compiled_command.parse(tokens[1:])
+                    if kwargs is not FALLBACK:
+                        return command_info, kwargs
 
         try:
-            args = self.handler.parse_args(line.split())
+            args = self.get_parser(tokens).parse_args(tokens)
         except SkipExecution:
-            return
+            return None, {}
+        except CantParseLine:
+            return NO_MATCH
 
         kwargs = vars(args).copy()
-        kwargs.pop('_command_method')
-        return args._command_method(self, **kwargs)
+        return kwargs.pop('_command_info'), kwargs
+
+
+class FastArgparseLineHandler(ArgparseLineHandler):
+    """ArgparseLineHandler that uses the compiled parser (see pymander.fastargs) whenever possible."""
+    fast_parser = True
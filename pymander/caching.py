@@ -0,0 +1,169 @@
+"""
+Caches used by command contexts: LRUCache backs the parse cache (see CommandContext.enable_parse_cache),
+ResultCache keeps the output of commands bound with cache=True (see the bind_* decorators).
+"""
+import collections
+import collections.abc
+import functools
+import time
+
+from .base_handlers import LineHandler
+
+
+__all__ = ('LRUCache', 'ResultCache', 'cache_results')
+
+
+class LRUCache:
+    """
+    A mapping of limited size that evicts the least recently used items. Counts hits and misses.
+    If ttl is set, items also expire ttl seconds after they have been put.
+    """
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        try:
+            value = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if self.ttl is not None:
+            expires, value = value
+            if self.clock() >= expires:
+                del self.items[key]
+                self.misses += 1
+                return default
+
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.ttl is not None:
+            value = (self.clock() + self.ttl, value)
+
+        items = self.items
+        items[key] = value
+        items.move_to_end(key)
+        if len(items) > self.max_size:
+            items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.items),
+            'max_size': self.max_size,
+        }
+
+
+class ResultCache:
+    """
+    The cached results of the commands of a context (see CommandContext.get_result_cache).
+    Every command has its own LRUCache, keyed on the arguments it was called with.
+    It is false while nothing has been cached since it was last cleared.
+    """
+    def __init__(self):
+        self.commands = {}
+        self._filled = False
+
+    def __bool__(self):
+        return self._filled
+
+    def get_command_cache(self, method, max_size, ttl):
+        command_cache = self.commands.get(method)
+        if command_cache is None:
+            command_cache = self.commands[method] = LRUCache(max_size, ttl)
+
+        return command_cache
+
+    def put(self, command_cache, key, value):
+        command_cache.put(key, value)
+        self._filled = True
+
+    def clear(self):
+        for command_cache in self.commands.values():
+            command_cache.clear()
+        self._filled = False
+
+    def stats(self):
+        """Return the cache statistics of every command ({command name: LRUCache.stats()})."""
+        return {method.__name__: command_cache.stats() for method, command_cache in self.commands.items()}
+
+
+def _make_key(value):
+    """Return a hashable equivalent of a parsed argument value (lists become tuples)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_make_key(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _make_key(item)) for key, item in value.items()))
+
+    return value
+
+
+def _record_chunks(chunks, on_complete):
+    recorded = []
+    for chunk in chunks:
+        recorded.append(chunk)
+        yield chunk
+
+    on_complete(recorded)
+
+
+def cache_results(method, ttl=None, max_size=128):
+    """
+    Wrap a command method so that its output and return value are cached in the result cache
+    of its context for every distinct set of arguments, for up to ttl seconds (forever by default).
+    The method may belong to a handler or to a context (see PrebuiltCommandContext).
+    The output is captured while the method runs and written through the context both then
+    and whenever the cached result is used. The cache is cleared when any command
+    that is not idempotent is executed in the context (see CommandLineHandler.invoke).
+    Output streamed by generator commands is cached only if it has been streamed to the end.
+    Calls with unhashable arguments and calls that raise an exception are not cached.
+    """
+    @functools.wraps(method)
+    def cached_method(self, *args, **kwargs):
+        context = self.context if isinstance(self, LineHandler) else self
+        result_cache = context.get_result_cache()
+        command_cache = result_cache.get_command_cache(method, max_size, ttl)
+        try:
+            key = (_make_key(args), _make_key(kwargs))
+            cached = command_cache.get(key)
+        except TypeError:
+            # unhashable arguments
+            return method(self, *args, **kwargs)
+
+        if cached is not None:
+            output, result, chunks = cached
+            for text in output:
+                context.write(text)
+            return result if chunks is None else iter(chunks)
+
+        output = []
+        with context.capture_output(output):
+            result = method(self, *args, **kwargs)
+
+        if result is not None and isinstance(result, collections.abc.Iterator):
+            # streamed output is cached once it has been streamed completely
+            return _record_chunks(result, lambda chunks: result_cache.put(command_cache, key, (output, None, chunks)))
+
+        result_cache.put(command_cache, key, (output, result, None))
+        return result
+
+    cached_method._idempotent = True
+    return cached_method
@@ -1,24 +1,48 @@
+import asyncio
+import concurrent.futures
+import inspect
 import sys
+import threading
 
-from .exceptions import ExitMainloop, ExitContext
+from .exceptions import CantParseLine, ExitMainloop, ExitContext
 from .contexts import CommandContext
+from .reader import DEFAULT_CHUNK_SIZE, iter_chunked_lines, ChunkedLineReader
 
 
-__all__ = ('Commander',)
+__all__ = ('Commander', 'AsyncCommander')
 
 
 class Commander:
     """
     Main class that orchestrates everything:
-        - reading from input in a loop
+        - reading from input in a loop (or running a script, see run_script)
         - entering and exiting contexts
     """
-    def __init__(self, context, in_stream=None, out_stream=None):
+    def __init__(self, context, in_stream=None, out_stream=None, output_policy=None, output_buffer_size=None,
+                 metrics=None, page_size=None, stream_limit=None, chunked_input=False, background_input=False):
+        """
+        output_policy and output_buffer_size, if given, are applied to every context
+        entered by the commander (see CommandContext.set_output_policy).
+        metrics, if given, is assigned to every context entered by the commander
+        and records entering and exiting them (see pymander.metrics).
+        page_size and stream_limit, if given, apply to the output streamed by commands
+        in every context entered by the commander (see CommandContext.write_stream):
+        after every page_size lines the user is asked whether to continue (see page).
+        With chunked_input=True the input stream is read in large chunks (see ChunkedLineReader),
+        with background_input=True it is also read ahead by a background thread while commands run.
+        """
         self.context_stack = []
         self.in_stream = None
         self.out_stream = None
+        self.output_policy = output_policy
+        self.output_buffer_size = output_buffer_size
+        self.metrics = metrics
+        self.page_size = page_size
+        self.stream_limit = stream_limit
 
         self.set_streams(in_stream, out_stream)
+        if chunked_input or background_input:
+            self.in_stream = ChunkedLineReader(self.in_stream, background=background_input)
         self.enter_context(context)
 
     @property
@@ -34,9 +58,13 @@ class Commander:
         for context in self.context_stack:
             context.set_out_stream(self.out_stream)
 
-    def execute(self, line):
+    def execute(self, line, on_cant_execute=None):
         try:
-            result = self.context.execute(line)
+            result = self.context.execute(line, on_cant_execute)
+            if inspect.isawaitable(result):
+                # an async command method, run to completion (see AsyncCommander for running them concurrently)
+                result = run_awaitable(result)
+
             if isinstance(result, CommandContext):
                 # the command requested to enter a new context by returning its instance
                 self.enter_context(result)
@@ -45,28 +73,346 @@ class Commander:
             self.exit_current_context()
 
     def read_and_execute(self):
+        self.context.report_jobs()
         self.context.prompt()
+        self.context.flush()
         line = self.in_stream.readline()
+        if not line:
+            self.end_of_input()
+            raise ExitMainloop
+
         self.execute(line)
 
     def mainloop(self):
         """Main commander loop: read lines and interpret them."""
-        while True:
-            try:
-                self.read_and_execute()
+        try:
+            while True:
+                try:
+                    self.read_and_execute()
 
-            except ExitMainloop:
-                break
+                except ExitMainloop:
+                    break
+
+        finally:
+            if self.context:
+                self.context.flush()
+
+    def run_script(self, script=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Execute commands non-interactively, without prompting.
+        script can be a file path, a text stream or an iterable of lines (the input stream by default).
+        Streams are read in chunks of chunk_size characters.
+        Runs until the end of the script or until the main context is exited.
+        Errors raised by commands and lines that no handler accepts are reported via on_script_error
+        and don't stop the script.
+        Background jobs that have finished are reported between lines, the rest are waited for
+        and reported at the end of the script.
+        Returns the number of lines that failed.
+        """
+        lines = self.iter_script(script, chunk_size)
+        error_count = 0
+        try:
+            for line_number, line in enumerate(lines, 1):
+                self.context.report_jobs()
+                try:
+                    self.execute(line, reject_line)
+
+                except ExitMainloop:
+                    break
+
+                except Exception as err:
+                    error_count += 1
+                    self.on_script_error(line_number, line, err)
+
+            else:
+                self.end_of_input()
+
+            self.wait_for_jobs()
+
+        finally:
+            lines.close()
+            if self.context:
+                self.context.flush()
+
+        return error_count
+
+    def iter_script(self, script=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield the lines of a script (see run_script), every one of them ending with a newline."""
+        if script is None:
+            script = self.in_stream
+
+        if isinstance(script, str):
+            with open(script, buffering=chunk_size) as script_file:
+                yield from self.iter_script(script_file, chunk_size=chunk_size)
+            return
+
+        if hasattr(script, 'read'):
+            lines = iter_chunked_lines(script, chunk_size)
+        else:
+            lines = script
+
+        for line in lines:
+            yield line if line.endswith('\n') else line + '\n'
+
+    def on_script_error(self, line_number, line, error):
+        self.context.write('Error in line {0}: {1}: {2}\n'.format(line_number, error.__class__.__name__, error))
 
     def write(self, text):
         self.out_stream.write(text)
 
+    def page(self):
+        """Ask whether to continue the output after a page of it. Return False if the user declines."""
+        self.context.write('-- More (Enter to continue, q to quit) --')
+        self.context.flush()
+        answer = self.in_stream.readline()
+        isatty = getattr(self.in_stream, 'isatty', None)
+        if isatty is None or not isatty():
+            # a terminal echoes the Enter, otherwise the output would continue on the line of the prompt
+            self.context.write('\n')
+        return bool(answer) and answer.strip().lower() != 'q'
+
     def enter_context(self, context):
         context.set_out_stream(self.out_stream)
+        if self.output_policy:
+            context.set_output_policy(self.output_policy, self.output_buffer_size)
+        if self.page_size:
+            context.page_size = self.page_size
+            context.pager = self.page
+        if self.stream_limit:
+            context.stream_limit = self.stream_limit
+        if self.metrics is not None:
+            context.metrics = self.metrics
+            self.metrics.record_context_event('enter', context)
         self.context_stack.append(context)
 
+    def wait_for_jobs(self):
+        """Wait for the background jobs of all the contexts on the stack to finish and report them."""
+        for context in reversed(self.context_stack):
+            context.wait_jobs()
+
+    def end_of_input(self):
+        """Called when the input is over: the contexts left on the stack are exited (see pymander.metrics)."""
+        if self.metrics is not None:
+            for context in reversed(self.context_stack):
+                self.metrics.record_context_event('exit', context)
+
     def exit_current_context(self):
+        self.context.flush()
+        if self.metrics is not None:
+            self.metrics.record_context_event('exit', self.context)
         if len(self.context_stack) == 1:
             raise ExitMainloop
 
         self.context_stack.pop()
+
+
+def run_awaitable(awaitable):
+    """Run an awaitable in a new event loop and return its result. Can't be called while an event loop is running."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        if inspect.iscoroutine(awaitable):
+            awaitable.close()
+        raise RuntimeError('Async commands can\'t be run by Commander in a running event loop, use AsyncCommander')
+
+    async def wait():
+        return await awaitable
+
+    return asyncio.run(wait())
+
+
+def reject_line(line):
+    """Raise CantParseLine for a line that no handler accepts (used by run_script to report it as an error)."""
+    raise CantParseLine('Invalid command: {0}'.format(line.rstrip('\n')))
+
+
+class AsyncCommander(Commander):
+    """
+    Commander for asyncio applications (see mainloop).
+    Command methods defined with async def are awaited, so their I/O doesn't block
+    the event loop. Synchronous commands run inline by default, or in an executor
+    if run_in_executor is set (executor=None means the default executor of the loop).
+    Input is read ahead by a background reader (up to read_ahead lines),
+    so reading overlaps with running commands. Commands still run one at a time, in order.
+    in_stream may also provide an asynchronous readline method (e.g. asyncio.StreamReader
+    wrapped to return text); if out_stream has an asynchronous drain method,
+    it is awaited after every command.
+    The reader is stopped when the mainloop (or run_script) ends. The lines it has read ahead are dropped
+    and are lost to any later reader of in_stream, including a line a blocking read returns after that.
+    page_size is not supported: the answers would have to be read while a command runs,
+    which can't be awaited (and would compete with the background reader for the input).
+    """
+    def __init__(self, context, in_stream=None, out_stream=None, run_in_executor=False, executor=None,
+                 read_ahead=16, **kwargs):
+        if kwargs.get('page_size'):
+            raise ValueError('{0} does not support page_size'.format(self.__class__.__name__))
+
+        self.run_in_executor = run_in_executor
+        self.executor = executor
+        self.read_ahead = read_ahead
+        self._lines = None
+        self._reader = None
+        self._stop_reading = None
+        super().__init__(context, in_stream=in_stream, out_stream=out_stream, **kwargs)
+
+    async def execute(self, line, on_cant_execute=None):
+        try:
+            if self.run_in_executor:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, self.context.execute, line, on_cant_execute)
+            else:
+                result = self.context.execute(line, on_cant_execute)
+
+            if inspect.isawaitable(result):
+                # an async command method
+                result = await result
+
+            if isinstance(result, CommandContext):
+                self.enter_context(result)
+
+        except ExitContext:
+            self.exit_current_context()
+
+        await self.drain()
+
+    async def drain(self):
+        drain = getattr(self.out_stream, 'drain', None)
+        if drain is not None and inspect.iscoroutinefunction(drain):
+            self.context.flush()
+            await drain()
+
+    async def readline(self):
+        """Return the next input line ('' at the end of input)."""
+        if self._lines is None:
+            self.start_reader()
+
+        return await self._lines.get()
+
+    def start_reader(self):
+        loop = asyncio.get_running_loop()
+        self._lines = asyncio.Queue(self.read_ahead)
+        if inspect.iscoroutinefunction(self.in_stream.readline):
+            self._reader = loop.create_task(self._read_lines(self.in_stream, self._lines))
+        else:
+            # blocking streams are read by a daemon thread, so a pending read doesn't keep
+            # the process alive after the mainloop ends (unlike a read in an executor)
+            self._stop_reading = threading.Event()
+            self._reader = threading.Thread(
+                target=self._read_lines_in_thread, args=(self.in_stream, self._lines, loop, self._stop_reading),
+                name='pymander-input', daemon=True,
+            )
+            self._reader.start()
+
+    def stop_reader(self):
+        if isinstance(self._reader, asyncio.Task):
+            self._reader.cancel()
+        if self._stop_reading is not None:
+            self._stop_reading.set()
+            # unblock the reader thread if it's waiting for room in the queue
+            while not self._lines.empty():
+                self._lines.get_nowait()
+            self._stop_reading = None
+        self._reader = None
+        self._lines = None
+
+    @staticmethod
+    async def _read_lines(in_stream, lines):
+        while True:
+            line = await in_stream.readline()
+            await lines.put(line)
+            if not line:
+                break
+
+    @staticmethod
+    def _read_lines_in_thread(in_stream, lines, loop, stop):
+        while not stop.is_set():
+            line = in_stream.readline()
+            if stop.is_set():
+                break  # nobody reads the queue anymore
+
+            put = lines.put(line)
+            try:
+                # blocks while the queue is full
+                asyncio.run_coroutine_threadsafe(put, loop).result()
+            except RuntimeError:
+                put.close()
+                break  # the loop is closed
+            except concurrent.futures.CancelledError:
+                break  # the loop is shutting down
+
+            if not line or stop.is_set():
+                break
+
+    async def run_script(self, script=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Same as Commander.run_script, but must be awaited in an event loop, and async commands are awaited.
+        The input stream (the default script) is read like in mainloop,
+        file paths, other streams and iterables are read synchronously.
+        """
+        lines = self.iter_script(script, chunk_size) if script is not None else None
+        line_number = 0
+        error_count = 0
+        try:
+            while True:
+                if lines is not None:
+                    line = next(lines, None)
+                else:
+                    line = await self.readline() or None
+                if line is None:
+                    self.end_of_input()
+                    break
+
+                line_number += 1
+                if not line.endswith('\n'):
+                    line += '\n'
+
+                self.context.report_jobs()
+                try:
+                    await self.execute(line, reject_line)
+
+                except ExitMainloop:
+                    break
+
+                except Exception as err:
+                    error_count += 1
+                    self.on_script_error(line_number, line, err)
+
+            self.wait_for_jobs()
+
+        finally:
+            if lines is not None:
+                lines.close()
+            self.stop_reader()
+            if self.context:
+                self.context.flush()
+
+        return error_count
+
+    async def read_and_execute(self):
+        self.context.report_jobs()
+        self.context.prompt()
+        self.context.flush()
+        await self.drain()
+        line = await self.readline()
+        if not line:
+            self.end_of_input()
+            raise ExitMainloop
+
+        await self.execute(line)
+
+    async def mainloop(self):
+        """Main commander loop: read lines and interpret them. Must be awaited in an event loop."""
+        try:
+            while True:
+                try:
+                    await self.read_and_execute()
+
+                except ExitMainloop:
+                    break
+
+        finally:
+            self.stop_reader()
+            if self.context:
+                self.context.flush()
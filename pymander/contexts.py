@@ -1,27 +1,192 @@
 import abc
+import collections
+import collections.abc
+import contextlib
 import copy
 import inspect
 import json
-import uuid
 
-from .exceptions import CantParseLine, ExitContext
-from .handlers import LineHandler, EmptyLineHandler, EchoLineHandler, ExitLineHandler, \
-    ExactLineHandler, ArgparseLineHandler, RegexLineHandler
+from .exceptions import ExitContext, ExitMainloop, BufferOverflow
+from .handlers import NO_MATCH, LineHandler, CommandLineHandler, EmptyLineHandler, EchoLineHandler, \
+    ExitLineHandler, ExactLineHandler, ArgparseLineHandler, RegexLineHandler, JobsLineHandler, StatsLineHandler, \
+    PipeFilterLineHandler
+from .jobs import JobManager
+from .jsonstream import IncrementalJsonDecoder
+from .caching import LRUCache, ResultCache
+from .line import Line, as_line
+from .pipelines import split_pipeline, iter_lines, chain_output, close_iterator
 
 
 __all__ = (
-    'CommandContext', 'MultiLineContext', 'JsonContext', 'StandardPrompt', 'PrebuiltCommandContext'
+    'CommandContext', 'MultiLineContext', 'JsonContext', 'StandardPrompt', 'PrebuiltCommandContext',
+    'OUTPUT_UNBUFFERED', 'OUTPUT_LINE_BUFFERED', 'OUTPUT_BUFFERED', 'OVERFLOW_ERROR', 'OVERFLOW_TRUNCATE',
 )
 
 
+# output policies (see CommandContext.set_output_policy)
+OUTPUT_UNBUFFERED = 'unbuffered'
+OUTPUT_LINE_BUFFERED = 'line'
+OUTPUT_BUFFERED = 'buffered'
+OUTPUT_POLICIES = (OUTPUT_UNBUFFERED, OUTPUT_LINE_BUFFERED, OUTPUT_BUFFERED)
+
+# buffer overflow policies (see MultiLineContext)
+OVERFLOW_ERROR = 'error'
+OVERFLOW_TRUNCATE = 'truncate'
+OVERFLOW_POLICIES = (OVERFLOW_ERROR, OVERFLOW_TRUNCATE)
+
+
+# types of parsed arguments that cached parse results can share between command calls
+_IMMUTABLE_TYPES = frozenset((str, int, float, bool, type(None), bytes))
+
+
+def _is_cacheable(value):
+    """Whether a parsed argument can be shared (or copied) between command calls by the parse cache."""
+    if type(value) in _IMMUTABLE_TYPES:
+        return True
+
+    if type(value) in (list, tuple):
+        return all(_is_cacheable(item) for item in value)
+
+    return False
+
+
+def _error_name(err):
+    """Return the error recorded for a command that has raised err (see pymander.metrics), None if it has exited."""
+    if isinstance(err, (ExitContext, ExitMainloop)):
+        # the command has succeeded, exiting is recorded as a context event (see Commander)
+        return None
+
+    return err.__class__.__name__
+
+
+async def _record_awaited(awaitable, record):
+    try:
+        result = await awaitable
+    except BaseException as err:
+        record(_error_name(err))
+        raise
+
+    record()
+    return result
+
+
+class _RecordedStream:
+    """
+    Wraps the output chunks streamed by a command (see write_stream), so that the command is recorded
+    when they are exhausted, fail or are closed.
+    """
+    def __init__(self, chunks, record):
+        self.chunks = chunks
+        self.record = record
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+
+        except StopIteration:
+            self.finish()
+            raise
+
+        except BaseException as err:
+            self.finish(_error_name(err))
+            raise
+
+    def close(self):
+        try:
+            close_iterator(self.chunks)
+        finally:
+            self.finish()
+
+    def finish(self, error=None):
+        if self.record is not None:
+            record, self.record = self.record, None
+            record(error)
+
+
+def _is_async_command(command_info):
+    """Whether a command method is defined with async def (generated methods wrap it, see PrebuiltCommandContext)."""
+    return inspect.iscoroutinefunction(inspect.unwrap(command_info['method']))
+
+
+def _resolves_natively(handler):
+    """Whether the handler dispatches lines by the resolve/invoke protocol of CommandLineHandler."""
+    return type(handler).dispatch is CommandLineHandler.dispatch and 'dispatch' not in handler.__dict__
+
+
+class _HandlerList(list):
+    """The handler list of a context: calls on_change whenever it's modified (see CommandContext.handlers)."""
+    def __init__(self, handlers, on_change):
+        super().__init__(handlers)
+        self.on_change = on_change
+
+    def __reduce_ex__(self, protocol):
+        # copies and pickles are plain lists, they don't belong to the context
+        return list, (list(self),)
+
+    def set_order(self, handlers):
+        """Replace the items by the same handlers in another order, without calling on_change."""
+        list.__setitem__(self, slice(None), handlers)
+
+
+def _notifying(method):
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.on_change()
+        return result
+
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove',
+              'clear', 'sort', 'reverse'):
+    setattr(_HandlerList, _name, _notifying(getattr(list, _name)))
+
+
 class CommandContext(metaclass=abc.ABCMeta):
     force_handlers = []
+    output_policy = OUTPUT_UNBUFFERED
+    output_buffer_size = 65536
+    _unflushed_size = 0
+    _job_manager = None
+    _output_capture = None
+    # see get_result_cache
+    result_cache = None
+    # see pymander.metrics
+    metrics = None
+    # see enable_parse_cache
+    parse_cache_size = None
+    # see write_stream
+    stream_batch_size = 8192
+    stream_limit = None
+    page_size = None
+    pager = None
+    # see execute_pipeline
+    pipelines = False
+    pipe_input = None
+    # see reorder_handlers
+    reorder_interval = None
+    _handler_hits = None
 
     def __init__(self, handlers=None, name='', ignore_force_handlers=False):
+        self._dispatch_index = None
+        self._command_index = None
+        if self.reorder_interval:
+            self._handler_hits = collections.Counter()
+            self._lines_until_reorder = self.reorder_interval
+        self.parse_cache = None
+        if self.parse_cache_size:
+            self.enable_parse_cache(self.parse_cache_size)
+
         # construct handler list
         self.handlers = copy.copy(handlers or [])
         if not ignore_force_handlers:
             self.handlers += [handler_class() for handler_class in self.force_handlers]
+            if self.pipelines:
+                self.handlers.append(PipeFilterLineHandler())
 
         self.name = name
         self.out_stream = None
@@ -29,29 +194,619 @@ class CommandContext(metaclass=abc.ABCMeta):
         for handler in self.handlers:
             handler.set_context(self)
 
+    @property
+    def handlers(self):
+        return self._handlers
+
+    @handlers.setter
+    def handlers(self, handlers):
+        # a copy that invalidates the dispatch index whenever it's modified
+        self._handlers = _HandlerList(handlers, self.invalidate_dispatch_index)
+        self.invalidate_dispatch_index()
+
+    def invalidate_dispatch_index(self):
+        """
+        Forget the dispatch and command indexes and the parse cache. Called whenever the handler list
+        is modified, must be called if the commands or keywords of a handler change.
+        """
+        self._dispatch_index = None
+        self._command_index = None
+        parse_cache = getattr(self, 'parse_cache', None)
+        if parse_cache is not None:
+            parse_cache.clear()
+
+    def enable_parse_cache(self, max_size=1024):
+        """
+        Cache the results of parsing lines: the handler, command and arguments a line resolves to
+        (or that no handler accepts it), for up to max_size distinct lines, least recently used ones
+        are evicted. Repeated lines then skip parsing, the commands are still executed every time.
+        Lines are only cached if every handler they were tried by is deterministic
+        (see LineHandler.deterministic), and so is their command (see CommandLineHandler.is_deterministic),
+        and all the arguments are strings, numbers, None or lists and tuples of them.
+        Parse cache statistics are available via parse_cache.stats().
+        Can also be enabled for all instances of a context class by setting parse_cache_size.
+        """
+        self.parse_cache = LRUCache(max_size)
+        self.invalidate_dispatch_index()
+
+    def disable_parse_cache(self):
+        self.parse_cache = None
+
+    def build_dispatch_index(self):
+        """
+        Build a mapping of line keywords (first tokens) to handlers that might accept
+        lines starting with them. Handlers that do not declare their keywords
+        are candidates for any line, so the order of handlers is preserved for every keyword.
+        """
+        handler_keywords = [(handler, handler.get_keywords()) for handler in self._handlers]
+        all_keywords = set()
+        for handler, keywords in handler_keywords:
+            if keywords is not None:
+                all_keywords.update(keywords)
+
+        index = {
+            keyword: [
+                handler for handler, keywords in handler_keywords
+                if keywords is None or keyword in keywords
+            ]
+            for keyword in all_keywords
+        }
+        wildcard_handlers = [handler for handler, keywords in handler_keywords if keywords is None]
+        wraps_lines = any(handler.accepts_line for handler in self._handlers)
+        self._dispatch_index = (index, wildcard_handlers, wraps_lines)
+
+    def get_candidate_handlers(self, line):
+        """Return handlers that might accept the line, in order."""
+        if self._dispatch_index is None:
+            self.build_dispatch_index()
+
+        index, wildcard_handlers, _ = self._dispatch_index
+        if type(line) is Line:
+            return index.get(line.first_token, wildcard_handlers)
+
+        tokens = line.split(None, 1)
+        return index.get(tokens[0] if tokens else '', wildcard_handlers)
+
+    def prepare_line(self, line):
+        """
+        Return the line the way it is passed to handlers: as a Line if any handler
+        of the context accepts one (see LineHandler.accepts_line), as is otherwise.
+        """
+        if self._dispatch_index is None:
+            self.build_dispatch_index()
+
+        return as_line(line) if self._dispatch_index[2] else line
+
+    def get_command(self, name):
+        """
+        Find a command by the name of its method, without parsing any line.
+        Return a (handler, command_info) tuple or None if there's no such command (the first handler wins).
+        The command can be executed by handler.invoke(command_info, kwargs), see also handler.get_default_kwargs.
+        """
+        if self._command_index is None:
+            commands = {}
+            for handler in self._handlers:
+                if isinstance(handler, CommandLineHandler):
+                    for command_info in handler.command_methods:
+                        commands.setdefault(command_info['method'].__name__, (handler, command_info))
+            self._command_index = commands
+
+        return self._command_index.get(name)
+
     def set_out_stream(self, out_stream):
         self.out_stream = out_stream
 
-    def execute(self, line):
+    def dispatch(self, line):
         """
-        Try to interpret a line by applying every handler in the list until one succeeds.
-        If none do, then execute the error handler self.on_cant_execute
+        Try to interpret a line by applying every handler that might accept it until one succeeds.
+        Return the result of the command or NO_MATCH if no handler accepts the line.
+        If the parse cache (see enable_parse_cache) or metrics (see pymander.metrics) are enabled,
+        handlers that support it (see CommandLineHandler.resolve) resolve and invoke the line separately,
+        so that the command can be cached and recorded.
         """
-        for handler in self.handlers:
+        parse_cache = self.parse_cache
+        if parse_cache is not None:
+            # (the parse cache is cleared whenever the handler list changes, see invalidate_dispatch_index)
+            entry = parse_cache.get(line)
+            if entry is not None:
+                return self._dispatch_cached(entry)
+
+        line = self.prepare_line(line)
+        metrics = self.metrics
+        resolve_first = parse_cache is not None or metrics is not None
+        # the line is only cached if every handler it was tried by is deterministic
+        cacheable = parse_cache is not None
+        misses = 0
+        for handler in self.get_candidate_handlers(line):
+            start = metrics.clock() if metrics is not None else None
+            if resolve_first and _resolves_natively(handler):
+                cacheable = cacheable and handler.deterministic
+                resolved = self._run_command(handler, None, handler.resolve, (line,), start, misses)
+                if resolved is NO_MATCH:
+                    misses += 1
+                    continue
+
+                command_info, kwargs = resolved
+                if cacheable:
+                    self._cache_resolved(line, handler, command_info, kwargs)
+                return self._invoke(handler, command_info, kwargs, start, misses)
+
+            cacheable = False
+            if metrics is not None:
+                result = self._run_command(handler, None, handler.dispatch, (line,), start, misses)
+            else:
+                result = handler.dispatch(line)
+            if result is not NO_MATCH:
+                return self._accept(handler, None, result, start, misses)
+
+            misses += 1
+
+        if cacheable:
+            parse_cache.put(line, (None, None, None, False))
+        if metrics is not None:
+            metrics.record_unmatched(self, misses)
+        return NO_MATCH
+
+    def _dispatch_cached(self, entry):
+        handler, command_info, kwargs, copy_kwargs = entry
+        if handler is None:
+            if self.metrics is not None:
+                self.metrics.record_unmatched(self, 0)
+            return NO_MATCH
+
+        if copy_kwargs:
+            kwargs = copy.deepcopy(kwargs)
+        return self._invoke(handler, command_info, kwargs, self.metrics.clock() if self.metrics is not None else None, 0)
+
+    def _cache_resolved(self, line, handler, command_info, kwargs):
+        # (command_info is None if resolving had side effects, e.g. printed help;
+        # arguments of other types, e.g. open files, are only valid for a single call)
+        if (
+            command_info is not None and handler.is_deterministic(command_info)
+            and all(_is_cacheable(value) for value in kwargs.values())
+        ):
+            copy_kwargs = any(type(value) not in _IMMUTABLE_TYPES for value in kwargs.values())
+            self.parse_cache.put(
+                line, (handler, command_info, copy.deepcopy(kwargs) if copy_kwargs else kwargs, copy_kwargs)
+            )
+
+    def _invoke(self, handler, command_info, kwargs, start, misses):
+        command = None
+        if self.metrics is None:
+            result = handler.invoke(command_info, kwargs)
+        else:
+            if command_info is not None:
+                command = command_info['method'].__name__
+            result = self._run_command(handler, command, handler.invoke, (command_info, kwargs), start, misses)
+        return self._accept(handler, command, result, start, misses)
+
+    def _run_command(self, handler, command, func, args, start, misses):
+        """Call func(*args) on behalf of a handler, recording the error it raises if metrics are enabled."""
+        metrics = self.metrics
+        if metrics is None:
+            return func(*args)
+
+        try:
+            return func(*args)
+
+        except BaseException as err:
+            metrics.record_command(self, handler, command, metrics.clock() - start, misses, _error_name(err))
+            raise
+
+    def _accept(self, handler, command, result, start, misses):
+        """
+        Called with the result of every line a handler has accepted: counts and records the command.
+        Handlers that aren't CommandLineHandlers don't tell whether their commands are idempotent,
+        so they clear the result cache (see get_result_cache).
+        """
+        if self.result_cache and not isinstance(handler, CommandLineHandler):
+            self.result_cache.clear()
+        if self._handler_hits is not None:
+            self.count_hit(handler)
+        if self.metrics is not None:
+            return self._record_result(handler, command, result, start, misses)
+        return result
+
+    def _record_result(self, handler, command, result, start, misses):
+        """
+        Record a command that has returned. The coroutine of an async command and the output chunks
+        of a streaming command are wrapped, so that the command is recorded when it has been awaited
+        or its output is over, along with the error it raises.
+        """
+        metrics = self.metrics
+
+        def record(error=None):
+            metrics.record_command(self, handler, command, metrics.clock() - start, misses, error)
+
+        if inspect.isawaitable(result):
+            return _record_awaited(result, record)
+
+        if result is not None and isinstance(result, collections.abc.Iterator):
+            return _RecordedStream(result, record)
+
+        record()
+        return result
+
+    def count_hit(self, handler):
+        """Record that a handler has accepted a line (only if reorder_interval is set, see reorder_handlers)."""
+        self._handler_hits[handler] += 1
+        self._lines_until_reorder -= 1
+        if self._lines_until_reorder <= 0:
+            self._lines_until_reorder = self.reorder_interval
+            self.reorder_handlers()
+
+    def reorder_handlers(self):
+        """
+        Move the handlers that have accepted the most lines towards the front of the handler list,
+        so that fewer handlers are tried before them. Only adjacent handlers that can be swapped
+        (see can_swap_handlers) are swapped, so the relative order of handlers that might accept
+        the same lines is kept and every line is still executed by the same handler.
+
+        If reorder_interval is set, the context counts the lines accepted by every handler
+        and calls this every reorder_interval accepted lines. The counts are halved afterwards,
+        so that the order follows changes in use.
+        """
+        hits = self._handler_hits or {}
+        handlers = list(self._handlers)
+        moved = False
+        for end in range(len(handlers) - 1, 0, -1):
+            swapped = False
+            for index in range(end):
+                first, second = handlers[index], handlers[index + 1]
+                if hits.get(second, 0) > hits.get(first, 0) and self.can_swap_handlers(first, second):
+                    handlers[index], handlers[index + 1] = second, first
+                    swapped = True
+
+            if not swapped:
+                break
+            moved = True
+
+        if self._handler_hits is not None:
+            self._handler_hits = collections.Counter({
+                handler: count // 2 for handler, count in self._handler_hits.items()
+                if count > 1 and handler in handlers
+            })
+
+        if moved:
+            # the index is rebuilt rather than invalidated: cached parse results stay valid,
+            # since lines are executed by the same handlers
+            self._handlers.set_order(handlers)
+            self.build_dispatch_index()
+
+    def can_swap_handlers(self, first, second):
+        """
+        Whether two handlers can be swapped without changing the handler a line is executed by:
+        neither of them is pinned or conflicts with the other, and either one of them is exclusive
+        or both declare their keywords (see LineHandler.get_keywords) and share none of them.
+        """
+        if first.pinned or second.pinned:
+            return False
+
+        if isinstance(first, second.conflicts_with) or isinstance(second, first.conflicts_with):
+            return False
+
+        if first.exclusive or second.exclusive:
+            return True
+
+        first_keywords = first.get_keywords()
+        second_keywords = second.get_keywords()
+        return (
+            first_keywords is not None and second_keywords is not None
+            and set(first_keywords).isdisjoint(second_keywords)
+        )
+
+    def execute(self, line, on_cant_execute=None):
+        """
+        Interpret a line (see dispatch).
+        If no handler accepts it, then execute the error handler on_cant_execute
+        (self.on_cant_execute by default)
+        """
+        if self.pipelines and '|' in line:
+            stages = split_pipeline(line)
+            if len(stages) > 1:
+                return self.execute_pipeline(line, stages, on_cant_execute)
+
+        result = self.dispatch(line)
+        if result is NO_MATCH:
+            (on_cant_execute or self.on_cant_execute)(line)
+            return None
+
+        if result is not None and isinstance(result, collections.abc.Iterator):
+            # the command returned (or is) a generator of output chunks
+            self.write_stream(result)
+            return None
+
+        return result
+
+    def execute_pipeline(self, line, stages, on_cant_execute=None):
+        """
+        Execute the stages of a pipeline (see pymander.pipelines), passing the output of every stage
+        to the next one as context.pipe_input, and stream the output of the last stage.
+        Every stage is resolved before any of them is executed (see resolve_line):
+        if no handler accepts a stage, on_cant_execute (self.on_cant_execute by default)
+        is called with the whole line and nothing is executed.
+        Async commands can't be stages (their output can't be awaited while it's passed on),
+        they are rejected the same way (see on_async_stage).
+        """
+        on_cant_execute = on_cant_execute or self.on_cant_execute
+        if not all(stages):
+            on_cant_execute(line)
+            return None
+
+        resolved_stages = []
+        for stage in stages:
+            stage_line = self.prepare_line(stage + '\n')
+            resolved = self.resolve_line(stage_line)
+            if resolved is NO_MATCH:
+                on_cant_execute(line)
+                return None
+            if resolved is not None and resolved[1] is not None and _is_async_command(resolved[1]):
+                self.on_async_stage(line, stage, on_cant_execute)
+                return None
+            resolved_stages.append((stage_line, resolved))
+
+        chunks = None
+        for stage_line, resolved in resolved_stages:
+            output = []
+            previous_input = self.pipe_input
+            self.pipe_input = iter_lines(chunks) if chunks is not None else None
             try:
-                return handler.try_execute(line)
+                with self.capture_output(output, forward=False):
+                    if resolved is None:
+                        result = self.dispatch(stage_line)
+                    else:
+                        result = self.invoke_resolved(*resolved)
+            finally:
+                self.pipe_input = previous_input
+
+            if result is NO_MATCH or inspect.isawaitable(result):
+                if chunks is not None:
+                    close_iterator(chunks)
+                if result is NO_MATCH:
+                    on_cant_execute(line)
+                else:
+                    close_iterator(result)  # (closes a coroutine)
+                    self.on_async_stage(line, stage_line.rstrip('\n'), on_cant_execute)
+                return None
+
+            if result is not None and isinstance(result, collections.abc.Iterator):
+                chunks = chain_output(output, result) if output else result
+            else:
+                chunks = iter(output)
+
+        self.write_stream(chunks)
+        return None
+
+    def on_async_stage(self, line, stage, on_cant_execute=None):
+        """Called when a stage of a pipeline is an async command, which can't be piped (see execute_pipeline)."""
+        self.write('Async commands can\'t be used in a pipeline: {0}\n'.format(stage.strip()))
+        (on_cant_execute or self.on_cant_execute)(line)
+
+    def resolve_line(self, line):
+        """
+        Find the handler and command that would execute a line, without executing it.
+        Return a (handler, command_info, kwargs) tuple to pass to invoke_resolved, NO_MATCH if no handler
+        accepts the line, or None if a handler that only accepts lines by executing them
+        (see CommandLineHandler.resolve) has to be tried first, so the line can only be dispatched.
+        """
+        for handler in self.get_candidate_handlers(line):
+            if not _resolves_natively(handler):
+                return None
+
+            resolved = handler.resolve(line)
+            if resolved is not NO_MATCH:
+                return (handler,) + tuple(resolved)
 
-            except CantParseLine:
-                pass
+        return NO_MATCH
 
-        self.on_cant_execute(line)
+    def invoke_resolved(self, handler, command_info, kwargs):
+        """Execute a command returned by resolve_line."""
+        start = self.metrics.clock() if self.metrics is not None else None
+        return self._invoke(handler, command_info, kwargs, start, 0)
+
+    def write_stream(self, chunks):
+        """
+        Write the output chunks (strings) of an iterator as they are produced.
+        Chunks are joined into batches of at least stream_batch_size characters,
+        every batch is written and flushed right away.
+        If stream_limit is set, the output is cut off after that many lines.
+        If page_size and pager are set, pager() is called after every page_size lines
+        and the output is stopped if it returns False (see Commander).
+        The iterator is closed if its output is stopped early.
+        """
+        limit = self.stream_limit
+        page_size = self.page_size if self.pager is not None else None
+        batch = []
+        batch_size = 0
+        line_count = 0
+        next_stop = min(stop for stop in (limit, page_size) if stop) if limit or page_size else None
+        # the output has reached the end of a page or the limit, which only matters if more output follows
+        stopped = False
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+
+                if stopped:
+                    next_stop = self._continue_stream(line_count, page_size)
+                    if next_stop is None:
+                        return
+                    stopped = False
+
+                if next_stop is not None:
+                    newline_count = chunk.count('\n')
+                    while line_count + newline_count >= next_stop:
+                        # the chunk reaches the end of a page or the limit: write out the part before it
+                        end = -1
+                        for _ in range(next_stop - line_count):
+                            end = chunk.index('\n', end + 1)
+                        batch.append(chunk[:end + 1])
+                        self.write(''.join(batch))
+                        self.flush()
+                        batch, batch_size = [], 0
+                        chunk = chunk[end + 1:]
+                        newline_count -= next_stop - line_count
+                        line_count = next_stop
+                        if not chunk:
+                            stopped = True
+                            break
+
+                        next_stop = self._continue_stream(line_count, page_size)
+                        if next_stop is None:
+                            return
+
+                    line_count += newline_count
+
+                if chunk:
+                    batch.append(chunk)
+                    batch_size += len(chunk)
+                    if batch_size >= self.stream_batch_size:
+                        self.write(''.join(batch))
+                        self.flush()
+                        batch, batch_size = [], 0
+
+            if batch:
+                self.write(''.join(batch))
+                self.flush()
+
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def _continue_stream(self, line_count, page_size):
+        """
+        Called when more output follows the end of a page or the limit (see write_stream).
+        Return the line count of the next stop or None if the output must be stopped.
+        """
+        limit = self.stream_limit
+        if line_count == limit:
+            self.on_stream_limit()
+            return None
+
+        if not self.pager():
+            return None
+
+        next_stop = line_count + page_size
+        if limit and limit < next_stop:
+            next_stop = limit
+        return next_stop
+
+    def on_stream_limit(self):
+        """Called when streamed output is cut off after stream_limit lines."""
+        self.write('... (output truncated after {0} lines)\n'.format(self.stream_limit))
+
+    def set_output_policy(self, output_policy, output_buffer_size=None):
+        """
+        Set when the output stream is flushed after writing to it:
+            - OUTPUT_UNBUFFERED: after every write (the default)
+            - OUTPUT_LINE_BUFFERED: after writes that contain a newline
+            - OUTPUT_BUFFERED: when at least output_buffer_size characters have been written
+              since the last flush
+        In any case the Commander flushes the output after prompting and when exiting the context
+        (prompts are not flushed by the context itself unless the output is unbuffered, see write_prompt).
+        """
+        if output_policy not in OUTPUT_POLICIES:
+            raise ValueError('Unknown output policy: {0}'.format(output_policy))
+
+        self.output_policy = output_policy
+        if output_buffer_size is not None:
+            self.output_buffer_size = output_buffer_size
 
     def write(self, text):
-        """Write to the current output stream."""
+        """
+        Write to the current output stream (or to the output of the current background job,
+        or to the list given to capture_output).
+        """
+        if self._job_manager is not None and self._job_manager.capture(text):
+            return
+
+        if self._output_capture is not None:
+            self._output_capture.append(text)
+            return
+
         if self.out_stream:
             self.out_stream.write(text)
+            output_policy = self.output_policy
+            if output_policy == OUTPUT_UNBUFFERED:
+                self.out_stream.flush()
+            elif output_policy == OUTPUT_LINE_BUFFERED:
+                if '\n' in text:
+                    self.out_stream.flush()
+            else:
+                self._unflushed_size += len(text)
+                if self._unflushed_size >= self.output_buffer_size:
+                    self.flush()
+
+    @contextlib.contextmanager
+    def capture_output(self, output, forward=True):
+        """
+        Collect whatever is written to the context in the output list,
+        and write it out when it's over if forward is set.
+        """
+        previous_capture = self._output_capture
+        self._output_capture = output
+        try:
+            yield output
+
+        finally:
+            self._output_capture = previous_capture
+            if forward:
+                for text in output:
+                    self.write(text)
+
+    def write_prompt(self, text):
+        """
+        Write a prompt to the current output stream. It is only flushed right away if the output
+        is unbuffered, otherwise the Commander flushes the output once, right before reading the next line
+        (code that drives a context with buffered output directly has to call flush after prompt).
+        """
+        if self.out_stream:
+            self.out_stream.write(text)
+            if self.output_policy == OUTPUT_UNBUFFERED:
+                self.flush()
+            else:
+                self._unflushed_size += len(text)
+
+    def flush(self):
+        """Flush the current output stream."""
+        self._unflushed_size = 0
+        if self.out_stream:
             self.out_stream.flush()
 
+    def get_job_manager(self):
+        """Return the manager of background jobs started in this context (see pymander.jobs)."""
+        if self._job_manager is None:
+            self._job_manager = JobManager(self)
+
+        return self._job_manager
+
+    def get_result_cache(self):
+        """
+        Return the cache of the results of commands bound with cache=True (see pymander.caching).
+        It is created on first use and cleared whenever a command that isn't idempotent is executed,
+        including any line accepted by a handler that isn't a CommandLineHandler.
+        """
+        if self.result_cache is None:
+            self.result_cache = ResultCache()
+
+        return self.result_cache
+
+    def invalidate_result_cache(self):
+        """Forget the cached results of commands, e.g. when the state they depend on has changed."""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def report_jobs(self):
+        """Report background jobs that have finished. Called by the Commander before prompting."""
+        if self._job_manager is not None:
+            self._job_manager.report_finished()
+
+    def wait_jobs(self):
+        """Wait for the background jobs to finish and report them (see Commander.run_script)."""
+        if self._job_manager is not None:
+            self._job_manager.wait()
+
     def exit(self):
         raise ExitContext(self)
 
@@ -97,16 +852,72 @@ class MultiLineContext(CommandContext):
 
             return False
 
-    def __init__(self, *args, **kwargs):
+    max_buffer_size = None
+    overflow_policy = OVERFLOW_ERROR
+
+    def __init__(self, *args, max_buffer_size=None, overflow_policy=None, **kwargs):
+        """
+        max_buffer_size limits the number of buffered characters (unlimited by default).
+        When a line doesn't fit, overflow_policy decides what happens:
+            - OVERFLOW_ERROR: on_buffer_overflow is called (by default it reports the error and exits)
+            - OVERFLOW_TRUNCATE: the buffer is filled up and the rest of the input is dropped,
+              buffer_truncated is set
+        """
         self.force_handlers = [self.FinishedHandler]
         super().__init__(*args, **kwargs)
+        if max_buffer_size is not None:
+            self.max_buffer_size = max_buffer_size
+        if overflow_policy is not None:
+            if overflow_policy not in OVERFLOW_POLICIES:
+                raise ValueError('Unknown overflow policy: {0}'.format(overflow_policy))
+            self.overflow_policy = overflow_policy
+
         self.buffer = ''
 
-    def execute(self, line):
-        super().execute(line)
+    @property
+    def buffer(self):
+        """The buffered text. Lines are collected in chunks and joined on first access."""
+        if len(self._chunks) > 1:
+            self._chunks[:] = [''.join(self._chunks)]
+
+        return self._chunks[0] if self._chunks else ''
+
+    @buffer.setter
+    def buffer(self, text):
+        self._chunks = [text] if text else []
+        self.buffer_size = len(text)
+        self.buffer_truncated = False
+
+    def execute(self, line, on_cant_execute=None):
+        handlers = self.handlers
+        if len(handlers) == 1 and isinstance(handlers[0], MultiLineContext.FinishedHandler):
+            # fast path: there is nothing to dispatch
+            handlers[0].try_execute(line)
+        else:
+            super().execute(line, on_cant_execute)
 
     def to_buffer(self, line):
-        self.buffer += line
+        buffer_size = self.buffer_size + len(line)
+        if self.max_buffer_size is not None and buffer_size > self.max_buffer_size:
+            if self.overflow_policy == OVERFLOW_TRUNCATE:
+                line = line[:self.max_buffer_size - self.buffer_size]
+                buffer_size = self.max_buffer_size
+                self.buffer_truncated = True
+            else:
+                self.on_buffer_overflow(self.make_overflow_error())
+                return
+
+        if line:
+            self._chunks.append(line)
+        self.buffer_size = buffer_size
+
+    def make_overflow_error(self):
+        return BufferOverflow('The input exceeds the maximum size of {0} characters'.format(self.max_buffer_size))
+
+    def on_buffer_overflow(self, error):
+        self.buffer = ''
+        self.write('{0}\n'.format(error))
+        self.exit()
 
     @abc.abstractmethod
     def on_finished(self):
@@ -114,16 +925,66 @@ class MultiLineContext(CommandContext):
 
 
 class JsonContext(MultiLineContext):
+    """
+    Reads a JSON document and passes it to the callback.
+    By default the input is decoded when it's over (two empty lines in a row).
+    In the incremental mode the lines are validated as they arrive (see pymander.jsonstream):
+    errors are reported at the offending line and the context is exited as soon as
+    the document is complete. With json_lines=True (implies incremental) the callback is called
+    for every document of a JSON Lines input until the input is over.
+    loads is the function used for decoding documents (json.loads by default).
+    """
     FinishedHandler = MultiLineContext.OverOn2EmptyLines
+    incremental = False
+    json_lines = False
 
     def __init__(self, *args, **kwargs):
         self.callback = kwargs.pop('callback', lambda data: None)
         self.error = kwargs.pop('error', lambda err: self.write('{0}\n'.format(str(err))))
+        self.json_lines = kwargs.pop('json_lines', self.json_lines)
+        self.incremental = kwargs.pop('incremental', self.incremental) or self.json_lines
+        self.loads = kwargs.pop('loads', json.loads)
         super().__init__(*args, **kwargs)
+        self.decoder = None
+        if self.incremental:
+            self.decoder = IncrementalJsonDecoder(json_lines=self.json_lines, loads=self.loads)
+
+    def to_buffer(self, line):
+        if self.decoder is None:
+            super().to_buffer(line)
+            return
+
+        if self.max_buffer_size is not None and self.decoder.document_size + len(line) > self.max_buffer_size:
+            # a partial document is useless, so the input is never truncated here
+            self.on_buffer_overflow(self.make_overflow_error())
+            return
+
+        try:
+            documents = self.decoder.feed(line)
+
+        except ValueError as err:
+            self.error(err)
+            self.exit()
+            return
+
+        for data in documents:
+            self.callback(data)
+
+        if documents and not self.json_lines:
+            self.exit()
 
     def on_finished(self):
+        if self.decoder is not None:
+            try:
+                self.decoder.close()
+            except ValueError as err:
+                self.error(err)
+
+            self.exit()
+            return
+
         try:
-            data = json.loads(self.buffer)
+            data = self.loads(self.buffer)
 
         except ValueError as err:
             self.error(err)
@@ -133,56 +994,79 @@ class JsonContext(MultiLineContext):
         self.callback(data)
         self.exit()
 
+    def on_buffer_overflow(self, error):
+        self.buffer = ''
+        self.error(error)
+        self.exit()
+
     def prompt(self):
-        self.write('... ')
+        self.write_prompt('... ')
 
     def on_cant_execute(self, line):
         pass
 
 
 class StandardPrompt(CommandContext):
-    force_handlers = [EmptyLineHandler, EchoLineHandler, ExitLineHandler]
+    force_handlers = [EmptyLineHandler, EchoLineHandler, ExitLineHandler, JobsLineHandler, StatsLineHandler]
 
     def prompt(self):
-        if self.out_stream:
-            if self.name:
-                self.out_stream.write('{0} > '.format(self.name))
-            else:
-                self.out_stream.write('>>> ')
-            self.out_stream.flush()
+        if self.name:
+            self.write_prompt('{0} > '.format(self.name))
+        else:
+            self.write_prompt('>>> ')
 
     def on_cant_execute(self, line):
         self.write('Invalid command: {0}'.format(line))
 
 
 class PrebuiltCommandContext(CommandContext):
+    """
+    A context that generates its handlers from its own methods bound to handler classes
+    via the bind_* decorators. The handler classes are generated once per context class
+    and reused by all of its instances and clones.
+    """
 
-    def __init__(self, handlers=None, name=''):
-        self._handler_class_arg_sets = {}
-        methods = inspect.getmembers(self.__class__, predicate=inspect.isfunction)
-        for method_tuple in methods:
-            method = method_tuple[1]
+    def __init__(self, handlers=None, name='', ignore_force_handlers=False):
+        handlers = copy.copy(handlers or [])
+        if not ignore_force_handlers:
+            # clones get copies of the generated handlers along with the rest
+            handlers += [handler_class() for handler_class in self.get_prebuilt_handler_classes()]
+
+        super().__init__(handlers=handlers, name=name, ignore_force_handlers=ignore_force_handlers)
+
+    @classmethod
+    def get_prebuilt_handler_classes(cls):
+        handler_classes = cls.__dict__.get('_prebuilt_handler_classes')
+        if handler_classes is not None:
+            return handler_classes
+
+        handler_class_arg_sets = {}
+        methods = inspect.getmembers(cls, predicate=inspect.isfunction)
+        for method_name, method in methods:
             if getattr(method, '_bound_command', False):
                 handler_class = method._handler_class
-                handler_class_name = handler_class.__name__
-                if handler_class_name not in self._handler_class_arg_sets:
-                    self._handler_class_arg_sets[handler_class_name] = [
-                        '{0}.{1}'.format(self.__class__, handler_class_name), (handler_class,), {}
+                if handler_class not in handler_class_arg_sets:
+                    handler_class_arg_sets[handler_class] = [
+                        '{0}.{1}'.format(cls.__name__, handler_class.__name__), (handler_class,), {}
                     ]
 
                 redirect_method = (
                     lambda local_method: lambda handler_self, *args, **kwargs:
                     local_method(handler_self.context, *args, **kwargs)
                 )(method)
+                redirect_method.__name__ = method_name
+                redirect_method.__wrapped__ = method
                 redirect_method._bound_command = True
+                redirect_method._idempotent = getattr(method, '_idempotent', False)
                 redirect_method._args = method._args
                 redirect_method._kwargs = method._kwargs
 
-                handler_method_name = 'generated_method_{}'.format(uuid.uuid4().hex)
-                self._handler_class_arg_sets[handler_class_name][2][handler_method_name] = redirect_method
-
-        handlers = copy.copy(handlers) or [] + [
-            type(*handler_class_args)() for handler_class_args in self._handler_class_arg_sets.values()
-        ]
+                # keep the names (and thus the order) of the original methods
+                handler_method_name = 'generated_method_{0}'.format(method_name)
+                handler_class_arg_sets[handler_class][2][handler_method_name] = redirect_method
 
-        super().__init__(handlers=handlers, name=name)
+        handler_classes = tuple(
+            type(*handler_class_args) for handler_class_args in handler_class_arg_sets.values()
+        )
+        cls._prebuilt_handler_classes = handler_classes
+        return handler_classes
@@ -1,15 +1,44 @@
-from . import base_handlers
+import inspect
+
+from . import base_handlers, caching, jobs
 
 
 __all__ = (
-    'bind_to_handler', 'bind_command', 'bind_exact', 'bind_regex', 'bind_argparse'
+    'bind_to_handler', 'bind_command', 'bind_exact', 'bind_regex', 'bind_argparse',
+    'bind_fast_argparse'
 )
 
 
-def bind_to_handler(handler_class, *args, **kwargs):
+def bind_to_handler(handler_class, *args, background=False, executor=jobs.JOB_THREAD,
+                    cache=False, cache_ttl=None, cache_size=128, idempotent=None, **kwargs):
+    """
+    Bind a method to a handler class as a command.
+    With background=True the command is run as a background job in a thread or process pool
+    (executor is 'thread', 'process' or an Executor instance, see pymander.jobs).
+    With cache=True the output and the result of the command are cached for every distinct set
+    of arguments: up to cache_size sets for up to cache_ttl seconds (see pymander.caching).
+    Cached results of a context are forgotten whenever a command that isn't idempotent
+    is executed in it. Cached commands are idempotent, other read-only commands
+    can be marked with idempotent=True so that they don't clear the cache.
+    Commands defined with async def can't be cached (the result would be a coroutine, which can only be awaited once)
+    or run in the background (a job would only create the coroutine, see AsyncCommander for running them concurrently).
+    """
+    if cache and background:
+        raise ValueError('Background commands can\'t be cached')
+
     def decorator(method):
+        if cache and inspect.iscoroutinefunction(method):
+            raise ValueError('Async commands can\'t be cached')
+        if background and inspect.iscoroutinefunction(method):
+            raise ValueError('Async commands can\'t be run in the background')
+        if background:
+            method = jobs.run_in_background(method, executor)
+        if cache:
+            method = caching.cache_results(method, cache_ttl, cache_size)
+
         method._bound_command = True
         method._handler_class = handler_class
+        method._idempotent = cache if idempotent is None else idempotent
         method._args = args
         method._kwargs = kwargs
         return method
@@ -31,3 +60,7 @@ def bind_regex(*args, **kwargs):
 
 def bind_argparse(*args, **kwargs):
     return bind_to_handler(base_handlers.ArgparseLineHandler, *args, **kwargs)
+
+
+def bind_fast_argparse(*args, **kwargs):
+    return bind_to_handler(base_handlers.FastArgparseLineHandler, *args, **kwargs)
@@ -1,4 +1,4 @@
-__all__ = ('CantParseLine', 'SkipExecution', 'ExitContext', 'ExitMainloop')
+__all__ = ('CantParseLine', 'SkipExecution', 'ExitContext', 'ExitMainloop', 'BufferOverflow')
 
 
 class CantParseLine(Exception):
@@ -15,3 +15,7 @@ class ExitContext(Exception):
 
 class ExitMainloop(Exception):
     pass
+
+
+class BufferOverflow(Exception):
+    pass
@@ -0,0 +1,322 @@
+"""
+A lightweight alternative to argparse for parsing the arguments of bind_argparse commands.
+
+Option specs are compiled into a CompiledCommand once; parsing a line then takes
+a single pass over its tokens. The compiled parser only handles the unambiguous
+cases itself. Whenever argparse might behave in a special way (help, abbreviated
+or clustered options, '--', negative numbers, errors, etc.) it returns FALLBACK,
+and the caller is expected to ask argparse instead, which guarantees identical results.
+"""
+import argparse
+import copy
+import re
+
+
+__all__ = ('FALLBACK', 'NotCompilable', 'CompiledCommand')
+
+
+class _Fallback:
+    """Type of the FALLBACK sentinel."""
+    def __repr__(self):
+        return 'FALLBACK'
+
+
+# returned by CompiledCommand.parse when the line must be parsed by argparse
+FALLBACK = _Fallback()
+
+
+class NotCompilable(Exception):
+    """Raised for option specs that the compiled parser does not support."""
+
+
+class _ArgumentError(Exception):
+    pass
+
+
+_SUPPORTED_KWARGS = frozenset(
+    ('action', 'nargs', 'const', 'default', 'type', 'choices', 'required', 'help', 'metavar', 'dest')
+)
+_ACTION_NARGS = {
+    'store': None, 'append': None,
+    'store_const': 0, 'store_true': 0, 'store_false': 0, 'append_const': 0, 'count': 0,
+}
+_NARGS_PATTERNS = {None: '(A)', '?': '(A?)', '*': '(A*)', '+': '(A+)'}
+
+
+def _copy_items(items):
+    """Mimics argparse._copy_items"""
+    if items is None:
+        return []
+
+    if type(items) is list:
+        return items[:]
+
+    return copy.copy(items)
+
+
+class _Argument:
+    def __init__(self, args, kwargs):
+        unsupported = set(kwargs) - _SUPPORTED_KWARGS
+        if unsupported or not args or not all(isinstance(arg, str) for arg in args):
+            raise NotCompilable
+
+        self.action = kwargs.get('action', 'store')
+        if self.action not in _ACTION_NARGS:
+            raise NotCompilable
+
+        if args[0][:1] != '-':
+            # positional argument
+            if len(args) != 1 or self.action != 'store' or {'dest', 'required', 'const'} & set(kwargs):
+                raise NotCompilable
+
+            self.option_strings = ()
+            self.dest = args[0]
+
+        else:
+            if not all(len(arg) > 1 and arg[0] == '-' for arg in args):
+                raise NotCompilable
+
+            self.option_strings = tuple(args)
+            self.dest = kwargs.get('dest')
+            if self.dest is None:
+                long_option_strings = [arg for arg in args if arg[1] == '-']
+                self.dest = (long_option_strings or args)[0].lstrip('-').replace('-', '_')
+                if not self.dest:
+                    raise NotCompilable
+
+        if self.action == 'store' or self.action == 'append':
+            self.nargs = kwargs.get('nargs')
+            if not (self.nargs in (None, '?', '*', '+') or isinstance(self.nargs, int) and self.nargs > 0):
+                raise NotCompilable
+        else:
+            if 'nargs' in kwargs:
+                raise NotCompilable
+            self.nargs = 0
+
+        self.const = kwargs.get('const')
+        self.default = kwargs.get('default')
+        if self.action == 'store_true':
+            self.const = True
+            self.default = kwargs.get('default', False)
+        elif self.action == 'store_false':
+            self.const = False
+            self.default = kwargs.get('default', True)
+
+        if isinstance(self.default, str) and self.default == argparse.SUPPRESS:
+            raise NotCompilable
+
+        self.type = kwargs.get('type')
+        if self.type is not None and not callable(self.type):
+            raise NotCompilable
+
+        self.choices = kwargs.get('choices')
+        self.required = kwargs.get('required', False)
+
+    def nargs_pattern(self):
+        if isinstance(self.nargs, int):
+            return '(A{{{0}}})'.format(self.nargs)
+
+        return _NARGS_PATTERNS[self.nargs]
+
+    def convert(self, arg_string):
+        if self.type is None:
+            return arg_string
+
+        try:
+            return self.type(arg_string)
+        except (argparse.ArgumentTypeError, TypeError, ValueError):
+            raise _ArgumentError
+
+    def check(self, value):
+        if self.choices is not None and value not in self.choices:
+            raise _ArgumentError
+
+    def get_values(self, arg_strings):
+        """Mimics ArgumentParser._get_values"""
+        if not arg_strings and self.nargs == '?':
+            value = self.const if self.option_strings else self.default
+            if isinstance(value, str):
+                value = self.convert(value)
+                self.check(value)
+
+        elif not arg_strings and self.nargs == '*' and not self.option_strings:
+            if self.choices is not None:
+                raise _ArgumentError  # leave this corner case to argparse
+
+            value = self.default if self.default is not None else []
+
+        elif len(arg_strings) == 1 and self.nargs in (None, '?'):
+            value = self.convert(arg_strings[0])
+            self.check(value)
+
+        else:
+            value = [self.convert(arg_string) for arg_string in arg_strings]
+            for item in value:
+                self.check(item)
+
+        return value
+
+    def apply(self, namespace, arg_strings):
+        """Mimics the standard argparse actions"""
+        action = self.action
+        if action == 'store':
+            namespace[self.dest] = self.get_values(arg_strings)
+        elif action == 'append':
+            items = _copy_items(namespace.get(self.dest))
+            items.append(self.get_values(arg_strings))
+            namespace[self.dest] = items
+        elif action == 'append_const':
+            items = _copy_items(namespace.get(self.dest))
+            items.append(self.const)
+            namespace[self.dest] = items
+        elif action == 'count':
+            count = namespace.get(self.dest)
+            namespace[self.dest] = (0 if count is None else count) + 1
+        else:
+            namespace[self.dest] = self.const
+
+
+class CompiledCommand:
+    """
+    Parser for the arguments of a single command compiled from its bind_argparse option specs.
+    Raises NotCompilable if the specs use features the compiled parser doesn't support.
+    """
+
+    def __init__(self, options):
+        self.arguments = []
+        for option in options:
+            if isinstance(option, str):
+                option = (option,)
+            option_args = [item for item in option if isinstance(item, str)]
+            option_kwargs_l = [item for item in option if isinstance(item, dict)]
+            if len(option_args) + len(option_kwargs_l) != len(option) or len(option_kwargs_l) > 1:
+                raise NotCompilable
+            self.arguments.append(_Argument(option_args, option_kwargs_l[0] if option_kwargs_l else {}))
+
+        self.positionals = [argument for argument in self.arguments if not argument.option_strings]
+        self.positional_regex = re.compile(
+            ''.join(argument.nargs_pattern() for argument in self.positionals)
+        )
+        self.required_options = [
+            argument for argument in self.arguments if argument.option_strings and argument.required
+        ]
+
+        self.option_string_arguments = {}
+        for argument in self.arguments:
+            for option_string in argument.option_strings:
+                if option_string in self.option_string_arguments or option_string in ('-h', '--help'):
+                    raise NotCompilable  # argparse will report the conflict
+                self.option_string_arguments[option_string] = argument
+
+        positional_dests = [argument.dest for argument in self.positionals]
+        if len(set(positional_dests)) != len(positional_dests) or set(positional_dests) & {
+            argument.dest for argument in self.arguments if argument.option_strings
+        }:
+            raise NotCompilable  # the order of actions would matter
+
+        self.defaults = {}
+        for argument in self.arguments:
+            if argument.dest not in self.defaults:
+                self.defaults[argument.dest] = argument.default
+
+    def _parse_option(self, tokens, index):
+        """Return (argument, explicit_arg) for an option token or raise _ArgumentError."""
+        token = tokens[index]
+        argument = self.option_string_arguments.get(token)
+        if argument is not None:
+            return argument, None
+
+        if '=' in token:
+            option_string, explicit_arg = token.split('=', 1)
+            argument = self.option_string_arguments.get(option_string)
+            if argument is not None:
+                return argument, explicit_arg
+
+        # help, abbreviations, clusters, negative numbers, unknown options...
+        raise _ArgumentError
+
+    def parse(self, tokens):
+        """Return a dict of parsed arguments for the tokens following the command name, or FALLBACK."""
+        try:
+            return self._parse(tokens)
+        except _ArgumentError:
+            return FALLBACK
+
+    def _parse(self, tokens):
+        namespace = self.defaults.copy()
+        seen = set()
+        positional_strings = None
+        positionals_finished = False
+
+        index = 0
+        token_count = len(tokens)
+        while index < token_count:
+            token = tokens[index]
+            if token[:1] != '-':
+                if positionals_finished:
+                    # positionals interleaved with options: leave it to argparse
+                    raise _ArgumentError
+                if positional_strings is None:
+                    positional_strings = []
+                positional_strings.append(token)
+                index += 1
+                continue
+
+            if positional_strings is not None:
+                positionals_finished = True
+
+            argument, explicit_arg = self._parse_option(tokens, index)
+            index += 1
+            nargs = argument.nargs
+            if explicit_arg is not None:
+                if nargs == 0 or isinstance(nargs, int) and nargs > 1:
+                    raise _ArgumentError
+                arg_strings = [explicit_arg]
+
+            else:
+                available = 0
+                while index + available < token_count and tokens[index + available][:1] != '-':
+                    available += 1
+
+                if nargs is None:
+                    count = 1
+                elif nargs == '?':
+                    count = min(available, 1)
+                elif nargs == '*' or nargs == '+':
+                    count = available
+                else:
+                    count = nargs
+
+                if count > available or nargs == '+' and not count:
+                    raise _ArgumentError
+
+                arg_strings = tokens[index:index + count]
+                index += count
+
+            argument.apply(namespace, arg_strings)
+            seen.add(argument)
+
+        # allocate positional strings the same way argparse does
+        positional_strings = positional_strings or []
+        match = self.positional_regex.match('A' * len(positional_strings))
+        if match is None or match.end() != len(positional_strings):
+            raise _ArgumentError
+
+        start = 0
+        for argument, group in zip(self.positionals, match.groups()):
+            argument.apply(namespace, positional_strings[start:start + len(group)])
+            start += len(group)
+            seen.add(argument)
+
+        for argument in self.required_options:
+            if argument not in seen:
+                raise _ArgumentError
+
+        for argument in self.arguments:
+            if (
+                argument not in seen and isinstance(argument.default, str)
+                and namespace[argument.dest] is argument.default
+            ):
+                namespace[argument.dest] = argument.convert(argument.default)
+
+        return namespace
@@ -1,12 +1,17 @@
-from .exceptions import CantParseLine, SkipExecution
-from .base_handlers import LineHandler, RegexLineHandler, ExactLineHandler, ArgparseLineHandler
+import json
+import re
 
-from . import decorators
+from .base_handlers import NO_MATCH, LineHandler, CommandLineHandler, RegexLineHandler, \
+    ExactLineHandler, ArgparseLineHandler, FastArgparseLineHandler
+
+from .line import Line
+from . import decorators, pipelines
 
 
 __all__ = (
-    'LineHandler', 'RegexLineHandler', 'ExactLineHandler', 'ArgparseLineHandler',
-    'ExitLineHandler', 'EmptyLineHandler', 'EchoLineHandler'
+    'NO_MATCH', 'LineHandler', 'CommandLineHandler', 'RegexLineHandler', 'ExactLineHandler',
+    'ArgparseLineHandler', 'FastArgparseLineHandler', 'ExitLineHandler', 'EmptyLineHandler', 'EchoLineHandler',
+    'JobsLineHandler', 'StatsLineHandler', 'PipeFilterLineHandler',
 )
 
 
@@ -18,15 +23,122 @@ class ExitLineHandler(ExactLineHandler):
         self.context.exit()
 
 
-class EmptyLineHandler(LineHandler):
+class EmptyLineHandler(CommandLineHandler):
     """Just ignores empty lines."""
-    def try_execute(self, line):
-        if line.strip():
-            raise CantParseLine(line)
+    deterministic = True
+
+    def get_keywords(self):
+        if not self.matches_only_bound_commands(EmptyLineHandler):
+            # a subclass might accept other lines too
+            return None
+
+        return {''}
+
+    def resolve(self, line):
+        if (line.stripped if type(line) is Line else line.strip()):
+            return NO_MATCH
+
+        return None, {}
 
 
 class EchoLineHandler(RegexLineHandler):
     """Imitates the 'echo' shell command."""
-    @decorators.bind_command(r'^echo (?P<what>.*)\n?')
+    @decorators.bind_command(r'^echo (?P<what>.*)\n?', idempotent=True)
     def echo(self, what):
         self.context.write('{0}\n'.format(what))
+
+
+class JobsLineHandler(RegexLineHandler):
+    """Controls background jobs: 'jobs', 'wait [<id>]' and 'cancel <id>'."""
+    @decorators.bind_command(r'^jobs$', idempotent=True)
+    def jobs(self):
+        self.context.get_job_manager().list_jobs()
+
+    @decorators.bind_command(r'^wait$')
+    def wait_all(self):
+        self.context.get_job_manager().wait()
+
+    @decorators.bind_command(r'^wait (?P<job_id>\d+)$')
+    def wait(self, job_id):
+        self.context.get_job_manager().wait(int(job_id))
+
+    @decorators.bind_command(r'^cancel (?P<job_id>\d+)$')
+    def cancel(self, job_id):
+        self.context.get_job_manager().cancel(int(job_id))
+
+
+class StatsLineHandler(ExactLineHandler):
+    """Shows the metrics collected in the context (see pymander.metrics)."""
+    @decorators.bind_command('stats', idempotent=True)
+    def stats(self):
+        if self.context.metrics is None:
+            self.context.write('Metrics are disabled\n')
+        else:
+            self.context.write(self.context.metrics.format_stats())
+
+    @decorators.bind_command('stats json', idempotent=True)
+    def stats_json(self):
+        if self.context.metrics is None:
+            self.context.write('Metrics are disabled\n')
+        else:
+            self.context.write('{0}\n'.format(json.dumps(self.context.metrics.snapshot(), indent=2)))
+
+    @decorators.bind_command('stats reset')
+    def stats_reset(self):
+        if self.context.metrics is not None:
+            self.context.metrics.reset()
+
+
+class PipeFilterLineHandler(RegexLineHandler):
+    """
+    Filters the output of the previous stage of a pipeline (see pymander.pipelines):
+    'grep [-v] [-i] <regex>', 'head [[-n] N]', 'tail [[-n] N]' and 'wc -l'.
+    """
+    def get_input(self):
+        lines = self.context.pipe_input
+        if lines is None:
+            self.context.write('Filters can only be used in a pipeline, e.g.: ls | grep txt\n')
+
+        return lines
+
+    @decorators.bind_command(r'^grep(?P<flags>(?:\s+-[vi]+)*)\s+(?P<pattern>.+?)\s*$', idempotent=True)
+    def grep(self, flags, pattern):
+        lines = self.get_input()
+        if lines is None:
+            return None
+
+        if len(pattern) > 1 and pattern[0] == pattern[-1] and pattern[0] in '\'"':
+            pattern = pattern[1:-1]
+        try:
+            # compiled right away: the filter only runs once the output is streamed
+            regex = re.compile(pattern, re.IGNORECASE if 'i' in flags else 0)
+        except re.error as err:
+            pipelines.close_iterator(lines)
+            self.context.write('Invalid regular expression: {0}\n'.format(err))
+            return None
+
+        return pipelines.grep(lines, regex, invert='v' in flags)
+
+    @decorators.bind_command(r'^head(?:\s+(?:-n\s*)?(?P<count>\d+))?\s*$', idempotent=True)
+    def head(self, count):
+        lines = self.get_input()
+        if lines is None:
+            return None
+
+        return pipelines.head(lines, int(count) if count else 10)
+
+    @decorators.bind_command(r'^tail(?:\s+(?:-n\s*)?(?P<count>\d+))?\s*$', idempotent=True)
+    def tail(self, count):
+        lines = self.get_input()
+        if lines is None:
+            return None
+
+        return pipelines.tail(lines, int(count) if count else 10)
+
+    @decorators.bind_command(r'^wc\s+-l\s*$', idempotent=True)
+    def wc(self):
+        lines = self.get_input()
+        if lines is None:
+            return None
+
+        return pipelines.count_lines(lines)
@@ -0,0 +1,212 @@
+"""
+Background execution of commands bound with background=True (see the bind_* decorators).
+
+A background command is submitted to a shared thread or process pool and returns at once.
+Every context has its own JobManager (created on first use) that keeps track of its jobs.
+Whatever a job writes to its context is captured and written out by the main thread
+when the job is reported: before the next prompt, or by the 'wait' command (see JobsLineHandler).
+"""
+import collections
+import concurrent.futures
+import functools
+import threading
+
+from .base_handlers import LineHandler
+
+
+__all__ = ('JOB_THREAD', 'JOB_PROCESS', 'Job', 'JobManager', 'run_in_background', 'get_executor')
+
+
+# executor kinds
+JOB_THREAD = 'thread'
+JOB_PROCESS = 'process'
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# the job run by the current thread, if any
+_current_job = threading.local()
+
+
+def get_executor(executor):
+    """Return the shared pool for an executor kind or the executor itself if it is an Executor instance."""
+    if isinstance(executor, concurrent.futures.Executor):
+        return executor
+
+    with _executors_lock:
+        if executor not in _executors:
+            if executor == JOB_THREAD:
+                _executors[executor] = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='pymander-job')
+            elif executor == JOB_PROCESS:
+                _executors[executor] = concurrent.futures.ProcessPoolExecutor()
+            else:
+                raise ValueError('Unknown executor: {0}'.format(executor))
+
+        return _executors[executor]
+
+
+def _is_process_executor(executor):
+    return executor == JOB_PROCESS or isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+
+
+class _OutputCollector:
+    """
+    Stands in for the handler or context of a command run in another process.
+    Collects whatever the command writes; it is sent back along with the result.
+    """
+    def __init__(self):
+        self.output = []
+        self.context = self
+
+    def write(self, text):
+        self.output.append(text)
+
+    def flush(self):
+        pass
+
+
+def _run_in_thread(job, method, owner, args, kwargs):
+    _current_job.job = job
+    try:
+        return method(owner, *args, **kwargs)
+    finally:
+        _current_job.job = None
+
+
+def _run_in_process(owner_class, method_name, args, kwargs):
+    collector = _OutputCollector()
+    method = getattr(owner_class, method_name).__wrapped__
+    result = method(collector, *args, **kwargs)
+    return result, ''.join(collector.output)
+
+
+class Job:
+    def __init__(self, job_id, name, in_process=False):
+        self.id = job_id
+        self.name = name
+        self.in_process = in_process
+        self.future = None
+        self.output = []
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.running():
+            return 'running'
+        if not self.future.done():
+            return 'pending'
+        if self.future.exception() is not None:
+            return 'failed'
+
+        return 'done'
+
+    @property
+    def result(self):
+        """The return value of the command. Must only be used when the job is done."""
+        result = self.future.result()
+        if self.in_process:
+            return result[0]
+
+        return result
+
+    def get_output(self):
+        if self.in_process and self.status == 'done':
+            return self.future.result()[1]
+
+        return ''.join(self.output)
+
+
+class JobManager:
+    """Keeps track of the background jobs of a context (see CommandContext.get_job_manager)."""
+    def __init__(self, context):
+        self.context = context
+        self.jobs = collections.OrderedDict()
+        self._last_id = 0
+
+    def submit(self, method, owner, args, kwargs, executor=JOB_THREAD):
+        """Start a job that calls method(owner, *args, **kwargs) and return it."""
+        self._last_id += 1
+        job = Job(self._last_id, method.__name__, in_process=_is_process_executor(executor))
+        if job.in_process:
+            job.future = get_executor(executor).submit(_run_in_process, type(owner), method.__name__, args, kwargs)
+        else:
+            job.future = get_executor(executor).submit(_run_in_thread, job, method, owner, args, kwargs)
+
+        self.jobs[job.id] = job
+        self.context.write('[{0}] {1} started\n'.format(job.id, job.name))
+        return job
+
+    def capture(self, text):
+        """Add the text to the output of the job run by the current thread. Return False if there is no such job."""
+        job = getattr(_current_job, 'job', None)
+        if job is None:
+            return False
+
+        job.output.append(text)
+        return True
+
+    def get_job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            self.context.write('No such job: {0}\n'.format(job_id))
+
+        return job
+
+    def report(self, job):
+        """Write the output and the outcome of a finished job and forget it."""
+        del self.jobs[job.id]
+        status = job.status
+        self.context.write(job.get_output())
+        if status == 'failed':
+            error = job.future.exception()
+            self.context.write('[{0}] {1} failed: {2}: {3}\n'.format(
+                job.id, job.name, error.__class__.__name__, error
+            ))
+        else:
+            self.context.write('[{0}] {1} {2}\n'.format(job.id, job.name, status))
+
+    def report_finished(self):
+        for job in [job for job in self.jobs.values() if job.future.done()]:
+            self.report(job)
+
+    def list_jobs(self):
+        for job in self.jobs.values():
+            self.context.write('[{0}] {1} {2}\n'.format(job.id, job.name, job.status))
+
+    def wait(self, job_id=None):
+        """Wait for a job (or all jobs if job_id is None) to finish and report it."""
+        jobs = list(self.jobs.values()) if job_id is None else [self.get_job(job_id)]
+        for job in jobs:
+            if job is not None:
+                concurrent.futures.wait([job.future])
+                self.report(job)
+
+    def cancel(self, job_id):
+        """Cancel a job that hasn't started yet. Running jobs can't be interrupted."""
+        job = self.get_job(job_id)
+        if job is None:
+            return
+
+        if job.future.cancel():
+            self.report(job)
+        else:
+            self.context.write('[{0}] {1} is {2} and can\'t be cancelled\n'.format(job.id, job.name, job.status))
+
+
+def run_in_background(method, executor=JOB_THREAD):
+    """
+    Wrap a command method so that it is submitted to the job manager of its context.
+    The method may belong to a handler or to a context (see PrebuiltCommandContext).
+    Methods run in a process get a stand-in for self that only supports write
+    (and self.context.write), and their class must be importable.
+    """
+    if not isinstance(executor, concurrent.futures.Executor) and executor not in (JOB_THREAD, JOB_PROCESS):
+        raise ValueError('Unknown executor: {0}'.format(executor))
+
+    @functools.wraps(method)
+    def background_method(self, *args, **kwargs):
+        context = self.context if isinstance(self, LineHandler) else self
+        return context.get_job_manager().submit(method, self, args, kwargs, executor)
+
+    return background_method
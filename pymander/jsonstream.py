@@ -0,0 +1,193 @@
+"""
+Incremental decoding of JSON documents fed line by line (see JsonContext).
+
+The input is tokenized and checked against the JSON grammar as the lines arrive,
+so syntax errors are reported at the offending line and the end of a document is known
+as soon as its last token arrives. Values that fit in a line are validated at once by
+the C scanner of the json module. The text of a complete document is then decoded by
+a loads function (json.loads by default, any compatible faster implementation can be used).
+JSON tokens can't contain line breaks, so every line can be tokenized on its own.
+"""
+import json
+import json.scanner
+import re
+
+
+__all__ = ('IncrementalJsonDecoder',)
+
+
+_TOKEN_RE = re.compile(r'''
+    [ \t\n\r]*
+    (?:
+        ([\[\]{}:,])                                                       # 1: punctuation
+      | ("(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*")         # 2: string
+      | (-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?              # 3: number or literal
+         |true|false|null|NaN|-?Infinity)
+      | ([^ \t\n\r])                                                     # 4: anything else
+    )
+''', re.VERBOSE | re.DOTALL)
+
+# parser states
+_VALUE = 0  # at the beginning of a document, after ':' and after ',' in an array
+_VALUE_OR_CLOSE = 1  # after '['
+_KEY_OR_CLOSE = 2  # after '{'
+_KEY = 3  # after ',' in an object
+_COLON = 4  # after a key
+_COMMA_OR_CLOSE = 5  # after a value in an array or an object
+_DONE = 6  # after a complete document (if only one is expected)
+
+_ERROR_MESSAGES = {
+    _VALUE: 'Expecting value',
+    _VALUE_OR_CLOSE: 'Expecting value',
+    _KEY_OR_CLOSE: 'Expecting property name enclosed in double quotes',
+    _KEY: 'Expecting property name enclosed in double quotes',
+    _COLON: "Expecting ':' delimiter",
+    _COMMA_OR_CLOSE: "Expecting ',' delimiter",
+    _DONE: 'Extra data',
+}
+
+
+def _make_error(message, line, line_number, column):
+    """A JSONDecodeError pointing at a position in the given input line."""
+    error = json.JSONDecodeError(message, line, column)
+    error.lineno = line_number
+    error.colno = column + 1
+    error.args = ('{0}: line {1} column {2}'.format(message, line_number, column + 1),)
+    return error
+
+
+class IncrementalJsonDecoder:
+    """
+    Decodes JSON documents from lines fed one at a time.
+    With json_lines=True any number of documents can follow each other (JSON Lines),
+    otherwise any data after the first document is an error.
+    """
+    def __init__(self, json_lines=False, loads=json.loads):
+        self.json_lines = json_lines
+        self.loads = loads
+        self.line_number = 0
+        self.document_count = 0
+        self.document_size = 0
+        self._state = _VALUE
+        self._stack = []
+        self._chunks = []
+        self._scan_once = json.scanner.make_scanner(json.JSONDecoder())
+
+    @property
+    def in_document(self):
+        """True if a document has started but isn't complete yet."""
+        return bool(self._stack)
+
+    def feed(self, line):
+        """
+        Consume a line. Return the list of documents completed by it.
+        Raises json.JSONDecodeError at the first syntax error.
+        """
+        self.line_number += 1
+        if not self._stack and self._state == _VALUE:
+            # a whole document on a single line is common for JSON Lines, let the fast loads check it
+            try:
+                document = self.loads(line)
+            except ValueError:
+                pass
+            else:
+                self.document_count += 1
+                if not self.json_lines:
+                    self._state = _DONE
+                return [document]
+
+        documents = []
+        state = self._state
+        stack = self._stack
+        document_start = 0 if stack else None
+        pos = 0
+        while True:
+            match = _TOKEN_RE.match(line, pos)
+            if match is None:
+                break  # only whitespace is left
+
+            kind = match.lastindex
+            start = match.start(kind)
+            pos = match.end()
+            if state == _VALUE or state == _VALUE_OR_CLOSE:
+                if kind == 4 or kind == 1 and line[start] not in '[{':
+                    if not (state == _VALUE_OR_CLOSE and line[start] == ']'):
+                        raise _make_error(_ERROR_MESSAGES[state], line, self.line_number, start)
+
+                else:
+                    if not stack:
+                        document_start = start
+                    try:
+                        # let the C scanner validate values that don't span lines at once
+                        pos = self._scan_once(line, start)[1]
+                    except (StopIteration, ValueError):
+                        if kind != 1:
+                            raise _make_error(_ERROR_MESSAGES[state], line, self.line_number, start)
+
+                        # the value continues on the following lines
+                        stack.append(line[start])
+                        state = _VALUE_OR_CLOSE if line[start] == '[' else _KEY_OR_CLOSE
+                        continue
+
+                    if stack:
+                        state = _COMMA_OR_CLOSE
+                        continue
+
+                    self._chunks.append(line[document_start:pos])
+                    documents.append(self._decode())
+                    state = _VALUE if self.json_lines else _DONE
+                    continue
+
+            if kind == 2 and (state == _KEY or state == _KEY_OR_CLOSE):
+                state = _COLON
+                continue
+
+            char = line[start]
+            if kind != 1:
+                raise _make_error(_ERROR_MESSAGES[state], line, self.line_number, start)
+
+            elif char == ':':
+                if state != _COLON:
+                    raise _make_error(_ERROR_MESSAGES[state], line, self.line_number, start)
+                state = _VALUE
+
+            elif char == ',':
+                if state != _COMMA_OR_CLOSE:
+                    raise _make_error(_ERROR_MESSAGES[state], line, self.line_number, start)
+                state = _VALUE if stack[-1] == '[' else _KEY
+
+            elif (
+                char == ']' and (state == _COMMA_OR_CLOSE or state == _VALUE_OR_CLOSE) and stack[-1] == '['
+                or char == '}' and (state == _COMMA_OR_CLOSE or state == _KEY_OR_CLOSE) and stack[-1] == '{'
+            ):
+                stack.pop()
+                if stack:
+                    state = _COMMA_OR_CLOSE
+                    continue
+
+                self._chunks.append(line[document_start:pos])
+                documents.append(self._decode())
+                state = _VALUE if self.json_lines else _DONE
+
+            else:
+                raise _make_error(_ERROR_MESSAGES[state], line, self.line_number, start)
+
+        self._state = state
+        if stack:
+            chunk = line if document_start == 0 else line[document_start:]
+            self._chunks.append(chunk)
+            self.document_size += len(chunk)
+
+        return documents
+
+    def _decode(self):
+        text = ''.join(self._chunks)
+        self._chunks = []
+        self.document_size = 0
+        self.document_count += 1
+        return self.loads(text)
+
+    def close(self):
+        """Signal the end of input. Raises json.JSONDecodeError if a document is incomplete or missing."""
+        if self._stack or not self.json_lines and not self.document_count:
+            raise _make_error('Expecting value', '', self.line_number + 1, 0)
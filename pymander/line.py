@@ -0,0 +1,66 @@
+"""
+A line of input that is tokenized at most once.
+
+Contexts that have handlers declaring accepts_line (see LineHandler) wrap every dispatched line
+in a Line and pass it to all the handlers they try, so the handlers share the work of splitting
+the line via its memoized attributes (stripped, tokens, shlex_tokens, first_token).
+Line is a str, so handlers that treat it as a plain string keep working. Other contexts
+pass plain strings, as wrapping a line costs more than stripping or splitting it once.
+Handlers that use Line attributes should call as_line on their input, as they can also be
+called with a plain string.
+"""
+import shlex
+
+
+__all__ = ('Line', 'as_line')
+
+
+class _memoized:
+    """Like a property, but the value is computed on first access and stored in the instance."""
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+
+class Line(str):
+    """A line of input with lazily computed and memoized derived values. The values must not be modified."""
+
+    @_memoized
+    def stripped(self):
+        """The line without leading and trailing whitespace."""
+        return self.strip()
+
+    @_memoized
+    def tokens(self):
+        """The list of whitespace-separated tokens."""
+        return self.split()
+
+    @_memoized
+    def shlex_tokens(self):
+        """The list of tokens split the way a shell does (with quoting), or None if the quoting is broken."""
+        try:
+            return shlex.split(self)
+        except ValueError:
+            return None
+
+    @_memoized
+    def first_token(self):
+        """The first token ('' for an empty line)."""
+        tokens = self.tokens
+        return tokens[0] if tokens else ''
+
+
+def as_line(text):
+    """Return the text as a Line (as is if it already is one)."""
+    if type(text) is Line:
+        return text
+
+    return Line(text)
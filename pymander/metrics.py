@@ -0,0 +1,186 @@
+"""
+Instrumentation of command execution.
+
+Assign a Metrics instance to CommandContext.metrics, or pass it to the Commander,
+which assigns it to every context it enters. Contexts then record every dispatched line:
+the handler and command that accepted it, how long it took and how many handlers
+had been tried before (misses), or that no handler accepted it. The Commander records
+entering and exiting contexts.
+
+Events are passed to sinks: an InMemorySink that aggregates them is always present
+(it backs the 'stats' command, see StatsLineHandler), others can be added,
+e.g. a JsonLinesSink that writes every event as a line of JSON.
+Contexts without metrics (the default) only pay for a single attribute check per line.
+"""
+import bisect
+import collections
+import json
+import time
+
+
+__all__ = ('Metrics', 'Histogram', 'InMemorySink', 'JsonLinesSink', 'HISTOGRAM_BOUNDS')
+
+
+# upper bounds of the latency histogram buckets, in seconds
+HISTOGRAM_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self):
+        labels = ['<={0:g}'.format(bound) for bound in HISTOGRAM_BOUNDS] + ['>{0:g}'.format(HISTOGRAM_BOUNDS[-1])]
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean,
+            'max': self.max,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class InMemorySink:
+    """Aggregates events into counters and latency histograms."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # (context, handler, command) -> Histogram
+        self.commands = collections.OrderedDict()
+        # (context, handler, command) -> number of handlers tried before the accepting one
+        self.command_misses = collections.Counter()
+        # context -> number of lines no handler accepted
+        self.unmatched = collections.Counter()
+        # (event type, context) -> count
+        self.context_events = collections.Counter()
+
+    def record(self, event):
+        event_type = event['type']
+        if event_type == 'command':
+            key = (event['context'], event['handler'], event['command'])
+            histogram = self.commands.get(key)
+            if histogram is None:
+                histogram = self.commands[key] = Histogram()
+            histogram.add(event['duration'])
+            self.command_misses[key] += event['misses']
+
+        elif event_type == 'unmatched':
+            self.unmatched[event['context']] += 1
+
+        else:
+            self.context_events[(event_type, event['context'])] += 1
+
+    def snapshot(self):
+        """Return the aggregated metrics as a JSON-serializable dict."""
+        return {
+            'commands': [
+                dict(
+                    histogram.as_dict(), context=context, handler=handler, command=command,
+                    misses=self.command_misses[(context, handler, command)],
+                )
+                for (context, handler, command), histogram in self.commands.items()
+            ],
+            'unmatched': dict(self.unmatched),
+            'context_events': [
+                {'type': event_type, 'context': context, 'count': count}
+                for (event_type, context), count in sorted(self.context_events.items())
+            ],
+        }
+
+    def format(self):
+        """Return the aggregated metrics as a human-readable table."""
+        lines = ['{0:<48} {1:>8} {2:>10} {3:>10} {4:>8}'.format('command', 'count', 'mean, ms', 'max, ms', 'misses')]
+        for key, histogram in self.commands.items():
+            lines.append('{0:<48} {1:>8} {2:>10.3f} {3:>10.3f} {4:>8}'.format(
+                '.'.join(part or '-' for part in key), histogram.count,
+                histogram.mean * 1000, histogram.max * 1000, self.command_misses[key],
+            ))
+
+        for context, count in sorted(self.unmatched.items()):
+            lines.append('Unmatched lines in {0}: {1}'.format(context, count))
+        for (event_type, context), count in sorted(self.context_events.items()):
+            lines.append('Context {0} ({1}): {2}'.format(event_type, context, count))
+
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """Writes every event as a line of JSON to a text stream or a file (given by path)."""
+    def __init__(self, stream_or_path):
+        self.own_stream = isinstance(stream_or_path, str)
+        self.stream = open(stream_or_path, 'a') if self.own_stream else stream_or_path
+
+    def record(self, event):
+        self.stream.write(json.dumps(event) + '\n')
+
+    def close(self):
+        if self.own_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class Metrics:
+    """Collects events of command execution and passes them to the sinks (see the module docstring)."""
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, sinks=None):
+        self.memory = InMemorySink()
+        self.sinks = [self.memory] + list(sinks or [])
+
+    def emit(self, event):
+        event['time'] = time.time()
+        for sink in self.sinks:
+            sink.record(event)
+
+    def record_command(self, context, handler, command, duration, misses, error=None):
+        self.emit({
+            'type': 'command', 'context': context.__class__.__name__, 'handler': handler.__class__.__name__,
+            'command': command, 'duration': duration, 'misses': misses, 'error': error,
+        })
+
+    def record_unmatched(self, context, misses):
+        self.emit({'type': 'unmatched', 'context': context.__class__.__name__, 'misses': misses})
+
+    def record_context_event(self, event_type, context):
+        """event_type is 'enter' or 'exit'."""
+        self.emit({'type': event_type, 'context': context.__class__.__name__})
+
+    def snapshot(self):
+        return self.memory.snapshot()
+
+    def format_stats(self):
+        return self.memory.format()
+
+    def dump(self, stream_or_path):
+        """Write the aggregated metrics as JSON to a text stream or a file."""
+        if isinstance(stream_or_path, str):
+            with open(stream_or_path, 'w') as stream:
+                json.dump(self.snapshot(), stream, indent=2)
+        else:
+            json.dump(self.snapshot(), stream_or_path, indent=2)
+
+    def reset(self):
+        self.memory.reset()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,308 @@
+import collections
+import re
+
+
+__all__ = ('CombinedRegex', 'literal_first_token')
+
+
+_GROUP_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_COMMENT_RE = re.compile(r'\(\?#(?:\\.|[^\\)])*\)')
+_GLOBAL_FLAGS = set('aiLmsux')
+
+
+def _pattern_string(pattern):
+    """
+    Return the source of a regular expression given as a string or as a compiled pattern,
+    or None if a compiled pattern can't be rewritten as a string (it has flags or is a bytes pattern).
+    """
+    if isinstance(pattern, str):
+        return pattern
+
+    if isinstance(pattern.pattern, str) and pattern.flags == re.UNICODE:
+        return pattern.pattern
+
+    return None
+
+
+class _NotCombinable(Exception):
+    pass
+
+
+def _namespace_pattern(pattern, prefix):
+    """
+    Rewrite a regular expression so that all of its named groups (and references to them)
+    get the given prefix. Returns (new_pattern, [(namespaced_name, original_name), ...]).
+    Raises _NotCombinable if the pattern cannot safely be embedded into a larger expression
+    (numbered backreferences, conditional groups, global inline flags).
+    """
+    result = []
+    names = []
+    pos = 0
+    length = len(pattern)
+    while pos < length:
+        char = pattern[pos]
+        if char == '\\':
+            escaped = pattern[pos + 1:pos + 2]
+            if escaped.isdigit() and escaped != '0':
+                raise _NotCombinable  # numbered backreference
+            result.append(pattern[pos:pos + 2])
+            pos += 2
+
+        elif char == '[':
+            # copy the whole character class as is
+            end = pos + 1
+            if pattern[end:end + 1] == '^':
+                end += 1
+            if pattern[end:end + 1] == ']':
+                end += 1
+            while end < length and pattern[end] != ']':
+                end += 2 if pattern[end] == '\\' else 1
+            result.append(pattern[pos:end + 1])
+            pos = end + 1
+
+        elif pattern.startswith('(?#', pos):
+            # copy comments as is, they may contain anything
+            comment_match = _COMMENT_RE.match(pattern, pos)
+            if not comment_match:
+                raise _NotCombinable
+            result.append(comment_match.group())
+            pos = comment_match.end()
+
+        elif pattern.startswith('(?P<', pos):
+            name_match = _GROUP_NAME_RE.match(pattern, pos + 4)
+            if not name_match or pattern[name_match.end():name_match.end() + 1] != '>':
+                raise _NotCombinable
+            name = name_match.group()
+            names.append((prefix + name, name))
+            result.append('(?P<{0}{1}>'.format(prefix, name))
+            pos = name_match.end() + 1
+
+        elif pattern.startswith('(?P=', pos):
+            name_match = _GROUP_NAME_RE.match(pattern, pos + 4)
+            if not name_match:
+                raise _NotCombinable
+            result.append('(?P={0}{1}'.format(prefix, name_match.group()))
+            pos = name_match.end()
+
+        elif pattern.startswith('(?(', pos):
+            raise _NotCombinable  # conditional group
+
+        elif pattern.startswith('(?', pos) and pattern[pos + 2:pos + 3] in _GLOBAL_FLAGS:
+            end = pos + 2
+            while end < length and pattern[end] in _GLOBAL_FLAGS:
+                end += 1
+            if pattern[end:end + 1] == ')':
+                raise _NotCombinable  # global inline flags, e.g. (?i)
+            result.append(pattern[pos:end])
+            pos = end
+
+        else:
+            result.append(char)
+            pos += 1
+
+    return ''.join(result), names
+
+
+class CombinedRegex:
+    """
+    Matches a line against an ordered list of regular expressions in a single pass.
+
+    Patterns are merged into one alternation, each wrapped in its own named group and with
+    its own named groups moved into a separate namespace, so the winning alternative
+    and its arguments can be recovered from the match object.
+    The first pattern (in list order) that matches wins, exactly like trying
+    ``re.match`` for each of them in turn.
+    Patterns that cannot be embedded into an alternation are kept as separate expressions,
+    preserving their position in the order. Patterns may be strings or compiled expressions.
+
+    Since the regex engine tries the alternatives in turn, patterns are also bucketed by the literal
+    first token of the lines they match (see literal_first_token): a line is only matched against
+    the alternation of the patterns for its first token and of the patterns without one.
+    """
+
+    def __init__(self, patterns):
+        patterns = list(patterns)
+        bucketed = collections.defaultdict(list)
+        wildcard_indices = []
+        for index, pattern in enumerate(patterns):
+            re.compile(pattern)  # report invalid expressions as is
+            keyword = literal_first_token(pattern)
+            if keyword is None:
+                wildcard_indices.append(index)
+            bucketed[keyword].append(index)
+
+        self.segments = _combine(patterns, wildcard_indices)
+        self.buckets = {
+            keyword: _combine(patterns, sorted(indices + wildcard_indices))
+            for keyword, indices in bucketed.items() if keyword is not None
+        }
+
+    def match(self, line, first_token=None):
+        """
+        Return (pattern_index, groupdict) for the first matching pattern or None.
+        first_token is the first whitespace-separated token of the line, if it is already known.
+        """
+        if self.buckets:
+            if first_token is None:
+                tokens = line.split(None, 1)
+                first_token = tokens[0] if tokens else ''
+            segments = self.buckets.get(first_token, self.segments)
+        else:
+            segments = self.segments
+
+        for regex, alternatives in segments:
+            match = regex.match(line)
+            if match is None:
+                continue
+
+            if isinstance(alternatives, int):
+                # a standalone expression
+                return alternatives, match.groupdict()
+
+            index, names = alternatives[match.lastgroup]
+            return index, {name: match.group(namespaced) for namespaced, name in names}
+
+        return None
+
+
+def _combine(patterns, indices):
+    """
+    Compile the patterns with the given indices (in order) into a list of (regex, alternatives) segments:
+    alternatives is {group name: (pattern index, [(namespaced name, name), ...])} for a combined regex
+    or the pattern index for a pattern that can't be combined.
+    """
+    segments = []
+    combined_parts = []
+    combined_alternatives = {}
+
+    def close_combined():
+        if not combined_parts:
+            return
+
+        try:
+            regex = re.compile('|'.join(combined_parts))
+        except re.error:
+            # fall back to matching the expressions one by one
+            for index, names in sorted(combined_alternatives.values()):
+                segments.append((re.compile(patterns[index]), index))
+        else:
+            segments.append((regex, combined_alternatives.copy()))
+
+        del combined_parts[:]
+        combined_alternatives.clear()
+
+    for index in indices:
+        pattern = patterns[index]
+        group_name = '_c{0}'.format(index)
+        try:
+            source = _pattern_string(pattern)
+            if source is None:
+                raise _NotCombinable  # a compiled pattern with flags
+            namespaced, names = _namespace_pattern(source, group_name + '_')
+        except _NotCombinable:
+            close_combined()
+            segments.append((re.compile(pattern), index))
+            continue
+
+        combined_parts.append('(?P<{0}>{1})'.format(group_name, namespaced))
+        combined_alternatives[group_name] = (index, names)
+
+    close_combined()
+    return segments
+
+
+_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+_QUANTIFIERS = set('?*+{')
+_WHITESPACE_ESCAPES = set('stnrfv')
+
+
+def _has_top_level_alternation(pattern):
+    depth = 0
+    pos = 0
+    length = len(pattern)
+    while pos < length:
+        char = pattern[pos]
+        if char == '\\':
+            pos += 2
+            continue
+
+        if char == '[':
+            pos += 1
+            if pattern[pos:pos + 1] == '^':
+                pos += 1
+            if pattern[pos:pos + 1] == ']':
+                pos += 1
+            while pos < length and pattern[pos] != ']':
+                pos += 2 if pattern[pos] == '\\' else 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+
+        pos += 1
+
+    return False
+
+
+def literal_first_token(pattern):
+    """
+    Return the literal word that every line matched by ``re.match(pattern, line)``
+    must start with as its first whitespace-separated token, or None if there is no such word
+    (e.g. the expression starts with a group or a character class).
+    """
+    pattern = _pattern_string(pattern)
+    if pattern is None:
+        return None
+
+    pos = 0
+    if pattern.startswith('^'):
+        pos = 1
+    elif pattern.startswith('\\A'):
+        pos = 2
+
+    chars = []
+    length = len(pattern)
+    while pos < length:
+        char = pattern[pos]
+        if char == '\\':
+            escaped = pattern[pos + 1:pos + 2]
+            if escaped == 'Z':
+                break
+            if escaped in _WHITESPACE_ESCAPES or escaped == ' ':
+                pos += 2
+                if pattern[pos:pos + 1] in _QUANTIFIERS and pattern[pos:pos + 1] != '+':
+                    return None  # optional separator
+                break
+            if escaped.isalnum() or not escaped or escaped.isspace():
+                return None
+            chars.append(escaped)
+            pos += 2
+
+        elif char in (' ', '\t'):
+            pos += 1
+            if pattern[pos:pos + 1] in _QUANTIFIERS and pattern[pos:pos + 1] != '+':
+                return None  # optional separator
+            break
+
+        elif char == '$':
+            break
+
+        elif char in _SPECIAL_CHARS or char.isspace():
+            return None
+
+        else:
+            chars.append(char)
+            pos += 1
+
+        if pattern[pos:pos + 1] in _QUANTIFIERS:
+            return None  # the last literal character is not mandatory
+    else:
+        # the expression may continue the word after its end: 'ls' matches 'lsx'
+        return None
+
+    if not chars or _has_top_level_alternation(pattern):
+        return None
+
+    return ''.join(chars)
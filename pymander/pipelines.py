@@ -0,0 +1,129 @@
+"""
+Pipelines of commands: 'ls | grep py | head 5'.
+
+Contexts with pipelines = True split lines at unquoted '|' characters (a '\\|' stands for a literal '|')
+and dispatch every stage through their handlers (see CommandContext.execute_pipeline).
+The output of a stage (whatever it writes or streams, see CommandContext.write_stream)
+is passed to the next stage as an iterator of lines, available as context.pipe_input
+while the next command is called. Stages are connected lazily: a line is only produced
+when the next stage asks for it, so 'head' stops the commands before it as soon as it has enough,
+and memory use doesn't depend on the size of the output.
+
+Filter commands must get context.pipe_input when they are called, so they are regular methods
+that return generators rather than generator methods (the body of a generator method
+only runs when the generator is iterated, and by then pipe_input belongs to another stage).
+The built-in filters (grep, head, tail and wc, see PipeFilterLineHandler) are built from
+the generators below.
+"""
+import collections
+import re
+
+
+__all__ = ('split_pipeline', 'iter_lines', 'close_iterator', 'chain_output', 'grep', 'head', 'tail', 'count_lines')
+
+
+_PIPELINE_TOKEN_REGEX = re.compile(r"""'[^']*'?|"(?:[^"\\]|\\.)*"?|\\\||\||[^'"\\|]+|\\""")
+
+
+def split_pipeline(line):
+    """
+    Split a line into the command lines of pipeline stages (without surrounding whitespace).
+    Returns a list with a single item if the line has no unquoted '|'.
+    """
+    stages = []
+    stage = []
+    for token in _PIPELINE_TOKEN_REGEX.findall(line):
+        if token == '|':
+            stages.append(''.join(stage).strip())
+            stage = []
+        elif token == '\\|':
+            stage.append('|')
+        else:
+            stage.append(token)
+
+    stages.append(''.join(stage).strip())
+    return stages
+
+
+def close_iterator(iterator):
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+
+
+def chain_output(written, chunks):
+    """Yield the output a command has written and then the chunks it streams."""
+    try:
+        yield from written
+        yield from chunks
+
+    finally:
+        close_iterator(chunks)
+
+
+def iter_lines(chunks):
+    """Turn an iterator of output chunks into an iterator of lines (the last one may lack a newline)."""
+    partial = ''
+    try:
+        for chunk in chunks:
+            if '\n' not in chunk:
+                partial += chunk
+                continue
+
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line + '\n'
+
+        if partial:
+            yield partial
+
+    finally:
+        close_iterator(chunks)
+
+
+def grep(lines, pattern, invert=False, ignore_case=False):
+    """
+    Yield the lines that match a regular expression (or that don't if invert is set).
+    pattern can be a string or a compiled regular expression (ignore_case only applies to strings).
+    """
+    if isinstance(pattern, str):
+        pattern = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    search = pattern.search
+    try:
+        for line in lines:
+            if (search(line) is None) == invert:
+                yield line
+
+    finally:
+        close_iterator(lines)
+
+
+def head(lines, count=10):
+    """Yield the first count lines and stop the input."""
+    try:
+        if count <= 0:
+            return
+
+        for index, line in enumerate(lines, 1):
+            yield line
+            if index >= count:
+                break
+
+    finally:
+        close_iterator(lines)
+
+
+def tail(lines, count=10):
+    """Yield the last count lines (only count lines are kept in memory)."""
+    last_lines = collections.deque(lines, maxlen=max(count, 0))
+    yield from last_lines
+
+
+def count_lines(lines):
+    """Yield the number of lines."""
+    count = 0
+    for count, _ in enumerate(lines, 1):
+        pass
+
+    yield '{0}\n'.format(count)
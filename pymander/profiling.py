@@ -0,0 +1,248 @@
+"""
+On-demand profiling of commands.
+
+ProfileLineHandler adds the 'profile' command, which is not enabled by default.
+Add it to the force handlers of a context class:
+
+    class MyPrompt(StandardPrompt):
+        force_handlers = StandardPrompt.force_handlers + [ProfileLineHandler]
+
+Then:
+    profile [--top N] [--sort KEY] [--save PATH] <command line>
+        runs the command line in the current context under cProfile and prints
+        the top functions (or saves the stats for pstats/snakeviz to PATH);
+        async commands are run to completion under the profiler, which isn't possible
+        in a running event loop (e.g. in an AsyncCommander), so they aren't profiled there
+    profile --sample SECONDS [--interval MS] [--top N]
+        samples the stacks of all commands run in the context during the time window
+        and prints the hottest functions when it's over (or on 'profile --report')
+
+Sampling stops as soon as the window is over, but the report is written by the thread that runs
+commands: before the next command or prompt, or when the output is flushed (e.g. when the
+context is exited). Use 'profile --report' to end the window early.
+"""
+import argparse
+import asyncio
+import collections
+import cProfile
+import inspect
+import io
+import pstats
+import re
+import sys
+import threading
+import time
+
+from .base_handlers import NO_MATCH, ArgparseLineHandler
+from .commander import run_awaitable
+from .decorators import bind_command
+
+
+__all__ = ('ProfileLineHandler', 'SamplingProfiler')
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of the thread that runs commands, while a command is running.
+    Counts how often every function is on top of the stack (own samples) and anywhere in it (total samples).
+    If duration is given, sampling stops once that many seconds have passed since start.
+    """
+    def __init__(self, interval=0.005, duration=None):
+        self.interval = interval
+        self.duration = duration
+        self.deadline = None
+        self.own_samples = collections.Counter()
+        self.total_samples = collections.Counter()
+        self.sample_count = 0
+        self.thread_id = None
+        self.active = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.duration is not None:
+            self.deadline = time.monotonic() + self.duration
+        self._thread = threading.Thread(target=self._run, name='pymander-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_over(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if self.is_over():
+                break
+            if self.active:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    self.take_sample(frame)
+
+    def take_sample(self, frame):
+        self.sample_count += 1
+        self.own_samples[self._describe(frame)] += 1
+        seen = set()
+        while frame is not None:
+            function = self._describe(frame)
+            if function not in seen:
+                seen.add(function)
+                self.total_samples[function] += 1
+            frame = frame.f_back
+
+    @staticmethod
+    def _describe(frame):
+        code = frame.f_code
+        return '{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno)
+
+    def format(self, top=20):
+        if not self.sample_count:
+            return 'No samples collected\n'
+
+        lines = ['{0} samples'.format(self.sample_count), '{0:>7} {1:>7}  {2}'.format('own %', 'total %', 'function')]
+        for function, count in self.own_samples.most_common(top):
+            lines.append('{0:>7.1f} {1:>7.1f}  {2}'.format(
+                count * 100.0 / self.sample_count, self.total_samples[function] * 100.0 / self.sample_count, function
+            ))
+
+        return '\n'.join(lines) + '\n'
+
+
+class ProfileLineHandler(ArgparseLineHandler):
+    """Profiles commands of its context (see pymander.profiling)."""
+
+    def __init__(self):
+        super().__init__()
+        self.sampler = None
+        self.sampling_top = None
+
+    @bind_command('profile', [
+        ['--top', '-n', {'type': int, 'default': 20, 'help': 'number of functions to show'}],
+        ['--sort', '-s', {'default': 'cumulative', 'help': 'pstats sort key'}],
+        ['--save', {'metavar': 'PATH', 'help': 'save the stats to a file instead of printing them'}],
+        ['--sample', {'type': float, 'metavar': 'SECONDS', 'help': 'sample all commands for a while'}],
+        ['--interval', {'type': float, 'default': 5.0, 'metavar': 'MS', 'help': 'sampling interval'}],
+        ['--report', {'action': 'store_true', 'help': 'stop sampling and report now'}],
+        ['line', {'nargs': argparse.REMAINDER, 'help': 'the command to profile'}],
+    ], help='profile a command', idempotent=True)
+    def profile(self, top, sort, save, sample, interval, report, line):
+        if report:
+            self.stop_sampling()
+        elif sample is not None:
+            self.start_sampling(sample, interval / 1000.0, top)
+        elif line:
+            return self.profile_line(line, top, sort, save)
+        else:
+            self.context.write('Nothing to profile\n')
+
+    def get_keywords(self):
+        return {'profile'}
+
+    def resolve(self, line):
+        resolved = super().resolve(line)
+        if resolved is NO_MATCH or resolved[0] is None:
+            return resolved
+
+        # argparse only gets the whitespace-separated tokens of the line,
+        # the command line to profile is taken as it was typed, whitespace included
+        command_info, kwargs = resolved
+        if kwargs['line']:
+            token_starts = [match.start() for match in re.finditer(r'\S+', line)]
+            kwargs['line'] = line[token_starts[-len(kwargs['line'])]:]
+        else:
+            kwargs['line'] = ''
+        return command_info, kwargs
+
+    def profile_line(self, line, top=20, sort='cumulative', save=None):
+        """Execute a line in the context under cProfile and report the stats."""
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.execute_line, line)
+
+        finally:
+            if save:
+                profiler.dump_stats(save)
+                self.context.write('Profile saved to {0}\n'.format(save))
+            else:
+                stats_stream = io.StringIO()
+                pstats.Stats(profiler, stream=stats_stream).sort_stats(sort).print_stats(top)
+                self.context.write(stats_stream.getvalue())
+
+    def execute_line(self, line):
+        """Execute a line in the context, running an async command to completion (see Commander.execute)."""
+        result = self.context.execute(line)
+        if inspect.isawaitable(result):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return run_awaitable(result)
+
+            if inspect.iscoroutine(result):
+                result.close()
+            self.context.write('Async commands can\'t be profiled in a running event loop\n')
+            return None
+
+        return result
+
+    def start_sampling(self, duration, interval, top=20):
+        """Sample every command dispatched in the context during the next duration seconds."""
+        if self.sampler is not None:
+            self.stop_sampling()
+
+        self.sampler = SamplingProfiler(interval, duration)
+        self.sampling_top = top
+        self.sampler.start()
+
+        # intercept dispatching in this context only, so there's no overhead once sampling is over;
+        # report_jobs (called by the Commander before prompting) and flush report the window once it's over
+        self.context.dispatch = self._sampled_dispatch
+        self.context.report_jobs = self._sampled_report_jobs
+        self.context.flush = self._sampled_flush
+        self.context.write('Sampling commands for {0:g} seconds\n'.format(duration))
+
+    def stop_sampling(self):
+        if self.sampler is None:
+            self.context.write('Not sampling\n')
+            return
+
+        sampler = self.sampler
+        self.sampler = None
+        sampler.active = False
+        sampler.stop()
+        for name, method in (('dispatch', self._sampled_dispatch), ('report_jobs', self._sampled_report_jobs),
+                             ('flush', self._sampled_flush)):
+            if self.context.__dict__.get(name) == method:
+                delattr(self.context, name)
+        self.context.write(sampler.format(self.sampling_top))
+
+    def report_if_over(self):
+        """Stop sampling and report if the sampling window is over."""
+        if self.sampler is not None and self.sampler.is_over():
+            self.stop_sampling()
+
+    def _sampled_report_jobs(self):
+        self.report_if_over()
+        return type(self.context).report_jobs(self.context)
+
+    def _sampled_flush(self):
+        self.report_if_over()
+        return type(self.context).flush(self.context)
+
+    def _sampled_dispatch(self, line):
+        self.report_if_over()
+        sampler = self.sampler
+        if sampler is None:
+            return type(self.context).dispatch(self.context, line)
+
+        sampler.thread_id = threading.get_ident()
+        sampler.active = True
+        try:
+            return type(self.context).dispatch(self.context, line)
+
+        finally:
+            sampler.active = False
+            self.report_if_over()
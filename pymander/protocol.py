@@ -0,0 +1,147 @@
+"""
+A machine protocol for automation clients: JSON Lines in, JSON Lines out.
+
+Every input line is a JSON request, either a command line:
+    {"id": 1, "line": "buy greek --price 5"}
+or a command given by the name of its method and its arguments, which skips parsing entirely
+(arguments are passed as they are, without the conversions of parsing, and the ones that are left out
+get their defaults, see CommandLineHandler.get_default_kwargs):
+    {"id": 2, "command": "buy_salad", "kwargs": {"kind_of_salad": "greek", "price": "5"}}
+
+Every request gets a response line, in the order of the requests:
+    {"id": 1, "ok": true, "output": "Buying greek salad for 5...\n", "result": null, "error": null, "time": 0.0001}
+output is everything the command wrote (or streamed), result is its return value
+(converted to a string if it can't be encoded as JSON), error is {"type": <exception class>, "message": ...}
+if the command failed. Lines and commands that don't exist fail with the CantParseLine type.
+time is the time it took to execute the request, in seconds.
+Async commands are run to completion before their response is written (see Commander.execute),
+and so are the background jobs started by a request: their output and outcome are a part of its output.
+
+Requests don't have to wait for responses, so a client can keep many requests in flight
+and match the responses by their ids (any JSON value, null if left out).
+Nothing else is written: there are no prompts, and contexts report nothing between requests.
+"""
+import collections.abc
+import inspect
+import json
+import time
+
+from .commander import Commander, run_awaitable
+from .contexts import CommandContext
+from .exceptions import CantParseLine, ExitContext, ExitMainloop
+from .handlers import NO_MATCH
+from .pipelines import split_pipeline
+
+
+__all__ = ('MachineCommander',)
+
+
+class MachineCommander(Commander):
+    """Commander that speaks the JSON Lines protocol (see pymander.protocol) instead of prompting."""
+    clock = staticmethod(time.perf_counter)
+
+    def read_and_execute(self):
+        line = self.in_stream.readline()
+        if not line:
+            self.end_of_input()
+            raise ExitMainloop
+
+        self.handle_request(line)
+
+    def handle_request(self, line):
+        """Execute a request line and write the response."""
+        start = self.clock()
+        request_id = None
+        output = []
+        result = None
+        error = None
+        stop = False
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request must be a JSON object')
+
+            request_id = request.get('id')
+            context = self.context
+            with context.capture_output(output, forward=False):
+                try:
+                    if 'command' in request:
+                        result = self.execute_command(request['command'], request.get('kwargs') or {})
+                    elif 'line' in request:
+                        result = self.execute_line(request['line'])
+                    else:
+                        raise ValueError('A request must have a line or a command')
+
+                    # the outcome of the jobs started by the request is a part of its response
+                    context.wait_jobs()
+                    if isinstance(result, CommandContext):
+                        self.enter_context(result)
+                        result = None
+
+                except ExitContext:
+                    self.exit_current_context()
+
+        except ExitMainloop:
+            stop = True
+        except Exception as err:
+            error = {'type': err.__class__.__name__, 'message': str(err)}
+
+        self.write_response({
+            'id': request_id, 'ok': error is None, 'output': ''.join(output), 'result': result, 'error': error,
+            'time': self.clock() - start,
+        })
+        if stop:
+            raise ExitMainloop
+
+    def execute_line(self, line):
+        context = self.context
+        if not line.endswith('\n'):
+            line += '\n'
+
+        if context.pipelines and '|' in line and len(split_pipeline(line)) > 1:
+            return context.execute(line)
+
+        result = context.dispatch(line)
+        if result is NO_MATCH:
+            raise CantParseLine('Invalid command: {0}'.format(line.rstrip('\n')))
+
+        return self.finish_result(result)
+
+    def execute_command(self, name, kwargs):
+        found = self.context.get_command(name)
+        if found is None:
+            raise CantParseLine('No such command: {0}'.format(name))
+
+        handler, command_info = found
+        all_kwargs = handler.get_default_kwargs(command_info)
+        all_kwargs.update(kwargs)
+        return self.finish_result(handler.invoke(command_info, all_kwargs))
+
+    def finish_result(self, result):
+        if inspect.isawaitable(result):
+            # an async command method (see Commander.execute)
+            result = run_awaitable(result)
+
+        if result is not None and isinstance(result, collections.abc.Iterator):
+            # the output is streamed into the response
+            self.context.write_stream(result)
+            return None
+
+        return result
+
+    def write_response(self, response):
+        try:
+            text = json.dumps(response)
+        except (TypeError, ValueError):
+            response['result'] = repr(response['result'])
+            text = json.dumps(response)
+
+        self.out_stream.write(text + '\n')
+        has_pending = getattr(self.in_stream, 'has_pending', None)
+        if has_pending is None or not has_pending():
+            # (if more requests are waiting, their responses are flushed together)
+            self.out_stream.flush()
+
+    def enter_context(self, context):
+        super().enter_context(context)
+        context.pager = None  # there's no one to ask
@@ -0,0 +1,202 @@
+import codecs
+import collections
+import io
+import locale
+import os
+import queue
+import selectors
+import threading
+
+
+__all__ = ('DEFAULT_CHUNK_SIZE', 'iter_chunked_lines', 'ChunkedLineReader')
+
+
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def iter_chunked_lines(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read a text stream in large chunks and yield its lines (with their line endings).
+    The last line is yielded even if it doesn't end with a newline.
+    """
+    pending = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        lines = chunk.split('\n')
+        if len(lines) == 1:
+            # no line ending in this chunk
+            pending.append(chunk)
+            continue
+
+        pending.append(lines[0])
+        yield ''.join(pending) + '\n'
+        for index in range(1, len(lines) - 1):
+            yield lines[index] + '\n'
+
+        pending = [lines[-1]] if lines[-1] else []
+
+    if pending:
+        yield ''.join(pending)
+
+
+class ChunkedLineReader:
+    """
+    Reads lines from a stream in large chunks, so that every line doesn't cost a system call.
+    Can be used in place of the stream (e.g. as the input stream of a Commander).
+
+    If the stream has a file descriptor, chunks of up to chunk_size bytes are read from it directly
+    (whatever is available, e.g. a whole paste) and decoded incrementally with the encoding of the stream;
+    line endings are translated as in text mode. The stream must not be read otherwise afterwards.
+    Other streams are read in chunks of chunk_size characters.
+    Every chunk is split into lines at once; a partial line at the end of a chunk is completed
+    by the next one, the last line is returned even if it doesn't end with a newline.
+
+    With background=True the chunks are read by a daemon thread, so the input is read ahead
+    while commands run (up to max_queued_chunks chunks).
+
+    Returning a line costs more than TextIOWrapper.readline of a buffered stream, so the reader
+    only pays off with the background thread or when the input is produced slowly (e.g. by a pipe).
+    """
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, background=False, max_queued_chunks=16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_queued_chunks = max_queued_chunks
+        self.fd = _get_fd(stream)
+        self._decoder = None
+        if self.fd is not None:
+            encoding = getattr(stream, 'encoding', None) or locale.getpreferredencoding(False)
+            decoder = codecs.getincrementaldecoder(encoding)(getattr(stream, 'errors', None) or 'strict')
+            self._decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+
+        self._partial = ''
+        self._lines = collections.deque()
+        self._eof = False
+        self._error = None
+        self._batches = None
+        self._thread = None
+        if background:
+            self.start()
+
+    def start(self):
+        """Start reading in a background thread."""
+        if self._thread is None:
+            self._batches = queue.Queue(self.max_queued_chunks)
+            self._thread = threading.Thread(target=self._read_in_thread, name='pymander-reader', daemon=True)
+            self._thread.start()
+
+    def _read_in_thread(self):
+        while True:
+            try:
+                lines = self.read_lines()
+            except Exception as err:
+                self._batches.put(err)
+                break
+
+            self._batches.put(lines)
+            if not lines:
+                break
+
+    def read_chunk(self):
+        """Read the next chunk of text ('' at the end of input)."""
+        if self.fd is None:
+            return self.stream.read(self.chunk_size)
+
+        while True:
+            data = os.read(self.fd, self.chunk_size)
+            text = self._decoder.decode(data, final=not data)
+            if text or not data:
+                return text
+            # only a part of a multibyte character (or of a line ending) has been read
+
+    def read_lines(self):
+        """Read chunks until there's a complete line and return the lines read. Return [] at the end of input."""
+        while True:
+            chunk = self.read_chunk()
+            if not chunk:
+                last_line, self._partial = self._partial, ''
+                return [last_line] if last_line else []
+
+            lines = chunk.split('\n')
+            if len(lines) == 1:
+                self._partial += chunk
+                continue
+
+            lines[0] = self._partial + lines[0]
+            self._partial = lines.pop()
+            return [line + '\n' for line in lines]
+
+    def readline(self):
+        """Return the next line ('' at the end of input)."""
+        lines = self._lines
+        if not lines:
+            if not self._eof:
+                self._add_batch(self._batches.get() if self._batches is not None else self.read_lines())
+
+            if not lines:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+
+                return ''
+
+        return lines.popleft()
+
+    def _add_batch(self, batch):
+        if isinstance(batch, Exception):
+            # reading failed in the background thread, it is raised by readline
+            self._error = batch
+            self._eof = True
+        elif not batch:
+            self._eof = True
+        else:
+            self._lines.extend(batch)
+
+    def has_pending(self, timeout=0):
+        """Whether readline would return without waiting (waits for up to timeout seconds if it would)."""
+        if self._lines or self._eof:
+            return True
+
+        if self._batches is not None:
+            try:
+                self._add_batch(self._batches.get(timeout=timeout) if timeout else self._batches.get_nowait())
+            except queue.Empty:
+                return False
+
+            return True
+
+        if self.fd is None:
+            return True
+
+        with selectors.DefaultSelector() as selector:
+            try:
+                selector.register(self.fd, selectors.EVENT_READ)
+            except (OSError, ValueError):
+                return True  # e.g. a regular file, reading it doesn't block
+
+            return bool(selector.select(timeout))
+
+    def isatty(self):
+        """Whether the wrapped stream is a terminal (see Commander.page)."""
+        isatty = getattr(self.stream, 'isatty', None)
+        return isatty is not None and isatty()
+
+    def fileno(self):
+        """Return the file descriptor of the wrapped stream (raises io.UnsupportedOperation if it has none)."""
+        if self.fd is None:
+            raise io.UnsupportedOperation('fileno')
+
+        return self.fd
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+def _get_fd(stream):
+    """Return the file descriptor of a stream or None if it has none."""
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
@@ -0,0 +1,129 @@
+"""
+Serving many concurrent commander sessions from a single process.
+
+Every connection gets its own AsyncCommander with its own clone of a prototype context
+(see CommandContext.clone), so sessions don't share the context stack or streams.
+All sessions are multiplexed on a single asyncio event loop.
+"""
+import asyncio
+import threading
+
+from .commander import AsyncCommander
+
+
+__all__ = ('CommanderServer', 'SessionReader', 'SessionWriter', 'run_server')
+
+
+class SessionReader:
+    """Text input stream of a session on top of asyncio.StreamReader."""
+    def __init__(self, reader, encoding='utf-8'):
+        self.reader = reader
+        self.encoding = encoding
+
+    async def readline(self):
+        try:
+            line = await self.reader.readline()
+        except (ConnectionError, ValueError):
+            # reset connection or a line longer than the reader limit: end the session
+            return ''
+
+        return line.decode(self.encoding, errors='replace')
+
+
+class SessionWriter:
+    """
+    Text output stream of a session on top of asyncio.StreamWriter.
+    Writes go straight to the transport buffer, so flush does nothing;
+    the commander awaits drain after every command, which provides backpressure
+    against slow clients.
+    Must be created in the thread of the event loop. Writes from other threads
+    (e.g. commands run in an executor) are passed to the loop, as transports aren't thread-safe.
+    """
+    def __init__(self, writer, encoding='utf-8'):
+        self.writer = writer
+        self.encoding = encoding
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+
+    def write(self, text):
+        data = text.encode(self.encoding, errors='replace')
+        if threading.get_ident() == self._loop_thread_id:
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    def flush(self):
+        pass
+
+    async def drain(self):
+        await self.writer.drain()
+
+
+class CommanderServer:
+    """
+    Serves commander sessions over TCP (start with host and port) or a Unix socket (start with path).
+    At most max_sessions sessions are served at once; further connections wait for a free slot.
+    commander_kwargs are passed to every AsyncCommander (e.g. output_policy, run_in_executor).
+    """
+    commander_class = AsyncCommander
+
+    def __init__(self, prototype, max_sessions=256, encoding='utf-8', **commander_kwargs):
+        self.prototype = prototype
+        self.max_sessions = max_sessions
+        self.encoding = encoding
+        self.commander_kwargs = commander_kwargs
+        self.session_count = 0
+        self.server = None
+        self._session_slots = None
+
+    def make_context(self):
+        return self.prototype.clone(name=self.prototype.name)
+
+    def make_commander(self, reader, writer):
+        return self.commander_class(
+            self.make_context(),
+            in_stream=SessionReader(reader, self.encoding), out_stream=SessionWriter(writer, self.encoding),
+            **self.commander_kwargs
+        )
+
+    async def handle_connection(self, reader, writer):
+        try:
+            async with self._session_slots:
+                self.session_count += 1
+                try:
+                    await self.make_commander(reader, writer).mainloop()
+                except ConnectionError:
+                    pass
+                finally:
+                    self.session_count -= 1
+
+        finally:
+            writer.close()
+
+    async def start(self, host=None, port=None, path=None, **server_kwargs):
+        """Start listening and return the asyncio server."""
+        self._session_slots = asyncio.Semaphore(self.max_sessions)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path, **server_kwargs)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port, **server_kwargs)
+
+        return self.server
+
+    async def serve_forever(self, host=None, port=None, path=None, **server_kwargs):
+        server = await self.start(host=host, port=port, path=path, **server_kwargs)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+def run_server(prototype, host=None, port=None, path=None, **kwargs):
+    """Serve sessions of clones of the prototype context until interrupted (see CommanderServer)."""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(CommanderServer(prototype, **kwargs).serve_forever(host=host, port=port, path=path))
+    finally:
+        loop.close()
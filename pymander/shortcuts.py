@@ -1,8 +1,12 @@
+import asyncio
+
 from .contexts import StandardPrompt
-from .commander import Commander
+from .commander import Commander, AsyncCommander
 
 
-__all__ = ('Commander', 'run_with_context', 'run_with_handler')
+__all__ = (
+    'Commander', 'AsyncCommander', 'run_with_context', 'run_with_handler', 'run_with_script', 'run_async_with_context',
+)
 
 
 def run_with_context(context):
@@ -11,3 +15,17 @@ def run_with_context(context):
 
 def run_with_handler(handler):
     run_with_context(StandardPrompt([handler]))
+
+
+def run_with_script(context, script=None):
+    """Run the commands of a script (see Commander.run_script) and return the number of failed lines."""
+    return Commander(context).run_script(script)
+
+
+def run_async_with_context(context, **kwargs):
+    """Run an AsyncCommander mainloop in a new event loop (see AsyncCommander for kwargs)."""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(AsyncCommander(context, **kwargs).mainloop())
+    finally:
+        loop.close()
@@ -1,9 +1,12 @@
+import abc
+import re
 from unittest import TestCase
 
 from pymander.exceptions import ExitContext, CantParseLine
-from pymander.handlers import ExitLineHandler, EchoLineHandler, EmptyLineHandler, \
+from pymander.handlers import NO_MATCH, ExitLineHandler, EchoLineHandler, EmptyLineHandler, \
     ExactLineHandler, RegexLineHandler, ArgparseLineHandler
 from pymander.decorators import bind_command
+from pymander.patterns import CombinedRegex
 
 
 class FakeContext:
@@ -48,6 +51,9 @@ class EchoLineHandlerCase(SimpleLineHandlerCase):
         self.handler.try_execute('echo qwerty uiop')
         self.assertEqual('qwerty uiop\n', self.fake_context.text)
 
+    def test_keywords(self):
+        self.assertEqual({'echo'}, self.handler.get_keywords())
+
     def test_invalid_command(self):
         with self.assertRaises(CantParseLine):
             self.handler.try_execute('qwerty')
@@ -65,6 +71,15 @@ class EmptyLineHandlerCase(SimpleLineHandlerCase):
         with self.assertRaises(CantParseLine):
             self.handler.try_execute('qwerty')
 
+    def test_keywords(self):
+        class CommentLineHandler(EmptyLineHandler):
+            def try_execute(self, line):
+                if not line.startswith('#'):
+                    return super().try_execute(line)
+
+        self.assertEqual({''}, self.handler.get_keywords())
+        self.assertIsNone(CommentLineHandler().get_keywords())
+
 
 class ExactLineHandlerCase(SimpleLineHandlerCase):
     class TestExactLineHandler(ExactLineHandler):
@@ -78,6 +93,30 @@ class ExactLineHandlerCase(SimpleLineHandlerCase):
         self.handler.try_execute('do this')
         self.assertEqual('This is done', self.fake_context.text)
 
+    def test_keywords(self):
+        self.assertEqual({'do'}, self.handler.get_keywords())
+
+    def test_command_registry(self):
+        other_handler = self.handler_class()
+        self.assertIs(self.handler.command_methods, other_handler.command_methods)
+        self.assertEqual(1, len(self.handler.command_methods))
+        self.assertEqual(('do this',), self.handler.command_methods[0]['args'])
+        with self.assertRaises(TypeError):
+            self.handler.command_methods[0]['args'] = ('do that',)
+
+    def test_command_registry_with_metaclass(self):
+        class RegisteringMeta(abc.ABCMeta):
+            pass
+
+        class MixedLineHandler(self.handler_class, metaclass=RegisteringMeta):
+            @bind_command('do that')
+            def do_that(self):
+                pass
+
+        self.assertEqual(
+            ['do that', 'do this'], sorted(command['args'][0] for command in MixedLineHandler().command_methods)
+        )
+
     def test_invalid_command(self):
         with self.assertRaises(CantParseLine):
             self.handler.try_execute('qwerty')
@@ -103,6 +142,10 @@ class RegexLineHandlerCase(SimpleLineHandlerCase):
         self.handler.try_execute('raise shields')
         self.assertEqual('Shields raised', self.fake_context.text)
 
+    def test_keywords(self):
+        # '(?P<action>raise|drop) shields' has no literal first word
+        self.assertIsNone(self.handler.get_keywords())
+
     def test_invalid_command(self):
         with self.assertRaises(CantParseLine):
             self.handler.try_execute('qwerty')
@@ -120,6 +163,10 @@ class ArgparseLineHandlerCase(SimpleLineHandlerCase):
         def do(self, what, joy):
             self.context.write('Doing {0}{1}'.format(what, ' with joy' if joy else ''))
 
+        @bind_command('rest', help='Take a break')
+        def rest(self):
+            self.context.write('Resting')
+
     handler_class = TestArgparseLineHandler
 
     def test_valid_command(self):
@@ -130,6 +177,32 @@ class ArgparseLineHandlerCase(SimpleLineHandlerCase):
         self.handler.try_execute('do homework --joy')
         self.assertEqual('Doing homework with joy', self.fake_context.text)
 
+    def test_keywords(self):
+        self.assertEqual({'do', 'rest'}, self.handler.get_keywords())
+
+    def test_lazy_subparsers(self):
+        self.handler.try_execute('do chores')
+        self.assertEqual({'do'}, self.handler._built_commands)
+
+        self.handler.try_execute('rest')
+        self.assertEqual({'do', 'rest'}, self.handler._built_commands)
+
+    def test_help(self):
+        class FakeStreamContext(FakeContext):
+            def __init__(self):
+                super().__init__()
+                self.out_stream = self
+
+        def get_help(handler):
+            handler.set_context(FakeStreamContext())
+            handler.try_execute('do --help')
+            return handler.context.text
+
+        eager_handler = self.handler_class()
+        eager_handler.build_all_subparsers()
+        self.assertIn('usage:  do [-h] [--joy] what', get_help(self.handler_class()))
+        self.assertEqual(get_help(eager_handler), get_help(self.handler_class()))
+
     def test_invalid_command(self):
         with self.assertRaises(CantParseLine):
             self.handler.try_execute('qwerty')
@@ -139,3 +212,106 @@ class ArgparseLineHandlerCase(SimpleLineHandlerCase):
 
         with self.assertRaises(CantParseLine):
             self.handler.try_execute('do something somethingelse')
+
+
+class CombinedRegexLineHandlerCase(SimpleLineHandlerCase):
+    class TestRegexLineHandler(RegexLineHandler):
+        @bind_command(r'(?P<word>\w+) (?P=word)')
+        def a_repeat(self, word):
+            self.context.write('Repeated {0}'.format(word))
+
+        @bind_command(r'(\w+)-\1')
+        def b_numbered_repeat(self):
+            self.context.write('Numbered repeat')
+
+        @bind_command(r'(?i)loud (?P<word>\w+)')
+        def c_loud(self, word):
+            self.context.write('Loud {0}'.format(word))
+
+        @bind_command(r'(?P<word>\w+)')
+        def d_any_word(self, word):
+            self.context.write('Word {0}'.format(word))
+
+    handler_class = TestRegexLineHandler
+
+    def test_valid_command(self):
+        self.handler.try_execute('yo yo')
+        self.assertEqual('Repeated yo', self.fake_context.text)
+
+        self.fake_context.clear()
+        self.handler.try_execute('ab-ab')
+        self.assertEqual('Numbered repeat', self.fake_context.text)
+
+        self.fake_context.clear()
+        self.handler.try_execute('LOUD noise')
+        self.assertEqual('Loud noise', self.fake_context.text)
+
+        # the first matching expression wins
+        self.fake_context.clear()
+        self.handler.try_execute('yo ho')
+        self.assertEqual('Word yo', self.fake_context.text)
+
+    def test_invalid_command(self):
+        with self.assertRaises(CantParseLine):
+            self.handler.try_execute('!')
+
+    def test_compiled_patterns_and_comments(self):
+        combined_regex = CombinedRegex([
+            re.compile(r'go (?P<where>\w+)'),
+            re.compile(r'stop', re.IGNORECASE),
+            r'say(?# (?P<what> is not a group) (?P<what>\w+)',
+        ])
+        self.assertEqual((0, {'where': 'home'}), combined_regex.match('go home'))
+        self.assertEqual((1, {}), combined_regex.match('STOP'))
+        self.assertEqual((2, {'what': 'hi'}), combined_regex.match('say hi'))
+
+    def test_buckets_by_first_token(self):
+        combined_regex = CombinedRegex([
+            r'go (?P<where>\w+)',
+            r'(?P<verb>\w+) now',
+            r'go home',
+            r'^stop$',
+            r'say (?P<what>.+)',
+        ])
+        self.assertEqual({'go', 'stop', 'say'}, set(combined_regex.buckets))
+        self.assertEqual((0, {'where': 'home'}), combined_regex.match('go home'))
+        self.assertEqual((0, {'where': 'now'}), combined_regex.match('go now', 'go'))
+        self.assertEqual((1, {'verb': 'stop'}), combined_regex.match('stop now'))
+        self.assertEqual((1, {'verb': 'run'}), combined_regex.match('run now'))
+        self.assertEqual((3, {}), combined_regex.match('stop'))
+        self.assertEqual((4, {'what': 'hi there'}), combined_regex.match('say hi there'))
+        self.assertIsNone(combined_regex.match('say'))
+        self.assertIsNone(combined_regex.match(''))
+
+
+class NoMatchProtocolCase(TestCase):
+    class CustomizedRegexLineHandler(RegexLineHandler):
+        @bind_command('hail (?P<whom>\\w+)')
+        def hail(self, whom):
+            self.context.write('Hailing {0}'.format(whom))
+
+        def try_execute(self, line):
+            if line.startswith('hail klingons'):
+                raise CantParseLine(line)
+
+            return super().try_execute(line)
+
+    def test_builtin_handlers(self):
+        for handler_class in (
+            ExitLineHandler, EchoLineHandler, EmptyLineHandler,
+            ExactLineHandlerCase.TestExactLineHandler,
+            RegexLineHandlerCase.TestRegexLineHandler,
+            ArgparseLineHandlerCase.TestArgparseLineHandler,
+        ):
+            handler = handler_class()
+            handler.set_context(FakeContext())
+            self.assertIs(NO_MATCH, handler.dispatch('qwerty uiop'))
+
+    def test_customized_try_execute(self):
+        handler = self.CustomizedRegexLineHandler()
+        fake_context = FakeContext()
+        handler.set_context(fake_context)
+
+        self.assertIs(NO_MATCH, handler.dispatch('hail klingons'))
+        self.assertIsNone(handler.dispatch('hail romulans'))
+        self.assertEqual('Hailing romulans', fake_context.text)
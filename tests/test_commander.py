@@ -1 +1,368 @@
-# TODO
+import asyncio
+import io
+import os
+import tempfile
+import threading
+from unittest import TestCase, skipUnless
+
+from pymander.commander import Commander, AsyncCommander
+from pymander.contexts import StandardPrompt, OUTPUT_BUFFERED, OUTPUT_LINE_BUFFERED
+from pymander.handlers import ExactLineHandler
+from pymander.decorators import bind_command
+from pymander.reader import iter_chunked_lines, ChunkedLineReader
+
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.flush_count = 0
+
+    def flush(self):
+        self.flush_count += 1
+        super().flush()
+
+
+class ChattyLineHandler(ExactLineHandler):
+    @bind_command('chat')
+    def chat(self):
+        for index in range(100):
+            self.context.write('Line {0}\n'.format(index))
+
+
+class StreamingLineHandler(ExactLineHandler):
+    def __init__(self):
+        super().__init__()
+        self.produced = 0
+        self.closed = False
+
+    @bind_command('count')
+    def count(self):
+        try:
+            for index in range(1000):
+                self.produced += 1
+                yield '{0}\n{1}\n'.format(index * 2, index * 2 + 1)
+        finally:
+            self.closed = True
+
+
+class FailingLineHandler(ExactLineHandler):
+    @bind_command('fail')
+    def fail(self):
+        raise RuntimeError('Failed!')
+
+
+class AsyncLineHandler(ExactLineHandler):
+    @bind_command('lookup')
+    async def lookup(self):
+        await asyncio.sleep(0)
+        self.context.write('Found\n')
+
+
+class AsyncStringReader:
+    """Mimics a text wrapper around asyncio.StreamReader."""
+    def __init__(self, text):
+        self.lines = io.StringIO(text)
+
+    async def readline(self):
+        await asyncio.sleep(0)
+        return self.lines.readline()
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def make_commander(in_text=''):
+    return Commander(
+        StandardPrompt([ChattyLineHandler(), FailingLineHandler()]),
+        in_stream=io.StringIO(in_text), out_stream=io.StringIO(),
+    )
+
+
+class CommanderCase(TestCase):
+    def test_mainloop_stops_at_eof(self):
+        commander = make_commander('echo 1\necho 2')
+        commander.mainloop()
+        self.assertEqual('>>> 1\n>>> 2\n>>> ', commander.out_stream.getvalue())
+
+    def test_run_script(self):
+        commander = make_commander()
+        error_count = commander.run_script(['echo 1', 'fail', 'qwerty\n', 'echo 2'])
+        self.assertEqual(2, error_count)
+        self.assertEqual(
+            '1\nError in line 2: RuntimeError: Failed!\nError in line 3: CantParseLine: Invalid command: qwerty\n2\n',
+            commander.out_stream.getvalue()
+        )
+
+    def test_run_script_unmatched_lines(self):
+        commander = make_commander()
+        self.assertEqual(1, commander.run_script(['qwerty']))
+        self.assertEqual('Error in line 1: CantParseLine: Invalid command: qwerty\n', commander.out_stream.getvalue())
+
+        commander = make_commander()
+        commander.context.pipelines = True
+        self.assertEqual(2, commander.run_script(['echo 1 | qwerty', 'echo 2', 'echo 3 |']))
+        self.assertEqual(
+            'Error in line 1: CantParseLine: Invalid command: echo 1 | qwerty\n2\n'
+            'Error in line 3: CantParseLine: Invalid command: echo 3 |\n',
+            commander.out_stream.getvalue()
+        )
+
+        # interactively, unmatched lines are still handled by the context
+        commander = make_commander('qwerty\n')
+        commander.mainloop()
+        self.assertEqual('>>> Invalid command: qwerty\n>>> ', commander.out_stream.getvalue())
+
+    def test_run_script_until_exit(self):
+        commander = make_commander('echo 1\nexit\necho 2\n')
+        self.assertEqual(0, commander.run_script())
+        self.assertEqual('1\nBye!\n', commander.out_stream.getvalue())
+
+    def test_run_script_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as script_file:
+            script_file.write('echo 1\n' * 1000)
+
+        try:
+            commander = make_commander()
+            self.assertEqual(0, commander.run_script(script_file.name, chunk_size=7))
+            self.assertEqual('1\n' * 1000, commander.out_stream.getvalue())
+        finally:
+            os.remove(script_file.name)
+
+    def test_iter_chunked_lines(self):
+        text = 'first\n\nthird line\nlast'
+        for chunk_size in (1, 2, 5, 100):
+            self.assertEqual(
+                ['first\n', '\n', 'third line\n', 'last'],
+                list(iter_chunked_lines(io.StringIO(text), chunk_size))
+            )
+
+    def test_chunked_line_reader(self):
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, encoding='utf-8') as in_stream:
+            reader = ChunkedLineReader(in_stream, chunk_size=4)
+            self.assertFalse(reader.has_pending())
+            # a multibyte character and a line ending split between chunks
+            os.write(write_fd, 'first\r\nпри'.encode('utf-8'))
+            self.assertTrue(reader.has_pending(timeout=1))
+            os.write(write_fd, 'вет\n\nlast'.encode('utf-8'))
+            os.close(write_fd)
+            self.assertEqual(['first\n', 'привет\n', '\n', 'last'], list(reader))
+            self.assertEqual('', reader.readline())
+
+        for chunk_size in (1, 3, 100):
+            reader = ChunkedLineReader(io.StringIO('a\nbc\n\nd'), chunk_size=chunk_size, background=True)
+            self.assertEqual(['a\n', 'bc\n', '\n', 'd'], list(reader))
+
+    def test_async_commands(self):
+        commander = Commander(
+            StandardPrompt([AsyncLineHandler()]), in_stream=io.StringIO('lookup\n'), out_stream=io.StringIO(),
+        )
+        commander.mainloop()
+        self.assertEqual('>>> Found\n>>> ', commander.out_stream.getvalue())
+
+        async def execute_in_loop():
+            commander.execute('lookup\n')
+
+        with self.assertRaises(RuntimeError):
+            run_async(execute_in_loop())
+
+    def test_chunked_line_reader_terminal(self):
+        class TerminalStream(io.StringIO):
+            def isatty(self):
+                return True
+
+        commander = Commander(
+            StandardPrompt([StreamingLineHandler()]), in_stream=TerminalStream('count\nq\n'),
+            out_stream=io.StringIO(), page_size=3, chunked_input=True,
+        )
+        self.assertTrue(commander.in_stream.isatty())
+        commander.mainloop()
+        # the terminal has echoed the answer, no newline is added
+        self.assertEqual(
+            '>>> 0\n1\n2\n-- More (Enter to continue, q to quit) -->>> ', commander.out_stream.getvalue()
+        )
+
+        with self.assertRaises(io.UnsupportedOperation):
+            ChunkedLineReader(io.StringIO('')).fileno()
+        read_fd, write_fd = os.pipe()
+        os.close(write_fd)
+        with open(read_fd) as in_stream:
+            reader = ChunkedLineReader(in_stream)
+            self.assertEqual(read_fd, reader.fileno())
+            self.assertFalse(reader.isatty())
+
+    def test_chunked_input(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'echo 1\nfail\necho 2\n')
+        os.close(write_fd)
+        with open(read_fd) as in_stream:
+            commander = Commander(
+                StandardPrompt([FailingLineHandler()]), in_stream=in_stream, out_stream=io.StringIO(),
+                background_input=True,
+            )
+            self.assertEqual(1, commander.run_script())
+        self.assertEqual('1\nError in line 2: RuntimeError: Failed!\n2\n', commander.out_stream.getvalue())
+
+    def test_buffered_output(self):
+        out_stream = CountingStream()
+        commander = Commander(
+            StandardPrompt([ChattyLineHandler()]),
+            in_stream=io.StringIO('chat\nexit\n'), out_stream=out_stream,
+            output_policy=OUTPUT_BUFFERED,
+        )
+        commander.mainloop()
+
+        self.assertTrue(out_stream.getvalue().startswith('>>> Line 0\n'))
+        self.assertTrue(out_stream.getvalue().endswith('Line 99\n>>> Bye!\n'))
+        # flushed at prompts and exit only
+        self.assertLess(out_stream.flush_count, 10)
+
+    def test_single_flush_per_prompt(self):
+        out_stream = CountingStream()
+        commander = Commander(
+            StandardPrompt(), in_stream=io.StringIO('\n\n\n'), out_stream=out_stream,
+            output_policy=OUTPUT_LINE_BUFFERED,
+        )
+        commander.mainloop()
+        self.assertEqual('>>> >>> >>> >>> ', out_stream.getvalue())
+        # one flush per prompt and one at the end
+        self.assertEqual(5, out_stream.flush_count)
+
+    def test_unbuffered_prompt_without_commander(self):
+        out_stream = CountingStream()
+        context = StandardPrompt()
+        context.set_out_stream(out_stream)
+        context.prompt()
+        self.assertEqual('>>> ', out_stream.getvalue())
+        self.assertEqual(1, out_stream.flush_count)
+
+    def test_streamed_output(self):
+        handler = StreamingLineHandler()
+        out_stream = CountingStream()
+        context = StandardPrompt([handler])
+        context.stream_batch_size = 1000
+        commander = Commander(context, in_stream=io.StringIO(), out_stream=out_stream, output_policy=OUTPUT_BUFFERED)
+        commander.run_script(['count'])
+
+        self.assertEqual(''.join('{0}\n'.format(index) for index in range(2000)), out_stream.getvalue())
+        # flushed after every batch of 1000+ characters
+        self.assertTrue(8 < out_stream.flush_count < 20)
+
+    def test_stream_limit(self):
+        handler = StreamingLineHandler()
+        commander = Commander(
+            StandardPrompt([handler]), in_stream=io.StringIO(), out_stream=io.StringIO(), stream_limit=5,
+        )
+        commander.run_script(['count'])
+        self.assertEqual('0\n1\n2\n3\n4\n... (output truncated after 5 lines)\n', commander.out_stream.getvalue())
+        self.assertEqual(3, handler.produced)
+        self.assertTrue(handler.closed)
+
+    def test_pager(self):
+        handler = StreamingLineHandler()
+        commander = Commander(
+            StandardPrompt([handler]), in_stream=io.StringIO('count\n\nq\n'), out_stream=io.StringIO(), page_size=3,
+        )
+        commander.mainloop()
+        more = '-- More (Enter to continue, q to quit) --\n'
+        self.assertEqual(
+            '>>> 0\n1\n2\n{0}3\n4\n5\n{0}>>> '.format(more), commander.out_stream.getvalue()
+        )
+        self.assertTrue(handler.closed)
+
+    def test_stream_boundaries(self):
+        pages = []
+        context = StandardPrompt()
+        context.set_out_stream(io.StringIO())
+        context.page_size = 2
+        context.pager = lambda: pages.append(context.out_stream.getvalue()) or True
+        context.write_stream(iter(['a\n', 'b\n', 'c\nd\n']))
+        context.write_stream(iter(['e\nf', '\n', '']))
+        self.assertEqual(['a\nb\n'], pages)
+
+        context = StandardPrompt()
+        context.set_out_stream(io.StringIO())
+        context.stream_limit = 2
+        context.write_stream(iter(['a\nb\n']))
+        context.write_stream(iter(['a\nb\n', 'c']))
+        self.assertEqual('a\nb\na\nb\n... (output truncated after 2 lines)\n', context.out_stream.getvalue())
+
+
+class AsyncCommanderCase(TestCase):
+    def make_commander(self, in_stream, **kwargs):
+        return AsyncCommander(
+            StandardPrompt([AsyncLineHandler(), ChattyLineHandler(), FailingLineHandler()]),
+            in_stream=in_stream, out_stream=io.StringIO(), **kwargs
+        )
+
+    def test_mainloop(self):
+        commander = self.make_commander(io.StringIO('lookup\necho 1\nexit\necho 2\n'))
+        run_async(commander.mainloop())
+        self.assertEqual('>>> Found\n>>> 1\n>>> Bye!\n', commander.out_stream.getvalue())
+
+    def test_async_input(self):
+        commander = self.make_commander(AsyncStringReader('lookup\nqwerty\n'), read_ahead=1)
+        run_async(commander.mainloop())
+        self.assertEqual('>>> Found\n>>> Invalid command: qwerty\n>>> ', commander.out_stream.getvalue())
+
+    def test_run_in_executor(self):
+        commander = self.make_commander(io.StringIO('chat\nlookup\n'), run_in_executor=True)
+        run_async(commander.mainloop())
+        self.assertIn('Line 99\n>>> Found\n>>> ', commander.out_stream.getvalue())
+
+    def test_no_pager(self):
+        with self.assertRaises(ValueError):
+            self.make_commander(io.StringIO(''), page_size=10)
+
+    def test_run_script(self):
+        commander = self.make_commander(io.StringIO('lookup\nqwerty\nexit\nlookup\n'))
+        self.assertEqual(1, run_async(commander.run_script()))
+        self.assertEqual(
+            'Found\nError in line 2: CantParseLine: Invalid command: qwerty\nBye!\n', commander.out_stream.getvalue()
+        )
+
+        commander = self.make_commander(None)
+        self.assertEqual(1, run_async(commander.run_script(['lookup', 'fail'])))
+        self.assertEqual('Found\nError in line 2: RuntimeError: Failed!\n', commander.out_stream.getvalue())
+
+    @skipUnless(hasattr(threading, 'excepthook'), 'threading.excepthook was added in Python 3.8')
+    def test_reader_stops_with_mainloop(self):
+        commander = self.make_commander(io.StringIO('exit\n' + 'echo 1\n' * 100), read_ahead=1)
+
+        async def run_and_stay():
+            await commander.readline()
+            reader = commander._reader
+            await asyncio.sleep(0.05)  # the reader is blocked on the full queue
+            commander.stop_reader()
+            await asyncio.get_running_loop().run_in_executor(None, reader.join, 1)
+            return reader
+
+        reader = run_async(run_and_stay())
+        self.assertFalse(reader.is_alive())
+        # the reader took at most the lines it was going to put into the queue
+        self.assertGreaterEqual(len(commander.in_stream.readlines()), 97)
+
+    def test_clean_shutdown(self):
+        errors = []
+        previous_excepthook = threading.excepthook
+        threading.excepthook = errors.append
+        try:
+            commander = self.make_commander(io.StringIO('exit\n' + 'echo 1\n' * 100), read_ahead=1)
+
+            async def read_and_leave():
+                await commander.readline()
+                await asyncio.sleep(0.05)  # the reader is blocked on the full queue when the loop shuts down
+
+            asyncio.run(read_and_leave())
+            for thread in threading.enumerate():
+                if thread.name == 'pymander-input':
+                    thread.join(1)
+        finally:
+            threading.excepthook = previous_excepthook
+
+        self.assertEqual([], errors)
@@ -1,7 +1,16 @@
+import argparse
+import io
+import itertools
+import os
+import re
+import tempfile
 from unittest import TestCase
 
-from pymander.contexts import CommandContext
-from pymander.handlers import LineHandler
+from pymander.contexts import CommandContext, PrebuiltCommandContext, JsonContext, StandardPrompt, \
+    OUTPUT_LINE_BUFFERED, OUTPUT_BUFFERED, OVERFLOW_TRUNCATE
+from pymander.decorators import bind_command, bind_exact, bind_regex, bind_argparse
+from pymander.handlers import LineHandler, ExactLineHandler, RegexLineHandler, ArgparseLineHandler
+from pymander.caching import LRUCache
 from pymander.exceptions import CantParseLine, ExitContext
 
 
@@ -14,6 +23,15 @@ class FuncLineHandler(LineHandler):
         return self.func(line)
 
 
+class KeywordLineHandler(FuncLineHandler):
+    def __init__(self, func, keywords):
+        super().__init__(func)
+        self.keywords = keywords
+
+    def get_keywords(self):
+        return self.keywords
+
+
 class SimpleStream:
     def write(self, line):
         pass
@@ -31,16 +49,69 @@ class DummyCommandContext(CommandContext):
         raise CantExecute
 
 
+class DummyPrebuiltContext(PrebuiltCommandContext, DummyCommandContext):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    @bind_exact('ping')
+    def ping(self):
+        self.log.append('pong')
+
+    @bind_regex(r'say (?P<what>\w+)')
+    def say(self, what):
+        self.log.append(what)
+
+
+class CachedContext(DummyPrebuiltContext):
+    parse_cache_size = 2
+
+    @bind_argparse('push', [['items', {'nargs': '*'}]])
+    def push(self, items):
+        items.append('!')
+        self.log.append(items)
+
+
+class CatalogContext(DummyPrebuiltContext):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.items = {'a': 1}
+        self.lookups = 0
+        self.set_out_stream(io.StringIO())
+
+    @bind_regex(r'^get (?P<key>\w+)$', cache=True, cache_ttl=60, cache_size=2)
+    def get(self, key):
+        self.lookups += 1
+        self.write('{0}\n'.format(self.items.get(key)))
+        return self.items.get(key)
+
+    @bind_exact('keys', cache=True)
+    def keys(self):
+        self.lookups += 1
+        for key in sorted(self.items):
+            yield '{0}\n'.format(key)
+
+    @bind_exact('size', idempotent=True)
+    def size(self):
+        self.write('{0}\n'.format(len(self.items)))
+
+    @bind_argparse('set', ['key', ['value', {'type': int}]])
+    def set(self, key, value):
+        self.items[key] = value
+
+
 class DummyOutStream:
     def __init__(self):
         self.written = False
         self.flushed = False
+        self.flush_count = 0
 
     def write(self, line):
         self.written = True
 
     def flush(self):
         self.flushed = True
+        self.flush_count += 1
 
 
 def _pass(*args, **kwargs):
@@ -73,6 +144,99 @@ class CommandContextCase(TestCase):
         with self.assertRaises(CantExecute):
             ctx.execute('qwerty')
 
+    def test_dispatch_index(self):
+        calls = []
+
+        def _record(name, accept=True):
+            def func(line):
+                calls.append(name)
+                if not accept:
+                    raise CantParseLine
+
+                return name
+
+            return func
+
+        ctx = DummyCommandContext(handlers=[
+            KeywordLineHandler(_record('first', accept=False), {'go', 'stop'}),
+            FuncLineHandler(_record('wildcard', accept=False)),
+            KeywordLineHandler(_record('second'), {'go'}),
+        ])
+        self.assertEqual('second', ctx.execute('go home'))
+        self.assertEqual(['first', 'wildcard', 'second'], calls)
+
+        del calls[:]
+        with self.assertRaises(CantExecute):
+            ctx.execute('run away')
+        self.assertEqual(['wildcard'], calls)
+
+        # the index is rebuilt when handlers are added
+        del calls[:]
+        ctx.handlers.append(KeywordLineHandler(_record('third'), {'run'}))
+        self.assertEqual('third', ctx.execute('run away'))
+        self.assertEqual(['wildcard', 'third'], calls)
+
+    def test_replaced_handlers(self):
+        class FirstLineHandler(ExactLineHandler):
+            @bind_command('first')
+            def first(self):
+                return 'first'
+
+        class SecondLineHandler(ExactLineHandler):
+            @bind_command('second')
+            def second(self):
+                return 'second'
+
+        ctx = DummyCommandContext(handlers=[FirstLineHandler()])
+        self.assertEqual('first', ctx.execute('first'))
+        ctx.handlers[0] = SecondLineHandler()
+        self.assertEqual('second', ctx.execute('second'))
+        with self.assertRaises(CantExecute):
+            ctx.execute('first')
+        self.assertIsNone(ctx.get_command('first'))
+        self.assertEqual('second', ctx.get_command('second')[1]['method'].__name__)
+
+    def test_dispatch_index_with_custom_protocol(self):
+        # handlers that customize try_execute may accept lines their commands aren't bound to
+        class DateLineHandler(ExactLineHandler):
+            @bind_command('date')
+            def date(self):
+                return 'today'
+
+            def try_execute(self, line):
+                if line.strip() == 'dt':
+                    return self.date()
+                return super().try_execute(line)
+
+        class ShowLineHandler(ArgparseLineHandler):
+            @bind_command('show', ['what'])
+            def show(self, what):
+                return what
+
+            def dispatch(self, line):
+                if line.strip() == '?':
+                    return 'help'
+                return super().dispatch(line)
+
+        ctx = DummyCommandContext(handlers=[DateLineHandler(), ShowLineHandler()])
+        self.assertEqual('today', ctx.execute('dt'))
+        self.assertEqual('help', ctx.execute('?'))
+        self.assertEqual('it', ctx.execute('show it'))
+
+    def test_compiled_patterns(self):
+        class GreetingLineHandler(RegexLineHandler):
+            @bind_command(re.compile(r'hello (?P<name>\w+)'))
+            def hello(self, name):
+                return name
+
+            @bind_command(re.compile(r'bye', re.IGNORECASE))
+            def bye(self):
+                return 'bye'
+
+        ctx = DummyCommandContext(handlers=[GreetingLineHandler()])
+        self.assertEqual('world', ctx.execute('hello world'))
+        self.assertEqual('bye', ctx.execute('BYE'))
+
     def test_exit(self):
         ctx = DummyCommandContext()
         with self.assertRaises(ExitContext):
@@ -86,3 +250,409 @@ class CommandContextCase(TestCase):
         ctx.write('')
         self.assertTrue(stream.written, 'Not written')
         self.assertTrue(stream.flushed, 'Not flushed')
+
+    def test_write_line_buffered(self):
+        ctx = DummyCommandContext()
+        stream = DummyOutStream()
+        ctx.set_out_stream(stream)
+        ctx.set_output_policy(OUTPUT_LINE_BUFFERED)
+
+        ctx.write('no newline')
+        self.assertEqual(0, stream.flush_count)
+        ctx.write('newline\n')
+        self.assertEqual(1, stream.flush_count)
+
+    def test_write_buffered(self):
+        ctx = DummyCommandContext()
+        stream = DummyOutStream()
+        ctx.set_out_stream(stream)
+        ctx.set_output_policy(OUTPUT_BUFFERED, 10)
+
+        ctx.write('12345\n')
+        self.assertEqual(0, stream.flush_count)
+        ctx.write('67890\n')
+        self.assertEqual(1, stream.flush_count)
+        ctx.write('12345\n')
+        self.assertEqual(1, stream.flush_count)
+        ctx.flush()
+        self.assertEqual(2, stream.flush_count)
+
+        with self.assertRaises(ValueError):
+            ctx.set_output_policy('sometimes')
+
+
+class PrebuiltCommandContextCase(TestCase):
+    def test_execute(self):
+        ctx = DummyPrebuiltContext()
+        ctx.execute('ping')
+        ctx.execute('say hello')
+        self.assertEqual(['pong', 'hello'], ctx.log)
+
+        with self.assertRaises(CantExecute):
+            ctx.execute('qwerty')
+
+    def test_handler_classes_are_shared(self):
+        first, second = DummyPrebuiltContext(), DummyPrebuiltContext()
+        self.assertEqual(
+            [handler.__class__ for handler in first.handlers],
+            [handler.__class__ for handler in second.handlers],
+        )
+        self.assertEqual(2, len(first.handlers))
+
+    def test_extra_handlers(self):
+        ctx = DummyPrebuiltContext(handlers=[FuncLineHandler(_raise)])
+        self.assertEqual(3, len(ctx.handlers))
+        ctx.execute('ping')
+        self.assertEqual(['pong'], ctx.log)
+
+    def test_clone(self):
+        ctx = DummyPrebuiltContext()
+        clone = ctx.clone()
+        self.assertEqual(len(ctx.handlers), len(clone.handlers))
+        clone.execute('say hi')
+        self.assertEqual(['hi'], clone.log)
+        self.assertEqual([], ctx.log)
+
+
+class ParseCacheCase(TestCase):
+    def test_cache(self):
+        ctx = CachedContext()
+        for line in ('ping', 'say hi', 'ping', 'ping', 'say hi'):
+            ctx.execute(line)
+        self.assertEqual(['pong', 'hi', 'pong', 'pong', 'hi'], ctx.log)
+        self.assertEqual(
+            {'hits': 3, 'misses': 2, 'hit_rate': 0.6, 'size': 2, 'max_size': 2},
+            ctx.parse_cache.stats()
+        )
+
+        # the least recently used line is evicted
+        ctx.execute('say bye')
+        self.assertEqual(['say hi', 'say bye'], list(ctx.parse_cache.items))
+
+    def test_unmatched_lines(self):
+        ctx = CachedContext()
+        for _ in range(2):
+            with self.assertRaises(CantExecute):
+                ctx.execute('qwerty')
+        self.assertEqual(1, ctx.parse_cache.hits)
+
+    def test_mutable_arguments_are_copied(self):
+        ctx = CachedContext()
+        ctx.execute('push a b')
+        ctx.execute('push a b')
+        self.assertEqual([['a', 'b', '!'], ['a', 'b', '!']], ctx.log)
+        self.assertEqual(1, ctx.parse_cache.hits)
+
+    def test_file_arguments(self):
+        class FileContext(CachedContext):
+            @bind_argparse('cat', [['file', {'type': argparse.FileType('r')}]])
+            def cat(self, file):
+                with file:
+                    self.log.append(file.read())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.txt')
+            with open(path, 'w') as file:
+                file.write('data')
+
+            ctx = FileContext()
+            for _ in range(2):
+                ctx.execute('cat {0}'.format(path))
+        self.assertEqual(['data', 'data'], ctx.log)
+        self.assertEqual(0, len(ctx.parse_cache))
+
+    def test_impure_types(self):
+        counter = itertools.count()
+
+        class TicketContext(CachedContext):
+            @bind_argparse('ticket', [['--number', {'type': lambda value: next(counter), 'default': '0'}]])
+            def ticket(self, number):
+                self.log.append(number)
+
+            @bind_argparse('pure', [['--number', {'type': int}]], deterministic=False)
+            def pure(self, number):
+                self.log.append(number)
+
+        ctx = TicketContext()
+        for line in ('ticket', 'ticket', 'pure --number 1', 'pure --number 1'):
+            ctx.execute(line)
+        self.assertEqual([0, 1, 1, 1], ctx.log)
+        self.assertEqual(0, len(ctx.parse_cache))
+
+    def test_invalidation(self):
+        ctx = CachedContext()
+        ctx.execute('ping')
+        self.assertEqual(1, len(ctx.parse_cache))
+
+        log = []
+        ctx.handlers.insert(0, KeywordLineHandler(log.append, {'ping'}))
+        ctx.execute('ping')
+        self.assertEqual(['ping'], log)
+
+        ctx.handlers = [FuncLineHandler(log.append)]
+        ctx.execute('ping')
+        self.assertEqual(['ping', 'ping'], log)
+        # the handler isn't deterministic, so nothing is cached
+        self.assertEqual(0, len(ctx.parse_cache))
+
+    def test_replaced_handler(self):
+        class PingLineHandler(ExactLineHandler):
+            def __init__(self, reply):
+                super().__init__()
+                self.reply = reply
+
+            @bind_command('ping')
+            def ping(self):
+                return self.reply
+
+        ctx = DummyCommandContext(handlers=[PingLineHandler('pong')])
+        ctx.enable_parse_cache()
+        self.assertEqual('pong', ctx.execute('ping'))
+        self.assertEqual(1, len(ctx.parse_cache))
+
+        ctx.handlers[0] = PingLineHandler('PONG')
+        self.assertEqual('PONG', ctx.execute('ping'))
+        self.assertEqual(0, ctx.parse_cache.hits)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(DummyPrebuiltContext().parse_cache)
+
+
+class JsonContextCase(TestCase):
+    def make_context(self, **kwargs):
+        results = []
+        ctx = JsonContext(callback=results.append, **kwargs)
+        ctx.set_out_stream(io.StringIO())
+        return ctx, results
+
+    def feed(self, ctx, lines):
+        with self.assertRaises(ExitContext):
+            for line in lines:
+                ctx.execute(line)
+
+    def test_parse(self):
+        ctx, results = self.make_context()
+        self.feed(ctx, ['{"a":\n', '\n', '[1, 2]}\n', '\n', '\n'])
+        self.assertEqual([{'a': [1, 2]}], results)
+
+    def test_buffer(self):
+        ctx, results = self.make_context()
+        ctx.execute('[1,\n')
+        ctx.execute('2]\n')
+        self.assertEqual('[1,\n2]\n', ctx.buffer)
+        ctx.buffer = '[3]'
+        self.assertEqual(3, ctx.buffer_size)
+        self.feed(ctx, ['\n', '\n'])
+        self.assertEqual([[3]], results)
+
+    def test_overflow(self):
+        ctx, results = self.make_context(max_buffer_size=10)
+        self.feed(ctx, ['[1, 2, 3,\n', '4]\n'])
+        self.assertEqual([], results)
+        self.assertEqual('The input exceeds the maximum size of 10 characters\n', ctx.out_stream.getvalue())
+        self.assertEqual('', ctx.buffer)
+
+    def test_overflow_truncate(self):
+        ctx, results = self.make_context(max_buffer_size=6, overflow_policy=OVERFLOW_TRUNCATE)
+        for line in ['"abc\n', 'def"\n', 'ghi\n']:
+            ctx.execute(line)
+        self.assertEqual('"abc\nd', ctx.buffer)
+        self.assertTrue(ctx.buffer_truncated)
+
+        with self.assertRaises(ValueError):
+            JsonContext(overflow_policy='never')
+
+    def test_incremental(self):
+        ctx, results = self.make_context(incremental=True)
+        ctx.execute('{"a":\n')
+        ctx.execute('\n')
+        with self.assertRaises(ExitContext):
+            ctx.execute('[1, 2]}\n')
+        self.assertEqual([{'a': [1, 2]}], results)
+
+    def test_incremental_error(self):
+        ctx, results = self.make_context(incremental=True)
+        ctx.execute('[1,\n')
+        with self.assertRaises(ExitContext):
+            ctx.execute('2 3]\n')
+        self.assertEqual([], results)
+        self.assertEqual("Expecting ',' delimiter: line 2 column 3\n", ctx.out_stream.getvalue())
+
+    def test_json_lines(self):
+        ctx, results = self.make_context(json_lines=True)
+        self.feed(ctx, ['{"a": 1}\n', '[2]\n', '3\n', '\n', '\n'])
+        self.assertEqual([{'a': 1}, [2], 3], results)
+        self.assertEqual('', ctx.out_stream.getvalue())
+
+
+class ResultCacheCase(TestCase):
+    def test_output_is_replayed(self):
+        ctx = CatalogContext()
+        self.assertEqual(1, ctx.execute('get a'))
+        self.assertEqual(1, ctx.execute('get a'))
+        ctx.execute('get b')
+        self.assertEqual('1\n1\nNone\n', ctx.out_stream.getvalue())
+        self.assertEqual(2, ctx.lookups)
+        self.assertEqual(
+            {'get': {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'size': 2, 'max_size': 2}},
+            ctx.result_cache.stats()
+        )
+
+    def test_invalidation(self):
+        ctx = CatalogContext()
+        ctx.execute('get a')
+        ctx.execute('size')
+        ctx.execute('get a')
+        self.assertEqual(1, ctx.lookups)
+
+        ctx.execute('set a 2')
+        self.assertEqual(2, ctx.execute('get a'))
+        self.assertEqual(2, ctx.lookups)
+        self.assertEqual('1\n1\n1\n2\n', ctx.out_stream.getvalue())
+
+    def test_invalidation_by_other_handlers(self):
+        items = {'a': 1}
+        ctx = CatalogContext(handlers=[KeywordLineHandler(lambda line: items.update(b=2), {'add'})])
+        ctx.items = items
+        ctx.execute('keys')
+        ctx.execute('add b')
+        ctx.execute('keys')
+        self.assertEqual('a\na\nb\n', ctx.out_stream.getvalue())
+        self.assertEqual(2, ctx.lookups)
+
+    def test_built_in_commands_keep_results(self):
+        class CatalogPrompt(CatalogContext, StandardPrompt):
+            pipelines = True
+
+        ctx = CatalogPrompt()
+        for line in ('get a', 'echo hi', 'stats', 'jobs', 'keys | grep a', 'get a'):
+            ctx.execute(line)
+        self.assertEqual(2, ctx.lookups)
+
+    def test_streamed_output(self):
+        ctx = CatalogContext()
+        ctx.execute('keys')
+        ctx.execute('keys')
+        self.assertEqual('a\na\n', ctx.out_stream.getvalue())
+        self.assertEqual(1, ctx.lookups)
+
+    def test_ttl(self):
+        ctx = CatalogContext()
+        now = [0.0]
+        ctx.get_result_cache()
+        original_clock = LRUCache.clock
+        LRUCache.clock = staticmethod(lambda: now[0])
+        try:
+            ctx.execute('get a')
+            now[0] = 59.0
+            ctx.execute('get a')
+            now[0] = 60.0
+            ctx.execute('get a')
+        finally:
+            LRUCache.clock = original_clock
+        self.assertEqual(2, ctx.lookups)
+
+    def test_background_commands_cant_be_cached(self):
+        with self.assertRaises(ValueError):
+            bind_exact('qwerty', cache=True, background=True)
+
+    def test_async_commands_cant_be_cached(self):
+        async def qwerty(self):
+            pass
+
+        with self.assertRaises(ValueError):
+            bind_exact('qwerty', cache=True)(qwerty)
+
+
+class ReorderingContext(DummyCommandContext):
+    reorder_interval = 4
+
+
+class ExclusiveLineHandler(KeywordLineHandler):
+    exclusive = True
+
+
+class PinnedLineHandler(FuncLineHandler):
+    pinned = True
+
+
+class HandlerOrderingCase(TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def make_handler(self, handler_class, name, *args):
+        def func(line):
+            self.calls.append(name)
+            if not line.startswith(name):
+                raise CantParseLine
+        return handler_class(func, *args)
+
+    def test_reorder(self):
+        numbers = self.make_handler(FuncLineHandler, '1')
+        pong = self.make_handler(KeywordLineHandler, 'pong', {'pong'})
+        ping = self.make_handler(ExclusiveLineHandler, 'ping', {'ping'})
+        ctx = ReorderingContext(handlers=[numbers, pong, ping])
+        for _ in range(3):
+            ctx.execute('ping')
+        self.assertEqual([numbers, pong, ping], ctx.handlers)
+        ctx.execute('ping')
+        self.assertEqual([ping, numbers, pong], ctx.handlers)
+        self.assertEqual({ping: 2}, ctx._handler_hits)
+
+        self.calls.clear()
+        ctx.execute('ping')
+        self.assertEqual(['ping'], self.calls)
+
+        # pong might accept the lines numbers accepts
+        for _ in range(8):
+            ctx.execute('pong')
+        self.assertEqual([ping, numbers, pong], ctx.handlers)
+
+    def test_constraints(self):
+        numbers = self.make_handler(PinnedLineHandler, '1')
+        ping = self.make_handler(ExclusiveLineHandler, 'ping', {'ping'})
+        ctx = ReorderingContext(handlers=[numbers, ping])
+        for _ in range(4):
+            ctx.execute('ping')
+        self.assertEqual([numbers, ping], ctx.handlers)
+
+        numbers = self.make_handler(FuncLineHandler, '1')
+        ping.conflicts_with = (FuncLineHandler,)
+        self.assertFalse(ctx.can_swap_handlers(numbers, ping))
+        self.assertFalse(ctx.can_swap_handlers(ping, numbers))
+        ping.conflicts_with = ()
+        self.assertTrue(ctx.can_swap_handlers(numbers, ping))
+        self.assertTrue(ctx.can_swap_handlers(
+            self.make_handler(KeywordLineHandler, 'a', {'a'}), self.make_handler(KeywordLineHandler, 'b', {'b'})
+        ))
+        self.assertFalse(ctx.can_swap_handlers(
+            self.make_handler(KeywordLineHandler, 'a', {'a'}), self.make_handler(KeywordLineHandler, 'a', {'a', 'b'})
+        ))
+
+    def test_parse_cache(self):
+        class PingLineHandler(ExactLineHandler):
+            exclusive = True
+
+            @bind_command('ping')
+            def ping(self):
+                return 'pong'
+
+        numbers = self.make_handler(FuncLineHandler, '1')
+        ping = PingLineHandler()
+        ctx = ReorderingContext(handlers=[numbers, ping])
+        ctx.enable_parse_cache()
+        ctx.execute('1')  # lines tried by numbers aren't cached, it isn't deterministic
+        for _ in range(3):
+            self.assertEqual('pong', ctx.execute('ping'))
+        self.assertEqual([ping, numbers], ctx.handlers)
+
+        # now that ping comes first, the line is cached, and cache hits are counted too
+        for _ in range(5):
+            self.assertEqual('pong', ctx.execute('ping'))
+        self.assertEqual({ping: 3}, ctx._handler_hits)
+        self.assertEqual(4, ctx.parse_cache.stats()['hits'])
+
+    def test_disabled_by_default(self):
+        ctx = DummyCommandContext(handlers=[self.make_handler(FuncLineHandler, '1')])
+        ctx.execute('1')
+        self.assertIsNone(ctx._handler_hits)
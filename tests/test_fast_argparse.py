@@ -0,0 +1,156 @@
+import io
+import sys
+from unittest import TestCase
+
+from pymander.handlers import NO_MATCH, ArgparseLineHandler, FastArgparseLineHandler
+from pymander.decorators import bind_command
+from pymander.fastargs import FALLBACK
+
+
+class FakeContext:
+    def __init__(self):
+        self.out_stream = io.StringIO()
+
+    def write(self, text):
+        self.out_stream.write(text)
+
+
+# (command options, lines to parse, lines that must not fall back to argparse)
+CONFORMANCE_CASES = [
+    (
+        [['what'], ['--joy', {'action': 'store_true'}]],
+        ['do chores', 'do homework --joy', 'do --joy homework', 'do', 'do a b', 'do -h', 'do --help',
+         'do --jo x', 'do -- x', 'do x --joy=1', 'do --joy --joy x', 'do -x'],
+        ['do chores', 'do homework --joy', 'do --joy homework'],
+    ),
+    (
+        [['--format', '-f', {'dest': 'text_format', 'default': 'plain'}]],
+        ['do', 'do -f json', 'do --format=json', 'do -f', 'do -fjson', 'do --format json --format xml',
+         'do -f=json', 'do json'],
+        ['do', 'do -f json', 'do --format=json', 'do --format json --format xml', 'do -f=json'],
+    ),
+    (
+        [['game', {'type': str, 'default': 'nothing'}], ['--well', {'action': 'store_true'}]],
+        ['do', 'do chess', 'do chess --well', 'do --well chess', 'do --well'],
+        ['do chess', 'do chess --well', 'do --well chess'],
+    ),
+    (
+        [
+            ['x', {'type': int}],
+            ['y', {'type': float, 'nargs': '?', 'default': '2.5'}],
+            ['--n', {'type': int, 'default': '7'}],
+            ['--c', {'choices': ['a', 'b']}],
+        ],
+        ['do 1', 'do 1 2', 'do 1 2 3', 'do x', 'do 1 --n 3', 'do 1 --n x', 'do --c a 1', 'do --c z 1',
+         'do 1 -5', 'do -1', 'do 1 --c b 2'],
+        ['do 1', 'do 1 2', 'do 1 --n 3', 'do --c a 1'],
+    ),
+    (
+        [
+            ['items', {'nargs': '*'}],
+            ['--tag', {'action': 'append'}],
+            ['-v', {'action': 'count'}],
+            ['--pair', {'nargs': 2}],
+            ['--opt', {'nargs': '?', 'const': 'C', 'default': 'D'}],
+        ],
+        ['do', 'do a b c', 'do --tag x --tag y a', 'do a --tag x', 'do a --tag x b', 'do -v -v a', 'do -vv a',
+         'do --pair 1 2 a', 'do --pair 1', 'do --opt', 'do --opt a', 'do a --opt', 'do --opt=z',
+         'do --pair=1 2'],
+        ['do', 'do a b c', 'do --tag x --tag y a', 'do a --tag x', 'do -v -v a', 'do --pair 1 2 a',
+         'do --opt', 'do --opt a', 'do a --opt', 'do --opt=z'],
+    ),
+    (
+        [['first'], ['rest', {'nargs': '+'}], ['--k', {'nargs': '*'}]],
+        ['do a b c', 'do a', 'do --k a b c', 'do a b --k', 'do a b --k x y', 'do --k'],
+        ['do a b c', 'do a b --k', 'do a b --k x y'],
+    ),
+    (
+        [['src', {'nargs': 2}], ['dst']],
+        ['do a b c', 'do a b', 'do a b c d'],
+        ['do a b c'],
+    ),
+    (
+        [
+            ['--req', {'required': True}],
+            ['--const', {'action': 'store_const', 'const': 42}],
+            ['--no', {'action': 'store_false'}],
+            ['--ac', {'action': 'append_const', 'const': 1, 'dest': 'acc'}],
+        ],
+        ['do --req r', 'do', 'do --const --req r --no', 'do --ac --ac --req x', 'do --req'],
+        ['do --req r', 'do --const --req r --no', 'do --ac --ac --req x'],
+    ),
+    (
+        [['c', {'nargs': '*', 'choices': ['x', 'y']}]],
+        ['do', 'do x y', 'do z'],
+        ['do x y'],
+    ),
+    (
+        [['opt', {'nargs': '?'}], ['--f', {'action': 'store_true'}]],
+        ['do --f x', 'do x --f', 'do --f', 'do'],
+        ['do --f x', 'do x --f', 'do --f', 'do'],
+    ),
+]
+
+if sys.version_info >= (3, 8):
+    # ('extend' was added to argparse in Python 3.8)
+    CONFORMANCE_CASES.append((
+        # not supported by the compiled parser at all
+        [['--e', {'action': 'extend', 'nargs': '+'}]],
+        ['do --e a b --e c', 'do'],
+        [],
+    ))
+
+
+def make_handler(base_class, options):
+    class TestHandler(base_class):
+        @bind_command('do', options)
+        def do(self, **kwargs):
+            return kwargs
+
+        @bind_command('other')
+        def other(self):
+            return 'other'
+
+    handler = TestHandler()
+    handler.set_context(FakeContext())
+    return handler
+
+
+class FastArgparseConformanceCase(TestCase):
+    def assert_same_result(self, options, line):
+        argparse_handler = make_handler(ArgparseLineHandler, options)
+        fast_handler = make_handler(FastArgparseLineHandler, options)
+
+        results = []
+        for handler in (argparse_handler, fast_handler):
+            resolved = handler.resolve(line)
+            if resolved is NO_MATCH:
+                results.append(NO_MATCH)
+            else:
+                command_info, kwargs = resolved
+                results.append((command_info and command_info['args'][0], kwargs))
+
+            results.append(handler.context.out_stream.getvalue())
+
+        self.assertEqual(results[:2], results[2:], 'Line: {0!r}, options: {1!r}'.format(line, options))
+
+    def test_conformance(self):
+        for options, lines, fast_lines in CONFORMANCE_CASES:
+            for line in lines + ['other', 'other x', 'qwerty', '-h', '']:
+                self.assert_same_result(options, line)
+
+    def test_fast_path(self):
+        for options, lines, fast_lines in CONFORMANCE_CASES:
+            handler = make_handler(FastArgparseLineHandler, options)
+            command_info, compiled_command = handler.get_compiled_commands()['do']
+            for line in fast_lines:
+                self.assertIsNot(FALLBACK, compiled_command.parse(line.split()[1:]), line)
+
+    def test_parser_is_built_lazily(self):
+        handler = make_handler(FastArgparseLineHandler, [['what']])
+        handler.dispatch('do chores')
+        self.assertIsNone(handler._parser)
+
+        handler.dispatch('do -h')
+        self.assertIsNotNone(handler._parser)
+        self.assertIn('usage:', handler.context.out_stream.getvalue())
@@ -0,0 +1,149 @@
+import io
+import json
+import threading
+from unittest import TestCase
+
+from pymander.commander import Commander
+from pymander.exceptions import ExitMainloop
+from pymander.contexts import StandardPrompt, PrebuiltCommandContext
+from pymander.decorators import bind_exact, bind_regex
+from pymander.handlers import ExactLineHandler
+from pymander.protocol import MachineCommander
+
+
+slow_job_started = threading.Event()
+release_slow_job = threading.Event()
+
+
+class BackgroundLineHandler(ExactLineHandler):
+    @bind_exact('slow', background=True)
+    def slow(self):
+        slow_job_started.set()
+        release_slow_job.wait(5)
+        self.context.write('Slow job done\n')
+        return 42
+
+    @bind_exact('broken', background=True)
+    def broken(self):
+        self.context.write('Trying\n')
+        raise RuntimeError('Broken!')
+
+
+class ComputingContext(PrebuiltCommandContext, StandardPrompt):
+    @bind_regex(r'^square (?P<number>\d+)$', background=True, executor='process')
+    def square(self, number):
+        self.write('Computing\n')
+        return int(number) ** 2
+
+
+class JobsCase(TestCase):
+    def setUp(self):
+        slow_job_started.clear()
+        release_slow_job.clear()
+        self.context = StandardPrompt([BackgroundLineHandler()])
+        self.context.set_out_stream(io.StringIO())
+
+    def get_output(self):
+        output = self.context.out_stream.getvalue()
+        self.context.out_stream.seek(0)
+        self.context.out_stream.truncate()
+        return output
+
+    def test_background_job(self):
+        job = self.context.execute('slow\n')
+        slow_job_started.wait(5)
+        self.assertEqual('[1] slow started\n', self.get_output())
+
+        self.context.execute('jobs\n')
+        self.assertEqual('[1] slow running\n', self.get_output())
+
+        # the output of a running job is held back
+        self.context.execute('echo hi\n')
+        self.assertEqual('hi\n', self.get_output())
+
+        release_slow_job.set()
+        self.context.execute('wait 1\n')
+        self.assertEqual('Slow job done\n[1] slow done\n', self.get_output())
+        self.assertEqual(42, job.result)
+
+        self.context.execute('jobs\n')
+        self.context.execute('wait 1\n')
+        self.assertEqual('No such job: 1\n', self.get_output())
+
+    def test_failed_job(self):
+        self.context.execute('broken\n')
+        self.context.execute('wait\n')
+        self.assertEqual(
+            '[1] broken started\nTrying\n[1] broken failed: RuntimeError: Broken!\n',
+            self.get_output()
+        )
+
+    def test_cancel_running_job(self):
+        self.context.execute('slow\n')
+        slow_job_started.wait(5)
+        self.context.execute('cancel 1\n')
+        release_slow_job.set()
+        self.context.execute('wait\n')
+        self.assertEqual(
+            '[1] slow started\n[1] slow is running and can\'t be cancelled\nSlow job done\n[1] slow done\n',
+            self.get_output()
+        )
+
+    def test_reported_before_prompt(self):
+        release_slow_job.set()
+        commander = Commander(
+            StandardPrompt([BackgroundLineHandler()]),
+            in_stream=io.StringIO('broken\n'), out_stream=io.StringIO(),
+        )
+        commander.read_and_execute()
+        commander.context.get_job_manager().jobs[1].future.exception()
+        with self.assertRaises(ExitMainloop):
+            commander.read_and_execute()
+        self.assertEqual(
+            '>>> [1] broken started\nTrying\n[1] broken failed: RuntimeError: Broken!\n>>> ',
+            commander.out_stream.getvalue()
+        )
+
+    def test_run_script(self):
+        commander = Commander(StandardPrompt([BackgroundLineHandler()]), out_stream=io.StringIO())
+
+        def script():
+            yield 'broken'
+            commander.context.get_job_manager().jobs[1].future.exception()
+            yield 'slow'
+            slow_job_started.wait(5)
+            threading.Timer(0.05, release_slow_job.set).start()
+            yield 'echo hi'
+
+        self.assertEqual(0, commander.run_script(script()))
+        # finished jobs are reported between lines, the others at the end of the script
+        self.assertEqual(
+            '[1] broken started\nTrying\n[1] broken failed: RuntimeError: Broken!\n'
+            '[2] slow started\nhi\nSlow job done\n[2] slow done\n',
+            commander.out_stream.getvalue()
+        )
+
+    def test_machine_protocol(self):
+        release_slow_job.set()
+        out_stream = io.StringIO()
+        MachineCommander(
+            StandardPrompt([BackgroundLineHandler()]), in_stream=io.StringIO('{"id": 1, "line": "slow"}\n'),
+            out_stream=out_stream,
+        ).mainloop()
+        response = json.loads(out_stream.getvalue())
+        self.assertEqual('[1] slow started\nSlow job done\n[1] slow done\n', response['output'])
+
+    def test_async_commands_cant_be_run_in_background(self):
+        async def sleep(self):
+            pass
+
+        with self.assertRaises(ValueError):
+            bind_exact('sleep', background=True)(sleep)
+
+    def test_process_job(self):
+        context = ComputingContext()
+        context.set_out_stream(io.StringIO())
+        job = context.execute('square 12\n')
+        context.execute('wait\n')
+        self.assertEqual('[1] square started\nComputing\n[1] square done\n', context.out_stream.getvalue())
+        self.assertEqual(144, job.result)
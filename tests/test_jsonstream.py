@@ -0,0 +1,70 @@
+import json
+from unittest import TestCase
+
+from pymander.jsonstream import IncrementalJsonDecoder
+
+
+VALID_DOCUMENTS = [
+    '{}', '[]', '0', '-1.5e+3', '"text"', 'true', 'null', 'NaN', '-Infinity',
+    '{"a": [1, 2, {"b": null}], "c": "d"}',
+    '[\n  1,\n  "two",\n  [3, [4]],\n  {"five": {"six": [true, false]}}\n]',
+    '{\n"escapes": "\\" \\\\ \\/ \\b \\f \\n \\r \\t \\u00e9",\n"unicode": "\u00e9\u4e2d"\n}',
+    '  [ 1 ,\t2 ]  ',
+]
+
+INVALID_DOCUMENTS = [
+    '[1, 2', '[1 2]', '{"a" 1}', '{"a": 1,}', '[1,]', '{1: 2}', '[}', '{]', '01', '1.', '.5', '-', '+1',
+    '"unterminated', '"bad \\x escape"', '"tab\tinside"', 'tru', 'nulls', '[1]]', '{"a": 1} x', "'single'",
+    '[\n1,\n2\n3\n]',
+]
+
+
+def decode_lines(text, **kwargs):
+    decoder = IncrementalJsonDecoder(**kwargs)
+    documents = []
+    for line in text.splitlines(True):
+        documents += decoder.feed(line)
+    decoder.close()
+    return documents
+
+
+class IncrementalJsonDecoderCase(TestCase):
+    def test_valid(self):
+        for text in VALID_DOCUMENTS:
+            expected = json.loads(text)
+            documents = decode_lines(text)
+            if expected != expected:  # NaN
+                self.assertNotEqual(documents[0], documents[0])
+            else:
+                self.assertEqual([expected], documents, text)
+
+    def test_invalid(self):
+        for text in INVALID_DOCUMENTS:
+            with self.assertRaises(ValueError, msg=text):
+                json.loads(text)
+            with self.assertRaises(json.JSONDecodeError, msg=text):
+                decode_lines(text)
+
+    def test_error_line(self):
+        decoder = IncrementalJsonDecoder()
+        decoder.feed('{\n')
+        decoder.feed('  "a": [1,\n')
+        with self.assertRaises(json.JSONDecodeError) as context:
+            decoder.feed('    2 3],\n')
+        self.assertEqual(3, context.exception.lineno)
+        self.assertEqual(7, context.exception.colno)
+        self.assertEqual("Expecting ',' delimiter: line 3 column 7", str(context.exception))
+
+    def test_document_is_complete(self):
+        decoder = IncrementalJsonDecoder()
+        self.assertEqual([], decoder.feed('[1,\n'))
+        self.assertTrue(decoder.in_document)
+        self.assertEqual([[1, 2]], decoder.feed('2]\n'))
+        self.assertFalse(decoder.in_document)
+
+    def test_json_lines(self):
+        text = '{"a": 1}\n\n[2,\n3] "four"\n5\n'
+        self.assertEqual([{'a': 1}, [2, 3], 'four', 5], decode_lines(text, json_lines=True))
+
+        with self.assertRaises(json.JSONDecodeError):
+            decode_lines(text)
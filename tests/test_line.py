@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from pymander.contexts import CommandContext
+from pymander.handlers import LineHandler, ExactLineHandler, ArgparseLineHandler
+from pymander.decorators import bind_command
+from pymander.exceptions import CantParseLine
+from pymander.line import Line, as_line
+
+
+class RecordingLineHandler(LineHandler):
+    accepts_line = True
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def try_execute(self, line):
+        line = as_line(line)
+        self.lines.append(line)
+        if line.first_token != 'record':
+            raise CantParseLine(line)
+
+        return line.shlex_tokens[1:]
+
+
+class PingLineHandler(ExactLineHandler):
+    @bind_command('ping')
+    def ping(self):
+        return 'pong'
+
+
+class AddLineHandler(ArgparseLineHandler):
+    @bind_command('add', [['numbers', {'type': int, 'nargs': '*'}]])
+    def add(self, numbers):
+        return sum(numbers)
+
+
+class LineContext(CommandContext):
+    def prompt(self):
+        pass
+
+    def on_cant_execute(self, line):
+        pass
+
+
+class LineCase(TestCase):
+    def test_memoized_attributes(self):
+        line = Line('  say "hello world"\n')
+        self.assertEqual('say "hello world"', line.stripped)
+        self.assertEqual(['say', '"hello', 'world"'], line.tokens)
+        self.assertEqual(['say', 'hello world'], line.shlex_tokens)
+        self.assertEqual('say', line.first_token)
+        self.assertIs(line.tokens, line.tokens)
+        self.assertEqual('  say "hello world"\n', line)
+
+        self.assertEqual('', Line('\n').first_token)
+        self.assertIsNone(Line('say "oops').shlex_tokens)
+        self.assertIs(line, as_line(line))
+
+    def test_context_passes_lines(self):
+        recorder = RecordingLineHandler()
+        ctx = LineContext([recorder, PingLineHandler(), AddLineHandler()])
+        self.assertEqual(['a b', 'c'], ctx.execute('record "a b" c'))
+        self.assertEqual('pong', ctx.execute(' ping '))
+        self.assertEqual(3, ctx.execute('add 1 2'))
+        self.assertEqual(3, len(recorder.lines))
+        for line in recorder.lines:
+            self.assertIs(Line, type(line))
+
+    def test_plain_strings_by_default(self):
+        lines = []
+
+        class PlainLineHandler(LineHandler):
+            def try_execute(self, line):
+                lines.append(line)
+                raise CantParseLine(line)
+
+        ctx = LineContext([PlainLineHandler(), PingLineHandler()])
+        self.assertEqual('pong', ctx.execute('ping'))
+        self.assertIs(str, type(lines[0]))
@@ -0,0 +1,164 @@
+import asyncio
+import io
+import json
+import time
+from unittest import TestCase
+
+from pymander.commander import Commander
+from pymander.contexts import StandardPrompt, PrebuiltCommandContext
+from pymander.decorators import bind_exact
+from pymander.metrics import Metrics, Histogram, JsonLinesSink, HISTOGRAM_BOUNDS
+
+
+class InventoryContext(PrebuiltCommandContext, StandardPrompt):
+    @bind_exact('count')
+    def count(self):
+        self.write('3\n')
+
+    @bind_exact('crash')
+    def crash(self):
+        raise RuntimeError('Crashed')
+
+    @bind_exact('lines')
+    def lines(self):
+        yield 'first\n'
+        time.sleep(0.05)
+        raise RuntimeError('Out of lines')
+
+    @bind_exact('nap')
+    async def nap(self):
+        await asyncio.sleep(0.05)
+
+    @bind_exact('nightmare')
+    async def nightmare(self):
+        await asyncio.sleep(0)
+        raise RuntimeError('Woke up')
+
+
+class MetricsCase(TestCase):
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in (0.000001, 0.0005, 0.0005, 20.0):
+            histogram.add(value)
+
+        self.assertEqual(4, histogram.count)
+        self.assertEqual(20.0, histogram.max)
+        self.assertEqual([1, 0, 2, 0, 0, 0, 0, 1], histogram.buckets)
+        self.assertEqual(len(HISTOGRAM_BOUNDS) + 1, len(histogram.as_dict()['buckets']))
+
+    def test_context_metrics(self):
+        events = io.StringIO()
+        metrics = Metrics(sinks=[JsonLinesSink(events)])
+        commander = Commander(
+            InventoryContext(), in_stream=io.StringIO('count\necho hi\ncount\nqwerty\n\n'),
+            out_stream=io.StringIO(), metrics=metrics,
+        )
+        commander.mainloop()
+
+        commands = {
+            (command['handler'], command['command']): command
+            for command in metrics.snapshot()['commands']
+        }
+        self.assertEqual(2, commands[('InventoryContext.ExactLineHandler', 'count')]['count'])
+        self.assertEqual(1, commands[('EchoLineHandler', 'echo')]['count'])
+        self.assertEqual(1, commands[('EmptyLineHandler', None)]['count'])
+        self.assertEqual({'InventoryContext': 1}, metrics.snapshot()['unmatched'])
+        # the context is exited at the end of input
+        self.assertEqual(
+            [{'type': 'enter', 'context': 'InventoryContext', 'count': 1},
+             {'type': 'exit', 'context': 'InventoryContext', 'count': 1}],
+            metrics.snapshot()['context_events']
+        )
+
+        event_types = [json.loads(line)['type'] for line in events.getvalue().splitlines()]
+        self.assertEqual(['enter', 'command', 'command', 'command', 'unmatched', 'command', 'exit'], event_types)
+
+    def test_parse_cache(self):
+        context = InventoryContext()
+        context.set_out_stream(io.StringIO())
+        context.enable_parse_cache()
+        context.metrics = Metrics()
+        for line in ('count\n', 'count\n', 'qwerty\n', 'qwerty\n'):
+            context.execute(line)
+        with self.assertRaises(RuntimeError):
+            context.execute('crash\n')
+
+        commands = {command['command']: command for command in context.metrics.snapshot()['commands']}
+        self.assertEqual(2, commands['count']['count'])
+        self.assertEqual(1, commands['crash']['count'])
+        self.assertEqual({'InventoryContext': 2}, context.metrics.snapshot()['unmatched'])
+
+    def test_errors_are_recorded(self):
+        context = InventoryContext()
+        context.metrics = Metrics()
+        with self.assertRaises(RuntimeError):
+            context.execute('crash')
+
+        command, = context.metrics.snapshot()['commands']
+        self.assertEqual('crash', command['command'])
+
+    def test_exit_is_not_an_error(self):
+        events = io.StringIO()
+        metrics = Metrics(sinks=[JsonLinesSink(events)])
+        for parse_cache in (False, True):
+            context = InventoryContext()
+            if parse_cache:
+                context.enable_parse_cache()
+            commander = Commander(
+                context, in_stream=io.StringIO('exit\n'), out_stream=io.StringIO(), metrics=metrics,
+            )
+            commander.mainloop()
+
+        command, = metrics.snapshot()['commands']
+        self.assertEqual('exit', command['command'])
+        self.assertEqual(2, command['count'])
+        self.assertEqual(
+            [None, None], [event['error'] for event in map(json.loads, events.getvalue().splitlines())
+                           if event['type'] == 'command']
+        )
+        self.assertIn({'type': 'exit', 'context': 'InventoryContext', 'count': 2}, metrics.snapshot()['context_events'])
+
+    def test_async_commands(self):
+        events = io.StringIO()
+        metrics = Metrics(sinks=[JsonLinesSink(events)])
+        commander = Commander(
+            InventoryContext(), in_stream=io.StringIO(), out_stream=io.StringIO(), metrics=metrics,
+        )
+        self.assertEqual(1, commander.run_script(['nap', 'nightmare']))
+
+        commands = [json.loads(line) for line in events.getvalue().splitlines()]
+        commands = {command['command']: command for command in commands if command['type'] == 'command'}
+        self.assertGreaterEqual(commands['nap']['duration'], 0.05)
+        self.assertIsNone(commands['nap']['error'])
+        self.assertEqual('RuntimeError', commands['nightmare']['error'])
+
+    def test_streamed_output(self):
+        events = io.StringIO()
+        context = InventoryContext()
+        context.set_out_stream(io.StringIO())
+        context.metrics = Metrics(sinks=[JsonLinesSink(events)])
+        with self.assertRaises(RuntimeError):
+            context.execute('lines')
+        context.execute('count')
+
+        lines, count = [json.loads(line) for line in events.getvalue().splitlines()]
+        self.assertEqual(('lines', 'RuntimeError'), (lines['command'], lines['error']))
+        self.assertGreaterEqual(lines['duration'], 0.05)
+        self.assertEqual(('count', None), (count['command'], count['error']))
+
+    def test_stats_command(self):
+        context = InventoryContext()
+        context.set_out_stream(io.StringIO())
+        context.execute('stats')
+        self.assertEqual('Metrics are disabled\n', context.out_stream.getvalue())
+
+        context.metrics = Metrics()
+        context.execute('count')
+        context.execute('stats')
+        self.assertIn('InventoryContext.InventoryContext.ExactLineHandler.count', context.out_stream.getvalue())
+
+        context.execute('stats reset')
+        # only the reset command itself is left
+        self.assertEqual(
+            ['stats_reset'], [command['command'] for command in context.metrics.snapshot()['commands']]
+        )
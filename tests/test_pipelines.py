@@ -0,0 +1,112 @@
+import asyncio
+import io
+from unittest import TestCase
+
+from pymander.contexts import PrebuiltCommandContext, StandardPrompt
+from pymander.decorators import bind_exact, bind_regex
+from pymander.handlers import LineHandler
+from pymander.pipelines import split_pipeline, iter_lines
+
+
+class CatalogContext(PrebuiltCommandContext, StandardPrompt):
+    pipelines = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.produced = 0
+        self.closed = False
+        self.colors_listed = False
+        self.set_out_stream(io.StringIO())
+
+    @bind_exact('items')
+    def items(self):
+        try:
+            for index in range(1000000):
+                self.produced += 1
+                yield 'item {0}\n'.format(index)
+        finally:
+            self.closed = True
+
+    @bind_exact('colors')
+    def colors(self):
+        self.colors_listed = True
+        self.write('red\ngreen\nblue\n')
+
+    @bind_exact('hello')
+    async def hello(self):
+        await asyncio.sleep(0)
+        self.write('hello\n')
+
+    @bind_regex(r'^upper$')
+    def upper(self):
+        lines = self.pipe_input
+        return (line.upper() for line in lines)
+
+
+class PipelineCase(TestCase):
+    def test_split(self):
+        self.assertEqual(['ls', 'grep "a|b"', 'head 5'], split_pipeline('ls | grep "a|b" | head 5\n'))
+        self.assertEqual(['echo a|b'], split_pipeline(r'echo a\|b'))
+        self.assertEqual(['ls', ''], split_pipeline('ls |'))
+        self.assertEqual(['a\n', 'bc\n', 'd'], list(iter_lines(iter(['a\nb', 'c\n', 'd']))))
+
+    def test_filters(self):
+        ctx = CatalogContext()
+        ctx.execute('colors | grep -v n\n')
+        ctx.execute('colors | grep -i "^R|^B" | upper\n')
+        ctx.execute('colors | tail 2 | wc -l\n')
+        self.assertEqual('red\nblue\nRED\nBLUE\n2\n', ctx.out_stream.getvalue())
+
+    def test_upstream_stops_early(self):
+        ctx = CatalogContext()
+        ctx.execute('items | grep 7 | head -n 3\n')
+        self.assertEqual('item 7\nitem 17\nitem 27\n', ctx.out_stream.getvalue())
+        self.assertEqual(28, ctx.produced)
+        self.assertTrue(ctx.closed)
+
+    def test_invalid_pipelines(self):
+        ctx = CatalogContext()
+        ctx.execute('colors | qwerty\n')
+        ctx.execute('colors |\n')
+        ctx.execute('head 3\n')
+        self.assertEqual(
+            'Invalid command: colors | qwerty\nInvalid command: colors |\n'
+            'Filters can only be used in a pipeline, e.g.: ls | grep txt\n',
+            ctx.out_stream.getvalue()
+        )
+        # stages are only executed once all of them are accepted
+        self.assertFalse(ctx.colors_listed)
+
+    def test_async_stages(self):
+        class AsyncLineHandler(LineHandler):
+            def try_execute(self, line):
+                return self.context.hello()
+
+        ctx = CatalogContext()
+        ctx.execute('hello | head 1\n')
+        ctx.execute('colors | hello\n')
+        self.assertEqual(
+            'Async commands can\'t be used in a pipeline: hello\nInvalid command: hello | head 1\n'
+            'Async commands can\'t be used in a pipeline: hello\nInvalid command: colors | hello\n',
+            ctx.out_stream.getvalue()
+        )
+        self.assertFalse(ctx.colors_listed)
+
+        ctx = CatalogContext([AsyncLineHandler()])
+        ctx.execute('greet | head 1\n')
+        self.assertEqual(
+            'Async commands can\'t be used in a pipeline: greet\nInvalid command: greet | head 1\n',
+            ctx.out_stream.getvalue()
+        )
+
+    def test_invalid_grep_pattern(self):
+        ctx = CatalogContext()
+        ctx.execute('items | grep (\n')
+        self.assertTrue(ctx.out_stream.getvalue().startswith('Invalid regular expression: '))
+        self.assertEqual(0, ctx.produced)
+
+    def test_disabled_by_default(self):
+        ctx = StandardPrompt()
+        ctx.set_out_stream(io.StringIO())
+        ctx.execute('echo a | b\n')
+        self.assertEqual('a | b\n', ctx.out_stream.getvalue())
@@ -0,0 +1,127 @@
+import asyncio
+import io
+import os
+import pstats
+import tempfile
+import time
+from unittest import TestCase
+
+from pymander.commander import Commander
+from pymander.contexts import StandardPrompt, PrebuiltCommandContext
+from pymander.decorators import bind_exact, bind_regex
+from pymander.profiling import ProfileLineHandler
+
+
+def sum_for_a_while():
+    return sum(range(10000))
+
+
+class ProfiledContext(PrebuiltCommandContext, StandardPrompt):
+    force_handlers = StandardPrompt.force_handlers + [ProfileLineHandler]
+
+    @bind_exact('spin')
+    def spin_for_a_while(self):
+        start = time.monotonic()
+        while time.monotonic() - start < 0.05:
+            sum(range(1000))
+        self.write('Done\n')
+
+    @bind_exact('nap')
+    async def take_a_nap(self):
+        await asyncio.sleep(0)
+        sum_for_a_while()
+        self.write('Awake\n')
+
+    @bind_regex(r'^say (?P<what>.*)$')
+    def say(self, what):
+        self.write('{0}\n'.format(what))
+
+
+class ProfileLineHandlerCase(TestCase):
+    def setUp(self):
+        self.context = ProfiledContext()
+        self.context.set_out_stream(io.StringIO())
+
+    def test_profile_line(self):
+        self.context.execute('profile --top 10 spin')
+        output = self.context.out_stream.getvalue()
+        self.assertTrue(output.startswith('Done\n'))
+        self.assertIn('spin_for_a_while', output)
+        self.assertIn('Ordered by: cumulative time', output)
+
+    def test_async_command(self):
+        # event loop setup can outweigh the command itself, show every function
+        self.context.execute('profile --top 1000 nap')
+        output = self.context.out_stream.getvalue()
+        self.assertTrue(output.startswith('Awake\n'))
+        self.assertIn('sum_for_a_while', output)
+
+        async def profile_in_loop():
+            self.context.execute('profile nap')
+
+        self.context.set_out_stream(io.StringIO())
+        asyncio.run(profile_in_loop())
+        self.assertTrue(
+            self.context.out_stream.getvalue().startswith('Async commands can\'t be profiled in a running event loop\n')
+        )
+
+    def test_whitespace_is_kept(self):
+        self.context.execute('profile --save {0} say a  "b   c"\n'.format(os.devnull))
+        self.assertTrue(self.context.out_stream.getvalue().startswith('a  "b   c"\n'))
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'spin.prof')
+            self.context.execute('profile --save {0} spin'.format(path))
+            stats = pstats.Stats(path)
+            self.assertTrue(any(function[2] == 'spin_for_a_while' for function in stats.stats))
+
+    def test_sampling(self):
+        self.context.execute('profile --sample 60 --interval 1')
+        self.assertIn('dispatch', self.context.__dict__)
+        self.context.execute('spin')
+        self.context.execute('profile --report')
+
+        output = self.context.out_stream.getvalue()
+        self.assertTrue(output.startswith('Sampling commands for 60 seconds\nDone\n'))
+        self.assertIn('spin_for_a_while', output)
+        self.assertNotIn('dispatch', self.context.__dict__)
+
+    def test_sampling_window_ends(self):
+        self.context.execute('profile --sample 0')
+        self.context.execute('echo hi')
+        self.assertNotIn('dispatch', self.context.__dict__)
+        self.context.execute('profile --report')
+        self.assertTrue(self.context.out_stream.getvalue().endswith('Not sampling\n'))
+
+    def test_sampling_window_ends_before_prompt(self):
+        self.context.execute('profile --sample 0.01 --interval 1')
+        time.sleep(0.05)
+        self.context.execute('spin')
+        self.assertEqual(self.context.out_stream.getvalue(),
+                         'Sampling commands for 0.01 seconds\nNo samples collected\nDone\n')
+
+        self.context.execute('profile --sample 0.01 --interval 1')
+        time.sleep(0.05)
+        self.context.report_jobs()
+        self.assertTrue(self.context.out_stream.getvalue().endswith('0.01 seconds\nNo samples collected\n'))
+        self.assertNotIn('report_jobs', self.context.__dict__)
+
+    def test_idle_sampling_window_reported_on_exit(self):
+        commander = Commander(self.context, in_stream=SlowStream(['profile --sample 0.01\n', '']),
+                              out_stream=io.StringIO())
+        commander.mainloop()
+        self.assertEqual(commander.out_stream.getvalue(),
+                         '>>> Sampling commands for 0.01 seconds\n>>> No samples collected\n')
+        self.assertNotIn('flush', self.context.__dict__)
+
+
+class SlowStream:
+    """Returns the lines given, taking a while to read every one of them."""
+    def __init__(self, lines, delay=0.05):
+        self.lines = iter(lines)
+        self.delay = delay
+
+    def readline(self):
+        time.sleep(self.delay)
+        return next(self.lines)
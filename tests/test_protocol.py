@@ -0,0 +1,90 @@
+import asyncio
+import io
+import json
+from unittest import TestCase
+
+from pymander.contexts import PrebuiltCommandContext, StandardPrompt
+from pymander.decorators import bind_argparse, bind_exact, bind_regex
+from pymander.protocol import MachineCommander
+
+
+class SaladContext(PrebuiltCommandContext, StandardPrompt):
+    @bind_argparse('buy', ['kind', ['--price', '-p', {'type': int, 'default': 3}]])
+    def buy(self, kind, price):
+        self.write('Buying {0} salad for {1}\n'.format(kind, price))
+        return price
+
+    @bind_regex(r'^eat (?P<what>\w+)(?P<now> now)?$')
+    def eat(self, what, now):
+        return {'ate': what, 'now': bool(now)}
+
+    @bind_exact('boom')
+    def boom(self):
+        raise KeyError('boom')
+
+    @bind_argparse('weigh', ['kind'])
+    async def weigh(self, kind):
+        await asyncio.sleep(0)
+        self.write('Weighing {0}\n'.format(kind))
+        return 250
+
+    @bind_exact('list')
+    def list_salads(self):
+        for name in ('greek', 'caesar'):
+            yield '{0}\n'.format(name)
+
+
+def run_requests(*requests):
+    in_stream = io.StringIO(''.join(
+        (request if isinstance(request, str) else json.dumps(request)) + '\n' for request in requests
+    ))
+    out_stream = io.StringIO()
+    MachineCommander(SaladContext(), in_stream=in_stream, out_stream=out_stream).mainloop()
+    responses = [json.loads(line) for line in out_stream.getvalue().splitlines()]
+    for response in responses:
+        response.pop('time')
+    return responses
+
+
+class MachineCommanderCase(TestCase):
+    def test_lines(self):
+        self.assertEqual([
+            {'id': 1, 'ok': True, 'output': 'Buying greek salad for 5\n', 'result': 5, 'error': None},
+            {'id': 2, 'ok': True, 'output': '', 'result': {'ate': 'pie', 'now': True}, 'error': None},
+            {'id': 3, 'ok': True, 'output': 'greek\ncaesar\n', 'result': None, 'error': None},
+        ], run_requests(
+            {'id': 1, 'line': 'buy greek -p 5'}, {'id': 2, 'line': 'eat pie now'}, {'id': 3, 'line': 'list'},
+        ))
+
+    def test_commands(self):
+        self.assertEqual([
+            {'id': 1, 'ok': True, 'output': 'Buying caesar salad for 3\n', 'result': 3, 'error': None},
+            {'id': 2, 'ok': True, 'output': '', 'result': {'ate': 'pie', 'now': False}, 'error': None},
+        ], run_requests(
+            {'id': 1, 'command': 'buy', 'kwargs': {'kind': 'caesar'}},
+            {'id': 2, 'command': 'eat', 'kwargs': {'what': 'pie'}},
+        ))
+
+    def test_async_commands(self):
+        self.assertEqual([
+            {'id': 1, 'ok': True, 'output': 'Weighing greek\n', 'result': 250, 'error': None},
+            {'id': 2, 'ok': True, 'output': 'Weighing caesar\n', 'result': 250, 'error': None},
+        ], run_requests({'id': 1, 'line': 'weigh greek'}, {'id': 2, 'command': 'weigh', 'kwargs': {'kind': 'caesar'}}))
+
+    def test_errors(self):
+        responses = run_requests(
+            {'id': 1, 'line': 'qwerty'}, {'id': 2, 'line': 'boom'}, {'id': 3, 'command': 'qwerty'}, 'garbage',
+            {'id': 5},
+        )
+        self.assertEqual([1, 2, 3, None, 5], [response['id'] for response in responses])
+        self.assertFalse(any(response['ok'] for response in responses))
+        self.assertEqual(
+            ['CantParseLine', 'KeyError', 'CantParseLine', 'JSONDecodeError', 'ValueError'],
+            [response['error']['type'] for response in responses]
+        )
+        self.assertEqual('Invalid command: qwerty', responses[0]['error']['message'])
+        self.assertEqual('No such command: qwerty', responses[2]['error']['message'])
+
+    def test_exit(self):
+        responses = run_requests({'id': 1, 'line': 'exit'}, {'id': 2, 'line': 'list'})
+        self.assertEqual([{'id': 1, 'ok': True, 'output': 'Bye!\n', 'result': None, 'error': None}], responses)
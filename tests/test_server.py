@@ -0,0 +1,73 @@
+import asyncio
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from pymander.contexts import StandardPrompt
+from pymander.server import CommanderServer
+
+
+class CommanderServerCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'test.sock')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp_dir.cleanup()
+
+    async def talk(self, lines):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        output = []
+        for line in lines:
+            output.append(await reader.readuntil(b'> '))
+            writer.write(line.encode())
+            await asyncio.sleep(0)
+
+        output.append(await reader.read())
+        writer.close()
+        return b''.join(output).decode()
+
+    async def serve_sessions(self, server, *sessions):
+        await server.start(path=self.path)
+        try:
+            return await asyncio.gather(*[self.talk(lines) for lines in sessions])
+        finally:
+            server.close()
+            await server.server.wait_closed()
+
+    def test_concurrent_sessions(self):
+        prototype = StandardPrompt(name='proto')
+        server = CommanderServer(prototype, max_sessions=2)
+        outputs = self.loop.run_until_complete(self.serve_sessions(
+            server,
+            ['echo 1\n', 'echo 2\n', 'exit\n'],
+            ['qwerty\n', 'exit\n'],
+            ['exit\n'],
+        ))
+
+        self.assertEqual([
+            'proto > 1\nproto > 2\nproto > Bye!\n',
+            'proto > Invalid command: qwerty\nproto > Bye!\n',
+            'proto > Bye!\n',
+        ], outputs)
+        self.assertEqual(0, server.session_count)
+        # sessions work with clones, the prototype is not used directly
+        self.assertIsNone(prototype.out_stream)
+
+    def test_run_in_executor(self):
+        server = CommanderServer(StandardPrompt(name='proto'), run_in_executor=True)
+        writes = []
+        original_write = asyncio.StreamWriter.write
+
+        def write(writer, data):
+            writes.append(threading.get_ident())
+            original_write(writer, data)
+
+        with mock.patch.object(asyncio.StreamWriter, 'write', write):
+            outputs = self.loop.run_until_complete(self.serve_sessions(server, ['echo 1\n', 'echo 2\n', 'exit\n']))
+
+        self.assertEqual(['proto > 1\nproto > 2\nproto > Bye!\n'], outputs)
+        self.assertEqual({threading.get_ident()}, set(writes))